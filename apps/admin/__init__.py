@@ -326,3 +326,4 @@ from . import email  # noqa: F401
 from . import hire  # noqa: F401
 from . import search  # noqa: F401
 from . import admin_message  # noqa: F401
+from . import profiles  # noqa: F401
@@ -1,7 +1,6 @@
 from . import admin
 import re
 
-from Levenshtein import ratio, jaro
 from flask import render_template, redirect, flash, url_for, current_app as app
 from flask_login import current_user
 from flask_mail import Message
@@ -52,6 +51,8 @@ def suppressed():
 
 
 def score_reconciliation(txn, payment):
+    from Levenshtein import ratio, jaro
+
     words = list(filter(None, re.split(r"\W+", txn.payee)))
 
     bankref_parts = [payment.bankref[:4], payment.bankref[4:]]
@@ -1,6 +1,4 @@
 from . import admin
-import markdown
-from inlinestyler.utils import inline_css
 from flask import render_template, redirect, flash, url_for, Markup
 from flask import current_app as app
 from flask_mail import Message
@@ -16,6 +14,9 @@ from ..common.forms import Form
 
 
 def format_html_email(markdown_text, subject):
+    import markdown
+    from inlinestyler.utils import inline_css
+
     extensions = ["markdown.extensions.nl2br", "markdown.extensions.smarty"]
     markdown_html = Markup(markdown.markdown(markdown_text, extensions=extensions))
     return inline_css(
@@ -18,9 +18,8 @@ from wtforms.validators import InputRequired
 from wtforms import SubmitField, BooleanField, FieldList, FormField
 
 from sqlalchemy.sql.functions import func
-import gocardless_pro.errors
 
-from main import db, mail, stripe, gocardless_client
+from main import db, mail, stripe, gocardless_pro, gocardless_client
 from models.payment import (
     Payment,
     RefundRequest,
@@ -0,0 +1,29 @@
+from flask import render_template, Response
+
+from models.request_profile import RequestProfile
+from . import admin
+
+
+@admin.route("/profiles")
+def profiles():
+    profiles = RequestProfile.query.order_by(RequestProfile.id.desc()).all()
+    return render_template("admin/profiles.html", profiles=profiles)
+
+
+@admin.route("/profiles/<int:profile_id>")
+def profile(profile_id):
+    profile = RequestProfile.query.get_or_404(profile_id)
+    return render_template("admin/profile.html", profile=profile)
+
+
+@admin.route("/profiles/<int:profile_id>.folded")
+def profile_folded(profile_id):
+    """ Collapsed stacks, for flamegraph.pl or https://www.speedscope.app """
+    profile = RequestProfile.query.get_or_404(profile_id)
+    return Response(
+        profile.to_folded(),
+        mimetype="text/plain",
+        headers={
+            "Content-Disposition": "attachment; filename=profile-%s.folded" % profile.id
+        },
+    )
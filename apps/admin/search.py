@@ -1,50 +1,115 @@
-from flask import request, redirect, url_for, render_template
-from models.user import User
-from models.payment import GoCardlessPayment, StripePayment, BankPayment
-from sqlalchemy import func
+import re
+
+import click
+from flask import request, redirect, url_for, render_template, current_app as app
+from sqlalchemy import func, literal
+
+from main import db
+from models.search import SearchEntry, SearchReference, rebuild_search_index
 from . import admin
 
+SEARCH_LIMIT = 100
+
+# Where each type of search result lives
+SEARCH_RESULT_URLS = {
+    "user": lambda r: url_for(".user", user_id=r.object_id),
+    "payment": lambda r: url_for(".payment", payment_id=r.object_id),
+    "purchase": lambda r: url_for(".user_tickets", user_id=r.user_id),
+    "proposal": lambda r: url_for(
+        "cfp_review.update_proposal", proposal_id=r.object_id
+    ),
+    "village": lambda r: url_for("villages.admin_village", village_id=r.object_id),
+    "bank_transaction": lambda r: url_for(
+        ".transaction_suggest_payments", txn_id=r.object_id
+    ),
+}
+
 
 def to_query(q):
-    return " & ".join(q.split(" "))
+    """ A tsquery matching words starting with each word in q """
+    words = re.findall(r"\w+", q.lower())
+    return " & ".join(w + ":*" for w in words)
+
+
+def search_entries(q, limit=SEARCH_LIMIT):
+    """ Search everything in one query, returning (entry, exact) pairs.
+
+        References which match q exactly come first, then ones which start
+        with it, then full-text matches, by rank.
+    """
+    reference = q.strip().lower()
+    references = (
+        db.session.query(
+            SearchReference.type,
+            SearchReference.object_id,
+            func.bool_or(SearchReference.reference == reference).label("exact"),
+        )
+        .filter(SearchReference.reference.startswith(reference, autoescape=True))
+        .group_by(SearchReference.type, SearchReference.object_id)
+        .subquery()
+    )
+
+    vector = func.to_tsvector("simple", SearchEntry.text)
+    tsquery = to_query(q)
+    if tsquery:
+        query = func.to_tsquery("simple", tsquery)
+        text_match = vector.op("@@")(query)
+        text_rank = func.ts_rank(vector, query)
+    else:
+        text_match = literal(False)
+        text_rank = literal(0)
+
+    exact = func.coalesce(references.c.exact, False)
+    return (
+        db.session.query(SearchEntry, exact)
+        .outerjoin(
+            references,
+            (references.c.type == SearchEntry.type)
+            & (references.c.object_id == SearchEntry.object_id),
+        )
+        .filter(references.c.object_id.isnot(None) | text_match)
+        .order_by(
+            exact.desc(),
+            references.c.object_id.is_(None),
+            text_rank.desc(),
+            SearchEntry.title,
+        )
+        .limit(limit)
+        .all()
+    )
 
 
 @admin.route("/search")
 def search():
     q = request.args["q"]
 
-    email_exact = User.query.filter(User.email == q).one_or_none()
-    if email_exact:
-        return redirect(url_for(".user", user_id=email_exact.id))
-
-    gc_exact = GoCardlessPayment.query.filter(
-        (GoCardlessPayment.gcid == q) | (GoCardlessPayment.mandate == q)
-    ).one_or_none()
-    if gc_exact:
-        return redirect(url_for(".payment", payment_id=gc_exact.id))
-
-    stripe_exact = StripePayment.query.filter(
-        (StripePayment.charge_id == q) | (StripePayment.intent_id == q)
-    ).one_or_none()
-    if stripe_exact:
-        return redirect(url_for(".payment", payment_id=stripe_exact.id))
-
-    bank_exact = BankPayment.query.filter(BankPayment.bankref == q).one_or_none()
-    if bank_exact:
-        return redirect(url_for(".payment", payment_id=bank_exact.id))
-
-    email_query = to_query(q.replace("@", " "))
-
-    # Careful with the following query. It'll stop using the indexes if you change the
-    # functions applied to the indexed columns. Which isn't really the end of the world given
-    # how small our dataset is, but I spent ages trying to work out how to get Alembic to add
-    # those indexes. So humour me.
-    results = User.query.filter(
-        func.to_tsvector("simple", User.name).match(to_query(q))
-        | (
-            func.to_tsvector("simple", func.replace(User.email, "@", " ")).match(
-                email_query
-            )
-        )
-    )
+    results = search_entries(q) if q.strip() else []
+    exact = [entry for entry, is_exact in results if is_exact]
+    if len(exact) == 1:
+        return redirect(SEARCH_RESULT_URLS[exact[0].type](exact[0]))
+
+    results = [(entry, SEARCH_RESULT_URLS[entry.type](entry)) for entry, _ in results]
     return render_template("admin/search-results.html", q=q, results=results)
+
+
+@admin.cli.command("rebuild_search_index")
+def rebuild_search_index_command():
+    """ Recreate the admin search entries from scratch """
+    count = rebuild_search_index()
+    db.session.commit()
+    app.logger.info("Indexed %s objects for search", count)
+
+
+@admin.cli.command("search_benchmark")
+@click.option("--users", type=int, default=50000, help="Number of fake users")
+@click.option("--queries", type=int, default=200, help="Number of searches")
+@click.option("--seed", type=int, default=0, help="Random seed")
+def search_benchmark(users, queries, seed):
+    """ Time admin searches with fake users added, then roll them back """
+    from .search_benchmark import run_benchmark
+
+    try:
+        result = run_benchmark(users, queries, seed)
+    finally:
+        db.session.rollback()
+    app.logger.info("Benchmark results: %s", result)
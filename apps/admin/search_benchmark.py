@@ -0,0 +1,97 @@
+""" Synthetic search entries for benchmarking the admin search.
+
+    Run `flask admin search_benchmark` against a copy of production. Entries
+    are inserted in the current transaction, which the command rolls back.
+"""
+import random
+from datetime import datetime
+from time import perf_counter
+
+from faker import Faker
+
+from main import db
+from models.search import SearchEntry, SearchReference
+from ..arrivals.search_benchmark import percentile
+from .search import search_entries
+
+# Well above any real user id, so fake entries don't clash with real ones
+FAKE_ID_OFFSET = 10 ** 8
+
+
+def generate_users(count, seed=0):
+    faker = Faker()
+    faker.seed_instance(seed)
+    return [
+        (
+            FAKE_ID_OFFSET + i,
+            faker.name(),
+            "{}.{}@{}".format(i, faker.user_name(), faker.free_email_domain()),
+        )
+        for i in range(count)
+    ]
+
+
+def insert_users(users, chunk_size=5000):
+    connection = db.session.connection()
+    for i in range(0, len(users), chunk_size):
+        chunk = users[i : i + chunk_size]
+        connection.execute(
+            SearchEntry.__table__.insert(),
+            [
+                {
+                    "type": "user",
+                    "object_id": id,
+                    "user_id": id,
+                    "title": name,
+                    "detail": email,
+                    "text": "%s %s" % (name, email.replace("@", " ")),
+                }
+                for id, name, email in chunk
+            ],
+        )
+        connection.execute(
+            SearchReference.__table__.insert(),
+            [
+                {"type": "user", "object_id": id, "reference": email.lower()}
+                for id, _, email in chunk
+            ],
+        )
+
+
+def generate_queries(users, count, rng):
+    """ Full emails, names, and the first few letters of surnames """
+    queries = []
+    for _ in range(count):
+        _, name, email = rng.choice(users)
+        queries.append(
+            rng.choice([email, name, name.split()[-1][:3], email.split("@")[0]])
+        )
+    return queries
+
+
+def run_benchmark(user_count=50000, query_count=200, seed=0):
+    """ Time searches, in milliseconds. The caller should roll back. """
+    users = generate_users(user_count, seed)
+
+    start = perf_counter()
+    insert_users(users)
+    db.session.execute("ANALYZE search_entry")
+    db.session.execute("ANALYZE search_reference")
+    insert_ms = (perf_counter() - start) * 1000
+
+    times = []
+    for query in generate_queries(users, query_count, random.Random(seed)):
+        start = perf_counter()
+        search_entries(query)
+        times.append((perf_counter() - start) * 1000)
+
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "users": user_count,
+        "queries": query_count,
+        "seed": seed,
+        "insert_ms": insert_ms,
+        "p50_ms": percentile(times, 50),
+        "p99_ms": percentile(times, 99),
+        "max_ms": max(times),
+    }
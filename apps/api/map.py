@@ -3,8 +3,6 @@ from flask import request, abort, redirect
 from flask_login import current_user
 from flask_restful import Resource
 from models.map import MapObject
-from geoalchemy2.shape import to_shape
-import shapely.geometry
 
 from main import db
 
@@ -12,6 +10,9 @@ from . import api
 
 
 def render_feature(obj):
+    from geoalchemy2.shape import to_shape
+    import shapely.geometry
+
     return {
         "id": api.url_for(MapObjectResource, obj_id=obj.id),
         "type": "Feature",
@@ -1,5 +1,4 @@
 import re
-from collections import OrderedDict
 
 from flask import (
     render_template,
@@ -14,12 +13,17 @@ from flask import (
     Markup,
     render_template_string,
 )
+from dateutil.parser import parse
+from decorator import decorator
 from sqlalchemy import func
 
-from main import db
+from main import db, csrf
 from models.purchase import Purchase, AdmissionTicket, CheckinStateException
 from models.user import User, checkin_code_re
-from .common import require_permission, json_response
+from ..common import require_permission, json_response
+from .replica import get_gate_replica
+from .search_index import arrivals_search
+from .sync import export_snapshot, apply_sync_event
 
 arrivals = Blueprint("arrivals", __name__)
 
@@ -28,6 +32,20 @@ arrivals_required = require_permission(
 )  # Decorator to require arrivals permission
 
 
+@decorator
+def arrivals_token_required(f, *args, **kwargs):
+    """ For offline gates, which authenticate with an API token """
+    auth = request.headers.get("Authorization", "")
+    if not auth.startswith("Bearer "):
+        abort(401)
+
+    user = User.get_by_api_token(app.config.get("SECRET_KEY"), auth[len("Bearer ") :])
+    if not user or not user.has_permission("arrivals"):
+        abort(403)
+
+    return f(*args, **kwargs)
+
+
 @arrivals.route("")
 @arrivals_required
 def main():
@@ -57,11 +75,18 @@ def checkin_qrcode(code):
     if not match:
         abort(404)
 
+    replica = get_gate_replica()
+    if replica:
+        user = replica.user_from_code(code)
+        if user is None:
+            abort(404)
+        return redirect(url_for(".checkin", user_id=user["id"], source="code"))
+
     user = User.get_by_checkin_code(app.config.get("SECRET_KEY"), code)
     return redirect(url_for(".checkin", user_id=user.id, source="code"))
 
 
-def user_from_code(query):
+def code_from_query(query):
     if not query:
         return None
 
@@ -76,53 +101,22 @@ def user_from_code(query):
     if not match:
         return None
 
-    code = match.group(1)
-    user = User.get_by_checkin_code(app.config.get("SECRET_KEY"), code)
-    return user
-
-
-def users_from_query(query):
-    names = User.query.order_by(User.name)
-    emails = User.query.order_by(User.email)
-
-    def escape(like):
-        return like.replace("^", "^^").replace("%", "^%")
+    return match.group(1)
 
-    def name_match(pattern, query):
-        return (
-            names.filter(User.name.ilike(pattern.format(query), escape="^"))
-            .limit(10)
-            .all()
-        )
-
-    def email_match(pattern, query):
-        return (
-            emails.filter(User.email.ilike(pattern.format(query), escape="^"))
-            .limit(10)
-            .all()
-        )
 
-    fulls = []
-    starts = []
-    contains = []
-    query = query.lower()
-    words = list(map(escape, filter(None, query.split(" "))))
-
-    if " " in query:
-        fulls += name_match("%{0}%", "%".join(words))
-        fulls += email_match("%{0}%", "%".join(words))
+def user_from_code(query):
+    code = code_from_query(query)
+    if not code:
+        return None
 
-    for word in words:
-        starts += name_match("{0}%", word)
-        contains += name_match("%{0}%", word)
+    user = User.get_by_checkin_code(app.config.get("SECRET_KEY"), code)
+    return user
 
-    for word in words:
-        starts += email_match("{0}%", word)
-        contains += email_match("%{0}%", word)
 
-    # make unique, but keep in order
-    users = list(OrderedDict.fromkeys(fulls + starts + contains))[:10]
-    return users
+def users_from_query(query):
+    user_ids = arrivals_search.search(query)
+    users = User.query.filter(User.id.in_(user_ids))
+    return sorted(users, key=lambda u: user_ids.index(u.id))
 
 
 @arrivals.route("/search", methods=["GET", "POST"])
@@ -141,12 +135,17 @@ def search(query=None):
 
     data = {}
     if request.form.get("n"):
-        # To serialise requests as they may go slow for certain query strings
+        # So the client can ignore responses to earlier keystrokes
         data["n"] = int(request.form.get("n"))
 
     query = query.strip()
     badge = bool(session.get("badge"))
 
+    replica = get_gate_replica()
+    if replica:
+        data.update(search_replica(replica, query, badge))
+        return data
+
     user = user_from_code(query)
 
     if user:
@@ -180,7 +179,7 @@ def search(query=None):
     completes = dict(completes)
 
     user_data = []
-    for u in users:
+    for u in users_ordered:
         user = {
             "id": u.id,
             "name": u.name,
@@ -196,16 +195,143 @@ def search(query=None):
     return data
 
 
+def search_replica(replica, query, badge):
+    code = code_from_query(query)
+    if code:
+        user = replica.user_from_code(code)
+        if user:
+            return {"location": url_for(".checkin", user_id=user["id"], source="code")}
+
+    field = "badge_issued" if badge else "checked_in"
+    user_data = []
+    for u in replica.search(query):
+        tickets = [t for t in replica.get_tickets(u["id"]) if t["paid"]]
+        user_data.append(
+            {
+                "id": u["id"],
+                "name": u["name"],
+                "email": u["email"],
+                "tickets": len(tickets),
+                "completes": len([t for t in tickets if t[field]]),
+                "url": url_for(".checkin", user_id=u["id"], source="typed"),
+            }
+        )
+
+    return {"users": user_data}
+
+
+def get_replica_tickets(replica, user_id, badge):
+    tickets = [t for t in replica.get_tickets(user_id) if t["paid"]]
+    if badge:
+        # Ticket must be checked in to receive a badge
+        return [t for t in tickets if t["checked_in"] and t["has_badge"]]
+    return tickets
+
+
+def replica_checkin(replica, user_id, source, badge):
+    user = replica.users.get(user_id)
+    if user is None:
+        abort(404)
+
+    tickets = sorted(
+        get_replica_tickets(replica, user_id, badge), key=lambda t: t["id"]
+    )
+
+    if request.method == "POST":
+        action = "badge_up" if badge else "check_in"
+        failed = []
+        for t in tickets:
+            # Only allow bulk completion, not undoing
+            try:
+                replica.record(t["id"], action)
+            except CheckinStateException:
+                failed.append(t)
+
+        success_count = len(tickets) - len(failed)
+        if failed:
+            failed_str = ", ".join(str(t["id"]) for t in failed)
+            if badge:
+                flash(
+                    "Issued %s badges. Already issued: %s" % (success_count, failed_str)
+                )
+            else:
+                flash(
+                    "Checked in %s tickets. Already checked in: %s"
+                    % (success_count, failed_str)
+                )
+            return redirect(url_for(".checkin", user_id=user_id))
+
+        if badge:
+            flash("Issued %s badges." % success_count)
+        else:
+            flash("Checked in %s tickets." % success_count)
+        return redirect(url_for(".main"))
+
+    return render_template(
+        "arrivals/checkin-replica.html",
+        user=user,
+        tickets=tickets,
+        badge=badge,
+        source=source,
+        pending=len(replica.pending),
+    )
+
+
+def replica_ticket_checkin(replica, ticket_id, badge, undo=False):
+    ticket = replica.tickets.get(int(ticket_id)) if ticket_id.isdigit() else None
+    if ticket is None or not ticket["paid"]:
+        abort(404)
+
+    action = "badge_up" if badge else "check_in"
+    if undo:
+        action = "undo_" + action
+
+    try:
+        replica.record(ticket["id"], action)
+    except CheckinStateException as e:
+        flash(str(e))
+
+    return redirect(url_for(".checkin", user_id=ticket["owner_id"]))
+
+
+@arrivals.route("/snapshot")
+@json_response
+@arrivals_token_required
+def snapshot():
+    since = request.args.get("since")
+    return export_snapshot(parse(since) if since else None)
+
+
+@csrf.exempt
+@arrivals.route("/sync", methods=["POST"])
+@json_response
+@arrivals_token_required
+def sync():
+    events = request.get_json()["events"]
+    results = [apply_sync_event(event) for event in events]
+    db.session.commit()
+
+    conflicts = [r for r in results if r["result"] != "ok"]
+    app.logger.info(
+        "Synced %s check-ins from gate, %s not applied", len(results), len(conflicts)
+    )
+    return {"results": results}
+
+
 @arrivals.route("/checkin/<int:user_id>", methods=["GET", "POST"])
 @arrivals.route("/checkin/<int:user_id>/<source>", methods=["GET", "POST"])
 @arrivals_required
 def checkin(user_id, source=None):
     badge = bool(session.get("badge"))
-    user = User.query.get_or_404(user_id)
-
     if source not in {None, "typed", "transfer", "code"}:
         abort(404)
 
+    replica = get_gate_replica()
+    if replica:
+        return replica_checkin(replica, user_id, source, badge)
+
+    user = User.query.get_or_404(user_id)
+
     if badge:
         # Ticket must be checked in to receive a badge
         tickets = [
@@ -274,6 +400,10 @@ def checkin(user_id, source=None):
 @arrivals_required
 def ticket_checkin(ticket_id):
     badge = bool(session.get("badge"))
+    replica = get_gate_replica()
+    if replica:
+        return replica_ticket_checkin(replica, ticket_id, badge)
+
     ticket = Purchase.query.get_or_404(ticket_id)
     if not ticket.is_paid_for:
         abort(404)
@@ -295,6 +425,10 @@ def ticket_checkin(ticket_id):
 @arrivals_required
 def undo_ticket_checkin(ticket_id):
     badge = bool(session.get("badge"))
+    replica = get_gate_replica()
+    if replica:
+        return replica_ticket_checkin(replica, ticket_id, badge, undo=True)
+
     ticket = Purchase.query.get_or_404(ticket_id)
     if not ticket.is_paid_for:
         abort(404)
@@ -310,3 +444,6 @@ def undo_ticket_checkin(ticket_id):
     db.session.commit()
 
     return redirect(url_for(".checkin", user_id=ticket.owner.id))
+
+
+from . import tasks  # noqa
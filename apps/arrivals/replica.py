@@ -0,0 +1,295 @@
+""" The local store for an offline arrivals gate.
+
+    A replica is a directory holding the latest snapshot from upstream, with
+    deltas merged in, and an append-only queue of check-ins made at this
+    gate. Check-ins update the in-memory state and are written to the queue
+    before returning, so nothing is lost if the laptop dies, and are
+    replayed upstream by sync(). None of this needs a database.
+
+    If ARRIVALS_REPLICA_PATH is set, the gate's search and check-in pages
+    use the replica rather than the database, and a background thread syncs
+    it with ARRIVALS_UPSTREAM every ARRIVALS_SYNC_SECONDS. This should be run
+    in a single process, as each process has its own copy of the replica.
+"""
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from threading import RLock, Lock, Thread
+from uuid import uuid4
+
+import requests
+from flask import current_app as app
+
+from models.purchase import CheckinStateException, CHECKIN_ACTIONS
+from .search_index import AttendeeIndex
+from .sync import verify_snapshot
+
+# What each action does to a ticket: (field, new value, error if it's already set)
+ACTION_CHANGES = {
+    "check_in": ("checked_in", True, "Ticket is already checked in."),
+    "undo_check_in": ("checked_in", False, "Ticket is not checked in."),
+    "badge_up": ("badge_issued", True, "Ticket is already badged up."),
+    "undo_badge_up": ("badge_issued", False, "Ticket is not badged up."),
+}
+SYNC_SECONDS = 30
+
+log = logging.getLogger(__name__)
+
+
+class ArrivalsReplica(object):
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        # Held while the state is changing, but not during requests upstream
+        self.lock = RLock()
+        self.generated = None
+        self.users = {}
+        self.tickets = {}
+        self.codes = {}
+        self.index = AttendeeIndex()
+        # Events which haven't been acknowledged upstream, by id
+        self.pending = {}
+        # Results of events which have, e.g. conflicts
+        self.results = {}
+
+    @property
+    def snapshot_file(self):
+        return os.path.join(self.path, "snapshot.json")
+
+    @property
+    def queue_file(self):
+        return os.path.join(self.path, "queue.jsonl")
+
+    @property
+    def results_file(self):
+        return os.path.join(self.path, "results.jsonl")
+
+    def load(self):
+        """ Load the saved snapshot and replay any queued check-ins """
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file) as f:
+                self.merge(json.load(f))
+
+        for result in read_jsonl(self.results_file):
+            self.results[result["id"]] = result
+
+        for event in read_jsonl(self.queue_file):
+            if event["id"] not in self.results:
+                self.pending[event["id"]] = event
+        self.reapply_pending()
+
+    def save(self):
+        data = {
+            "generated": self.generated,
+            "users": list(self.users.values()),
+            "tickets": list(self.tickets.values()),
+        }
+        tmp_file = self.snapshot_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.snapshot_file)
+
+    def load_snapshot(self, snapshot):
+        """ Merge a signed full or delta snapshot from upstream, and save it.
+
+            Check-ins which haven't been synced yet are applied again on top.
+        """
+        data = verify_snapshot(snapshot, self.key)
+        with self.lock:
+            if data["since"] is None:
+                self.users, self.tickets, self.codes = {}, {}, {}
+                self.index = AttendeeIndex()
+
+            self.merge(data)
+            self.save()
+            self.reapply_pending()
+
+    def reapply_pending(self):
+        """ Deltas from upstream don't include our check-ins yet """
+        for event in self.pending.values():
+            try:
+                self.apply(event)
+            except CheckinStateException:
+                # e.g. also checked in at another gate, which sync will report
+                pass
+
+    def merge(self, data):
+        self.generated = data["generated"]
+        for user in data["users"]:
+            self.users[user["id"]] = user
+            self.codes[user["checkin_code"]] = user["id"]
+
+        for ticket in data["tickets"]:
+            self.tickets[ticket["id"]] = ticket
+
+        # Only ticket holders are searchable, as upstream
+        holders = {t["owner_id"] for t in self.tickets.values() if t["paid"]}
+        for user in data["users"]:
+            if user["id"] in holders:
+                self.index.add(user["id"], user["name"], user["email"])
+
+        # Including anyone whose tickets have been refunded or transferred
+        for user_id in set(self.index.attendees) - holders:
+            self.index.remove(user_id)
+
+    def search(self, query):
+        with self.lock:
+            return [self.users[id] for id in self.index.search(query)]
+
+    def user_from_code(self, code):
+        with self.lock:
+            user_id = self.codes.get(code)
+            return self.users.get(user_id)
+
+    def get_tickets(self, user_id):
+        with self.lock:
+            return [dict(t) for t in self.tickets.values() if t["owner_id"] == user_id]
+
+    def apply(self, event):
+        ticket = self.tickets.get(event["ticket_id"])
+        if ticket is None:
+            raise CheckinStateException("Unknown ticket %s" % event["ticket_id"])
+
+        field, value, error = ACTION_CHANGES[event["action"]]
+        if value and not ticket["paid"]:
+            raise CheckinStateException("Ticket hasn't been paid for.")
+        if ticket[field] == value:
+            raise CheckinStateException(error)
+        ticket[field] = value
+
+    def record(self, ticket_id, action):
+        """ Check in or badge up a ticket locally, and queue it for upstream """
+        if action not in CHECKIN_ACTIONS:
+            raise ValueError("Unknown action %s" % action)
+
+        event = {
+            "id": str(uuid4()),
+            "ticket_id": ticket_id,
+            "action": action,
+            "occurred": datetime.utcnow().isoformat(),
+        }
+        with self.lock:
+            self.apply(event)
+
+            append_jsonl(self.queue_file, [event])
+            self.pending[event["id"]] = event
+        return event
+
+    def acknowledge(self, results):
+        """ Record results from the upstream sync endpoint.
+
+            Returns the conflicts, which need looking at by a human. The
+            next delta will bring the tickets back in line with upstream.
+        """
+        with self.lock:
+            append_jsonl(self.results_file, results)
+            for result in results:
+                self.results[result["id"]] = result
+                self.pending.pop(result["id"], None)
+            self.save()
+
+        return [r for r in results if r["result"] != "ok"]
+
+    def sync(self, upstream, token, timeout=30):
+        """ Send queued check-ins upstream, then fetch changes since our
+            snapshot, or a full snapshot if we don't have one.
+
+            upstream is the arrivals URL, e.g. https://www.emfcamp.org/arrivals,
+            and token is the API token of a user with arrivals permission.
+            Returns any conflicts.
+        """
+        headers = {"Authorization": "Bearer " + token}
+        conflicts = []
+        with self.lock:
+            pending = list(self.pending.values())
+            generated = self.generated
+
+        if pending:
+            response = requests.post(
+                upstream + "/sync",
+                json={"events": pending},
+                headers=headers,
+                timeout=timeout,
+            )
+            response.raise_for_status()
+            conflicts = self.acknowledge(response.json()["results"])
+
+        params = {"since": generated} if generated else {}
+        response = requests.get(
+            upstream + "/snapshot", params=params, headers=headers, timeout=timeout
+        )
+        response.raise_for_status()
+        self.load_snapshot(response.json())
+
+        return conflicts
+
+
+def sync_in_background(replica, upstream, token, interval):
+    while True:
+        try:
+            conflicts = replica.sync(upstream, token)
+            for conflict in conflicts:
+                log.warning(
+                    "Ticket %s: %s (%s)",
+                    conflict["ticket_id"],
+                    conflict["message"],
+                    conflict["result"],
+                )
+        except Exception as e:
+            # Most likely we're offline, so carry on and try again later
+            log.warning("Error syncing arrivals replica: %r", e)
+        time.sleep(interval)
+
+
+_gate_replica = None
+_gate_replica_lock = Lock()
+
+
+def get_gate_replica():
+    """ The replica for this gate, or None if it uses the database """
+    global _gate_replica
+
+    path = app.config.get("ARRIVALS_REPLICA_PATH")
+    if not path:
+        return None
+
+    with _gate_replica_lock:
+        if _gate_replica is None or _gate_replica.path != path:
+            _gate_replica = ArrivalsReplica(path, app.config["SECRET_KEY"])
+            _gate_replica.load()
+
+            upstream = app.config.get("ARRIVALS_UPSTREAM")
+            if upstream:
+                thread = Thread(
+                    target=sync_in_background,
+                    args=(
+                        _gate_replica,
+                        upstream.rstrip("/"),
+                        app.config["ARRIVALS_UPSTREAM_TOKEN"],
+                        app.config.get("ARRIVALS_SYNC_SECONDS", SYNC_SECONDS),
+                    ),
+                    daemon=True,
+                )
+                thread.start()
+
+    return _gate_replica
+
+
+def read_jsonl(filename):
+    if not os.path.exists(filename):
+        return []
+
+    with open(filename) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_jsonl(filename, items):
+    with open(filename, "a") as f:
+        for item in items:
+            f.write(json.dumps(item) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
@@ -0,0 +1,69 @@
+""" Synthetic attendees for benchmarking the arrivals search.
+
+    Run `flask arrivals search_benchmark --output results.jsonl` to check
+    search stays fast enough for gate volunteers typing at peak times.
+"""
+import random
+from datetime import datetime
+from time import perf_counter
+
+from faker import Faker
+
+from .search_index import AttendeeIndex
+
+
+def generate_attendees(count=3000, seed=0):
+    faker = Faker()
+    faker.seed_instance(seed)
+    return [
+        (
+            id,
+            faker.name(),
+            "{}.{}@{}".format(id, faker.user_name(), faker.free_email_domain()),
+        )
+        for id in range(1, count + 1)
+    ]
+
+
+def generate_queries(attendees, count, rng):
+    """ Queries as they're typed: growing prefixes of names and emails """
+    queries = []
+    while len(queries) < count:
+        _, name, email = rng.choice(attendees)
+        text = rng.choice([name, name.split()[-1], email])
+        queries.extend(text[:i] for i in range(1, len(text) + 1))
+    return queries[:count]
+
+
+def percentile(times, p):
+    times = sorted(times)
+    return times[min(len(times) - 1, int(len(times) * p / 100))]
+
+
+def run_benchmark(attendee_count=3000, query_count=2000, seed=0):
+    """ Time building the index and searching it, in milliseconds """
+    attendees = generate_attendees(attendee_count, seed)
+    queries = generate_queries(attendees, query_count, random.Random(seed))
+
+    start = perf_counter()
+    index = AttendeeIndex()
+    for attendee in attendees:
+        index.add(*attendee)
+    build_ms = (perf_counter() - start) * 1000
+
+    times = []
+    for query in queries:
+        start = perf_counter()
+        index.search(query)
+        times.append((perf_counter() - start) * 1000)
+
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "attendees": attendee_count,
+        "queries": len(queries),
+        "seed": seed,
+        "build_ms": build_ms,
+        "p50_ms": percentile(times, 50),
+        "p99_ms": percentile(times, 99),
+        "max_ms": max(times),
+    }
@@ -0,0 +1,228 @@
+""" An in-memory index of ticket holders for the arrivals search.
+
+    Gate volunteers search on every keystroke, and the old search ran up to
+    2 + 4 × (words) ILIKE queries for each one. Instead, each process keeps
+    an index of ticket holders' names and emails. Searches rank full,
+    prefix and substring matches from the index without touching the
+    database, stopping as soon as they have enough results.
+
+    The index picks up changed purchases every REFRESH_SECONDS, and is
+    rebuilt every REBUILD_SECONDS to catch renamed users.
+"""
+import heapq
+from datetime import datetime, timedelta
+from threading import Lock
+
+from main import db
+from models.purchase import Purchase
+from models.user import User
+
+SEARCH_LIMIT = 10
+REFRESH_SECONDS = 10
+REBUILD_SECONDS = 600
+
+NAME, EMAIL = FIELDS = range(2)
+EMPTY = frozenset()
+
+
+def get_ngrams(text, n):
+    return {text[i : i + n] for i in range(len(text) - n + 1)}
+
+
+def get_grams(text):
+    """ All substrings of up to three characters """
+    return get_ngrams(text, 1) | get_ngrams(text, 2) | get_ngrams(text, 3)
+
+
+def get_prefixes(text):
+    return {text[:n] for n in range(1, min(len(text), 3) + 1)}
+
+
+def contains_in_order(text, words):
+    pos = 0
+    for word in words:
+        pos = text.find(word, pos)
+        if pos < 0:
+            return False
+        pos += len(word)
+    return True
+
+
+class AttendeeIndex(object):
+    """ Ticket holders' names and emails, indexed by the substrings and
+        prefixes of up to three characters of each.
+
+        Longer words are looked up by intersecting their trigrams, and
+        checked against the candidates that contain all of them.
+    """
+
+    def __init__(self):
+        # id -> (name, email), lowercased
+        self.attendees = {}
+        # For each field, gram -> set of ids
+        self.grams = [{} for _ in FIELDS]
+        self.prefixes = [{} for _ in FIELDS]
+
+    def __len__(self):
+        return len(self.attendees)
+
+    def add(self, id, name, email):
+        if id in self.attendees:
+            self.remove(id)
+
+        values = self.attendees[id] = ((name or "").lower(), (email or "").lower())
+        for field, value in zip(FIELDS, values):
+            for gram in get_grams(value):
+                self.grams[field].setdefault(gram, set()).add(id)
+            for prefix in get_prefixes(value):
+                self.prefixes[field].setdefault(prefix, set()).add(id)
+
+    def remove(self, id):
+        values = self.attendees.pop(id)
+        for field, value in zip(FIELDS, values):
+            for index, keys in [
+                (self.grams[field], get_grams(value)),
+                (self.prefixes[field], get_prefixes(value)),
+            ]:
+                for key in keys:
+                    index[key].discard(id)
+                    if not index[key]:
+                        del index[key]
+
+    def containing(self, field, word):
+        if len(word) <= 3:
+            return self.grams[field].get(word, EMPTY)
+
+        postings = sorted(
+            (self.grams[field].get(t, EMPTY) for t in get_ngrams(word, 3)), key=len
+        )
+        return {
+            id
+            for id in postings[0].intersection(*postings[1:])
+            if word in self.attendees[id][field]
+        }
+
+    def starting(self, field, word):
+        ids = self.prefixes[field].get(word[:3], EMPTY)
+        if len(word) <= 3:
+            return ids
+        return {id for id in ids if self.attendees[id][field].startswith(word)}
+
+    def get_tiers(self, words):
+        """ Sets of ids matching words, best first.
+
+            Attendees whose name or email contains all the words in order
+            come first, then those where one starts with any word, then
+            those where one contains any word. Name matches come before
+            email matches.
+        """
+        if len(words) > 1:
+            for field in FIELDS:
+                postings = sorted((self.containing(field, w) for w in words), key=len)
+                yield {
+                    id
+                    for id in postings[0].intersection(*postings[1:])
+                    if contains_in_order(self.attendees[id][field], words)
+                }
+
+        for field in FIELDS:
+            yield set().union(*(self.starting(field, w) for w in words))
+
+        for field in FIELDS:
+            yield set().union(*(self.containing(field, w) for w in words))
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """ Attendee ids matching query, best first, then by name.
+
+            Tiers are only worked out until there are enough results, so
+            the common case of typing the start of a name is quick.
+        """
+        words = query.lower().split()
+        if not words:
+            return []
+
+        results = []
+        seen = set()
+        for tier in self.get_tiers(words):
+            tier = tier - seen
+            seen |= tier
+            results += heapq.nsmallest(
+                limit - len(results), tier, key=lambda id: (self.attendees[id], id)
+            )
+            if len(results) >= limit:
+                break
+
+        return results
+
+
+def get_ticket_holders(user_ids=None):
+    """ (id, name, email) for users with paid purchases """
+    query = (
+        db.session.query(User.id, User.name, User.email)
+        .join(Purchase, Purchase.owner_id == User.id)
+        .filter(Purchase.is_paid_for == True)  # noqa: E712
+        .distinct()
+    )
+    if user_ids is not None:
+        query = query.filter(User.id.in_(user_ids))
+    return query.all()
+
+
+class ArrivalsSearch(object):
+    """ Keeps an AttendeeIndex up to date with the database """
+
+    def __init__(self):
+        self.index = None
+        self.lock = Lock()
+        self.built = None
+        self.refreshed = None
+
+    def rebuild(self):
+        now = datetime.utcnow()
+        index = AttendeeIndex()
+        for id, name, email in get_ticket_holders():
+            index.add(id, name, email)
+
+        self.index = index
+        self.built = self.refreshed = now
+
+    def refresh(self):
+        """ Re-index the owners of purchases changed since the last refresh """
+        now = datetime.utcnow()
+        # Overlap with the last refresh, in case a transaction was committed
+        # after it started but before we looked
+        since = self.refreshed - timedelta(seconds=REFRESH_SECONDS)
+        changed_ids = {
+            owner_id
+            for owner_id, in db.session.query(Purchase.owner_id)
+            .filter(Purchase.modified >= since, Purchase.owner_id.isnot(None))
+            .distinct()
+        }
+
+        if changed_ids:
+            holders = {
+                id: (name, email) for id, name, email in get_ticket_holders(changed_ids)
+            }
+            for id in changed_ids:
+                if id in holders:
+                    self.index.add(id, *holders[id])
+                elif id in self.index.attendees:
+                    self.index.remove(id)
+
+        self.refreshed = now
+
+    def update(self):
+        now = datetime.utcnow()
+        if self.built is None or now - self.built > timedelta(seconds=REBUILD_SECONDS):
+            self.rebuild()
+        elif now - self.refreshed > timedelta(seconds=REFRESH_SECONDS):
+            self.refresh()
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        # Searches are quick, so don't let them see a half-updated index
+        with self.lock:
+            self.update()
+            return self.index.search(query, limit)
+
+
+arrivals_search = ArrivalsSearch()
@@ -0,0 +1,167 @@
+""" Snapshots and check-in sync for offline arrivals gates.
+
+    The gate downloads a signed snapshot of ticket holders, their check-in
+    codes and their tickets' states, then keeps it up to date with deltas of
+    tickets modified since its last snapshot. Check-ins at the gate are
+    recorded locally (see replica.py) and replayed here as events with ids
+    generated at the gate, so replays are idempotent. If an event can't be
+    applied, e.g. the ticket was checked in at another gate, it's recorded
+    as a conflict and reported back.
+"""
+import hashlib
+import hmac
+import json
+from datetime import datetime, timedelta
+
+from dateutil.parser import parse
+from flask import current_app as app
+from sqlalchemy.orm import joinedload
+
+from main import db
+from models.purchase import (
+    Purchase,
+    AdmissionTicket,
+    CheckinSyncEvent,
+    CheckinStateException,
+    CHECKIN_ACTIONS,
+)
+
+SNAPSHOT_VERSION = 1
+# Deltas overlap, to catch tickets changed in transactions which were still
+# open when the last snapshot was generated
+SNAPSHOT_OVERLAP = timedelta(minutes=1)
+
+
+class SnapshotSignatureException(Exception):
+    pass
+
+
+def get_snapshot_signature(data, key):
+    msg = json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    mac = hmac.new(b"arrivals-snapshot-" + key.encode("utf-8"), msg, hashlib.sha256)
+    return mac.hexdigest()
+
+
+def sign_snapshot(data, key):
+    return dict(data, signature=get_snapshot_signature(data, key))
+
+
+def verify_snapshot(snapshot, key):
+    """ Returns the snapshot without its signature, or raises """
+    data = dict(snapshot)
+    signature = data.pop("signature", "")
+    if not hmac.compare_digest(get_snapshot_signature(data, key), signature):
+        raise SnapshotSignatureException("Snapshot signature doesn't match")
+
+    if data.get("version") != SNAPSHOT_VERSION:
+        raise SnapshotSignatureException(
+            "Unsupported snapshot version %s" % data.get("version")
+        )
+    return data
+
+
+def ticket_snapshot(ticket):
+    return {
+        "id": ticket.id,
+        "owner_id": ticket.owner_id,
+        "product": ticket.product.checkin_display_name,
+        "has_badge": bool(ticket.product.get_attribute("has_badge")),
+        "paid": ticket.is_paid_for,
+        "checked_in": bool(ticket.checked_in),
+        "badge_issued": bool(ticket.badge_issued),
+    }
+
+
+def user_snapshot(user):
+    return {
+        "id": user.id,
+        "name": user.name,
+        "email": user.email,
+        "checkin_note": user.checkin_note,
+        "checkin_code": user.checkin_code,
+    }
+
+
+def export_snapshot(since=None):
+    """ A signed snapshot of admission tickets and their owners.
+
+        With since, only tickets modified since then are included, along
+        with their owners, whatever state they're in. Otherwise, all paid
+        tickets are included.
+    """
+    generated = datetime.utcnow()
+    tickets = AdmissionTicket.query.filter(
+        AdmissionTicket.owner_id.isnot(None)
+    ).options(joinedload(Purchase.product), joinedload(Purchase.owner))
+
+    if since is None:
+        tickets = tickets.filter(Purchase.is_paid_for == True)  # noqa: E712
+    else:
+        tickets = tickets.filter(Purchase.modified >= since - SNAPSHOT_OVERLAP)
+
+    tickets = tickets.order_by(Purchase.id).all()
+    owners = {t.owner_id: t.owner for t in tickets}
+
+    data = {
+        "version": SNAPSHOT_VERSION,
+        "generated": generated.isoformat(),
+        "since": since.isoformat() if since else None,
+        "users": [user_snapshot(u) for _, u in sorted(owners.items())],
+        "tickets": [ticket_snapshot(t) for t in tickets],
+    }
+    return sign_snapshot(data, app.config["SECRET_KEY"])
+
+
+def apply_sync_event(event):
+    """ Apply a check-in event from a gate, unless it's already been seen.
+
+        The caller should commit. Returns the result to send back.
+    """
+    existing = CheckinSyncEvent.query.get(event["id"])
+    if existing is not None:
+        return sync_result(existing)
+
+    if event["action"] not in CHECKIN_ACTIONS:
+        result, message = "rejected", "Unknown action %s" % event["action"]
+    elif AdmissionTicket.query.get(event["ticket_id"]) is None:
+        result, message = "rejected", "Unknown ticket %s" % event["ticket_id"]
+    else:
+        result, message = replay_event(event)
+
+    sync_event = CheckinSyncEvent(
+        event["id"],
+        event["ticket_id"],
+        event["action"],
+        parse(event["occurred"]),
+        result,
+        message,
+    )
+    if result != "rejected":
+        # Rejections don't change anything, and may not have a valid ticket
+        db.session.add(sync_event)
+        db.session.flush()
+
+    return sync_result(sync_event)
+
+
+def sync_result(sync_event):
+    return {
+        "id": sync_event.id,
+        "ticket_id": sync_event.ticket_id,
+        "result": sync_event.result,
+        "message": sync_event.message,
+    }
+
+
+def replay_event(event):
+    """ Returns (result, message) """
+    ticket = AdmissionTicket.query.get(event["ticket_id"])
+    try:
+        getattr(ticket, event["action"])()
+    except CheckinStateException as e:
+        app.logger.warning(
+            "Conflicting %s from gate for ticket %s: %s", event["action"], ticket.id, e
+        )
+        return "conflict", str(e)
+
+    return "ok", None
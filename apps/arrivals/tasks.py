@@ -0,0 +1,70 @@
+import json
+
+import click
+from dateutil.parser import parse
+from flask import current_app as app
+
+from . import arrivals
+from .replica import ArrivalsReplica
+from .sync import export_snapshot
+
+
+@arrivals.cli.command("search_benchmark")
+@click.option("--attendees", type=int, default=3000, help="Number of attendees")
+@click.option("--queries", type=int, default=2000, help="Number of searches")
+@click.option("--seed", type=int, default=0, help="Random seed")
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False),
+    help="Append the results to this file, one JSON object per line",
+)
+def search_benchmark(attendees, queries, seed, output):
+    """ Time the arrivals search index on synthetic attendees. """
+    from .search_benchmark import run_benchmark
+
+    result = run_benchmark(attendees, queries, seed)
+    app.logger.info("Benchmark results: %s", result)
+
+    if output:
+        with open(output, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+
+@arrivals.cli.command("export_snapshot")
+@click.option("--since", help="Only include tickets changed since this time")
+@click.argument("output", type=click.File("w"))
+def export_snapshot_command(since, output):
+    """ Export a signed snapshot of ticket holders for an offline gate. """
+    snapshot = export_snapshot(parse(since) if since else None)
+    json.dump(snapshot, output)
+    app.logger.info(
+        "Exported %s users and %s tickets",
+        len(snapshot["users"]),
+        len(snapshot["tickets"]),
+    )
+
+
+@arrivals.cli.command("replica_sync")
+@click.option("--upstream", required=True, help="e.g. https://www.emfcamp.org/arrivals")
+@click.option("--token", required=True, help="API token of an arrivals user")
+@click.option("--snapshot", type=click.File("r"), help="Load this snapshot first")
+@click.argument("path", type=click.Path(file_okay=False, exists=True))
+def replica_sync(upstream, token, snapshot, path):
+    """ Send an offline gate's check-ins upstream and fetch changes. """
+    replica = ArrivalsReplica(path, app.config["SECRET_KEY"])
+    replica.load()
+    if snapshot:
+        replica.load_snapshot(json.load(snapshot))
+
+    pending = len(replica.pending)
+    conflicts = replica.sync(upstream.rstrip("/"), token)
+    app.logger.info(
+        "Sent %s check-ins, now have %s tickets", pending, len(replica.tickets)
+    )
+    for conflict in conflicts:
+        app.logger.warning(
+            "Ticket %s: %s (%s)",
+            conflict["ticket_id"],
+            conflict["message"],
+            conflict["result"],
+        )
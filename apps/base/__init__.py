@@ -1,6 +1,4 @@
 import os
-from mailchimp3 import MailChimp
-from mailchimp3.helpers import get_subscriber_hash
 from requests import HTTPError
 
 from flask import (
@@ -52,6 +50,9 @@ def main():
 
 @base.route("/", methods=["POST"])
 def main_post():
+    from mailchimp3 import MailChimp
+    from mailchimp3.helpers import get_subscriber_hash
+
     mc = MailChimp(mc_api=app.config["MAILCHIMP_KEY"])
     try:
         email = request.form.get("email")
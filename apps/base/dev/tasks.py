@@ -10,7 +10,6 @@ from models.volunteer.shift import Shift
 from models.volunteer.role import Role
 
 from . import dev_cli
-from .fake import FakeDataGenerator
 
 
 @dev_cli.command("data")
@@ -25,6 +24,8 @@ def dev_data(ctx):
 @dev_cli.command("cfp_data")
 def fake_data():
     """ Make fake users, proposals, locations, etc """
+    from .fake import FakeDataGenerator
+
     fdg = FakeDataGenerator()
     fdg.run()
 
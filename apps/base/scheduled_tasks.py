@@ -1,8 +1,10 @@
+from smtplib import SMTPException, SMTPServerDisconnected
+
 from flask_mail import Message
 from flask import current_app as app
 from main import mail, db
 
-from models.email import EmailJobRecipient
+from models.email import EmailJobRecipient, QueuedEmail
 from models.scheduled_task import scheduled_task
 
 
@@ -28,3 +30,49 @@ def send_email(conn, rec):
     rec.sent = True
     db.session.add(rec)
     db.session.commit()
+
+
+@scheduled_task(minutes=1)
+def send_queued_emails():
+    """ Send emails from batches, e.g. CfP notifications """
+    count = 0
+    with mail.connect() as conn:
+        for email in QueuedEmail.query.filter(
+            QueuedEmail.sent == False, QueuedEmail.error.is_(None)  # noqa: E712
+        ).order_by(QueuedEmail.id):
+            count += 1
+            send_queued_email(conn, email)
+    return count
+
+
+def send_queued_message(conn, email, subject):
+    msg = Message(subject, sender=email.sender, recipients=[email.recipient])
+    msg.body = email.body
+    conn.send(msg)
+
+
+def send_queued_email(conn, email):
+    # A bad address or message shouldn't hold up the rest of the batch, but
+    # if we've lost the connection, give up until the next run.
+    try:
+        try:
+            send_queued_message(conn, email, email.subject)
+        except AttributeError as e:
+            # Header wrapping can fail on some subjects, so retry without the
+            # proposal title (https://bugs.python.org/issue27240)
+            if not email.fallback_subject:
+                raise
+            app.logger.warning(
+                "Failed to send queued email %s, retrying without title: %s",
+                email.id,
+                e,
+            )
+            send_queued_message(conn, email, email.fallback_subject)
+        email.sent = True
+    except SMTPServerDisconnected:
+        raise
+    except (AttributeError, SMTPException, UnicodeError) as e:
+        app.logger.error("Failed to send queued email %s: %s", email.id, e)
+        email.error = repr(e)
+
+    db.session.commit()
@@ -0,0 +1,112 @@
+""" Measure how long it takes to start the app, and how much memory it uses.
+
+    Every gunicorn worker and every `flask` command pays this, so run
+    `flask startup_benchmark --output results.jsonl` on each release to
+    catch heavy imports creeping back in. Each run starts a fresh
+    interpreter, as modules are only imported once per process.
+"""
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+
+# Modules which should only be imported when they're used
+LAZY_MODULES = [
+    "stripe",
+    "gocardless_pro",
+    "pytransferwise",
+    "pyppeteer",
+    "barcode",
+    "segno",
+    "mailchimp3",
+    "ofxparse",
+    "Levenshtein",
+    "inlinestyler",
+    "shapely.geometry",
+    "slotmachine",
+    "faker",
+]
+
+STARTUP_SCRIPT = """
+import json, resource, sys, time
+
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+app = main.create_app()
+created = time.perf_counter()
+main.warm_app(app)
+warmed = time.perf_counter()
+
+print(json.dumps({
+    "import_seconds": imported - start,
+    "create_app_seconds": created - imported,
+    "warm_seconds": warmed - created,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "module_count": len(sys.modules),
+    "lazy_modules_loaded": [m for m in %r if m in sys.modules],
+}))
+"""
+
+# e.g. "import time:       318 |        960 |   flask.app"
+IMPORT_TIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)$")
+
+
+def parse_import_times(output):
+    """ Cumulative import time of each top-level module, in seconds """
+    times = {}
+    for line in output.splitlines():
+        match = IMPORT_TIME_RE.match(line)
+        # Nested imports are indented further
+        if match and len(match.group(3)) == 1:
+            times[match.group(4)] = int(match.group(2)) / 1e6
+    return times
+
+
+def measure_startup(cwd):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT % LAZY_MODULES],
+        cwd=cwd,
+        env=os.environ,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    data = json.loads(result.stdout.splitlines()[-1])
+    data["import_times"] = parse_import_times(result.stderr)
+    return data
+
+
+def run_benchmark(cwd, runs=5, top=10):
+    """ Start the app runs times, and summarise the results """
+    results = [measure_startup(cwd) for _ in range(runs)]
+
+    # The first run is often slower, as nothing is in the page cache
+    import_times = {}
+    for result in results[1:] or results:
+        for module, seconds in result["import_times"].items():
+            import_times.setdefault(module, []).append(seconds)
+    slowest = sorted(
+        ((statistics.median(t), m) for m, t in import_times.items()), reverse=True
+    )[:top]
+
+    def median(key):
+        return statistics.median(r[key] for r in results)
+
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "runs": runs,
+        "import_seconds": median("import_seconds"),
+        "create_app_seconds": median("create_app_seconds"),
+        "warm_seconds": median("warm_seconds"),
+        "max_rss_kb": median("max_rss_kb"),
+        "module_count": median("module_count"),
+        "lazy_modules_loaded": sorted(
+            {m for r in results for m in r["lazy_modules_loaded"]}
+        ),
+        "slowest_imports": [[m, round(s, 4)] for s, m in slowest],
+    }
@@ -1,4 +1,7 @@
+import json
+
 import click
+from flask import current_app
 
 from main import db
 from apps.base import base as app
@@ -8,9 +11,10 @@ from models.scheduled_task import execute_scheduled_tasks
 
 
 @app.cli.command("periodic")
-def periodic():
+@click.option("--jobs", type=int, default=4, help="Tasks to run at once")
+def periodic(jobs):
     """ Execute periodic scheduled tasks """
-    execute_scheduled_tasks()
+    execute_scheduled_tasks(jobs)
 
 
 @app.cli.command("make_admin")
@@ -60,3 +64,22 @@ def create_perms():
             db.session.add(Permission(permission))
 
     db.session.commit()
+
+
+@app.cli.command("startup_benchmark")
+@click.option("--runs", type=int, default=5, help="Number of times to start the app")
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False),
+    help="Append the results to this file, one JSON object per line",
+)
+def startup_benchmark(runs, output):
+    """ Time starting the app from scratch, and record its memory use """
+    from .startup_benchmark import run_benchmark
+
+    result = run_benchmark(current_app.root_path, runs)
+    current_app.logger.info("Benchmark results: %s", result)
+
+    if output:
+        with open(output, "a") as f:
+            f.write(json.dumps(result) + "\n")
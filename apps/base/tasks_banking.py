@@ -1,5 +1,4 @@
 import click
-import ofxparse
 from datetime import datetime
 
 from flask import current_app as app
@@ -38,6 +37,8 @@ def create_bank_accounts():
 @click.argument("ofx_file", type=click.File("r"))
 def load_ofx(ofx_file):
     """ Import an OFX bank statement file """
+    import ofxparse
+
     ofx = ofxparse.OfxParser.parse(ofx_file)
 
     acct_id = ofx.account.account_id
@@ -1,7 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+import gzip
+import hashlib
+import time
 import simplejson
 import os
 
+import click
 from flask import current_app as app
 from sqlalchemy_continuum.utils import version_class, is_versioned
 
@@ -10,13 +15,68 @@ from apps.common.json_export import ExportEncoder
 from . import base
 
 
+class ChecksumWriter:
+    """ A binary file which keeps a checksum of what's written to it """
+
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+
+def write_json(filename, data, compress=False):
+    """ Stream data to filename as it's encoded, returning the file's SHA-256 """
+    with open(filename, "wb") as f:
+        writer = ChecksumWriter(f)
+        out = gzip.GzipFile(fileobj=writer, mode="wb") if compress else writer
+        for chunk in ExportEncoder(indent=4).iterencode(data):
+            out.write(chunk.encode("utf-8"))
+        if compress:
+            out.close()
+
+    return writer.sha256.hexdigest()
+
+
+def export_model(flask_app, model_class, path, compress):
+    """ Write a model's export files, in its own app context and session.
+
+        Returns the tables exported, and a dict of filename to checksum.
+    """
+    with flask_app.app_context():
+        start = time.time()
+        model = model_class.__name__
+        export = model_class.get_export_data()
+
+        checksums = {}
+        for dirname in ["public", "private"]:
+            if dirname in export:
+                filename = os.path.join(dirname, "{}.json".format(model))
+                if compress:
+                    filename += ".gz"
+                checksums[filename] = write_json(
+                    os.path.join(path, filename), export[dirname], compress
+                )
+                app.logger.info("Exported data from %s to %s", model, filename)
+
+        app.logger.debug("Exported %s in %.2fs", model, time.time() - start)
+        return export.get("tables", [model_class.__table__.name]), checksums
+
+
 @base.cli.command("export")
-def export_db():
+@click.option("--jobs", type=int, default=4, help="Models to export at once")
+@click.option("--compress", is_flag=True, help="Gzip the exported files")
+def export_db(jobs, compress):
     """ Export data from the DB to disk.
 
     This command is run as a last step before wiping the DB after an event, to export
     all the data we want to save. It saves a private and a public export to the
-    exports directory.
+    exports directory, along with SHA256SUMS.
 
     Model classes should implement get_export_data, which returns a dict with keys:
         public   Public data to save in git
@@ -25,6 +85,9 @@ def export_db():
 
     Alternatively, add __export_data__ = False to a class to state that get_export_data
     shouldn't be called, and that its associated table doesn't need to be checked.
+
+    Models are exported concurrently, each in its own session, and written out
+    as they're read, so tables of any size can be exported.
     """
 
     # As we go, we check against the list of all tables, in case we forget about some
@@ -43,7 +106,6 @@ def export_db():
         version_class(c) for c in all_model_classes if is_versioned(c)
     }
 
-    seen_model_classes = set()
     remaining_tables = set(db.metadata.tables)
 
     year = datetime.utcnow().year
@@ -51,25 +113,21 @@ def export_db():
     for dirname in ["public", "private"]:
         os.makedirs(os.path.join(path, dirname), exist_ok=True)
 
+    to_export = []
     for model_class in all_model_classes:
-        if model_class in seen_model_classes:
-            continue
-
-        seen_model_classes.add(model_class)
-
         table = model_class.__table__.name
         model = model_class.__name__
 
         if table in ignore:
             app.logger.debug("Ignoring %s", model)
-            remaining_tables.remove(table)
+            remaining_tables.discard(table)
             continue
 
         if not getattr(model_class, "__export_data__", True):
             # We don't remove the version table, as we want
             # to be explicit about chucking away edit stats
             app.logger.debug("Skipping %s", model)
-            remaining_tables.remove(table)
+            remaining_tables.discard(table)
             continue
 
         if model_class in all_version_classes:
@@ -79,25 +137,25 @@ def export_db():
             continue
 
         if hasattr(model_class, "get_export_data"):
+            to_export.append(model_class)
+
+    start = time.time()
+    checksums = {}
+    flask_app = app._get_current_object()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(export_model, flask_app, c, path, compress): c
+            for c in sorted(to_export, key=lambda c: c.__name__)
+        }
+        for future in as_completed(futures):
             try:
-                export = model_class.get_export_data()
-                for dirname in ["public", "private"]:
-                    if dirname in export:
-                        filename = os.path.join(path, dirname, "{}.json".format(model))
-                        simplejson.dump(
-                            export[dirname],
-                            open(filename, "w"),
-                            indent=4,
-                            cls=ExportEncoder,
-                        )
-                        app.logger.info("Exported data from %s to %s", model, filename)
-
-            except Exception as e:
-                app.logger.error("Error exporting %s", model)
+                exported_tables, model_checksums = future.result()
+            except Exception:
+                app.logger.error("Error exporting %s", futures[future].__name__)
                 raise
 
-            exported_tables = export.get("tables", [table])
             remaining_tables -= set(exported_tables)
+            checksums.update(model_checksums)
 
     if remaining_tables:
         app.logger.warning("Remaining tables: %s", ", ".join(remaining_tables))
@@ -112,7 +170,16 @@ def export_db():
     with app.test_client() as client:
         for schedule in ["schedule.frab", "schedule.json", "schedule.ics"]:
             resp = client.get("/{}".format(schedule))
-            with open(os.path.join(path, "public", schedule), "wb") as f:
+            schedule_file = os.path.join("public", schedule)
+            with open(os.path.join(path, schedule_file), "wb") as f:
                 f.write(resp.data)
+            checksums[schedule_file] = hashlib.sha256(resp.data).hexdigest()
+
+    # In the format sha256sum -c expects
+    with open(os.path.join(path, "SHA256SUMS"), "w") as f:
+        for name, checksum in sorted(checksums.items()):
+            f.write("{}  {}\n".format(checksum, name))
 
-    app.logger.info("Export complete, summary written to %s", filename)
+    app.logger.info(
+        "Export complete in %.2fs, summary written to %s", time.time() - start, filename
+    )
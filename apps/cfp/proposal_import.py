@@ -0,0 +1,173 @@
+""" Importing proposals from CSV, e.g. a previous year's schedule.
+
+    The CSV is read in chunks. Each chunk looks up its users and existing
+    titles with one query each, and is flushed and committed as a unit, so
+    the session only ever holds one chunk's objects. Rows which fail
+    validation are reported and skipped rather than aborting the import.
+"""
+from itertools import islice
+from time import monotonic
+
+from flask import current_app as app
+
+from main import db
+from models.cfp import Proposal, TalkProposal, WorkshopProposal, InstallationProposal
+from models.user import User
+
+IMPORT_CHUNK_SIZE = 500
+IMPORT_TYPES = {
+    "talk": TalkProposal,
+    "workshop": WorkshopProposal,
+    "installation": InstallationProposal,
+}
+
+
+class ImportStats(object):
+    def __init__(self):
+        self.start = monotonic()
+        self.rows = 0
+        self.imported = 0
+        self.skipped = 0
+        # (line number, message)
+        self.errors = []
+
+    @property
+    def seconds(self):
+        return monotonic() - self.start
+
+    @property
+    def rows_per_second(self):
+        return self.rows / max(self.seconds, 1e-6)
+
+    def __repr__(self):
+        return "<ImportStats: %s rows, %s imported, %s skipped, %s errors>" % (
+            self.rows,
+            self.imported,
+            self.skipped,
+            len(self.errors),
+        )
+
+
+def get_import_email(row):
+    return "cfp_%s@test.invalid" % row["id"]
+
+
+def validate_import_row(row):
+    """ Returns a reason the row can't be imported, or None """
+    for field in ["id", "title", "description", "type"]:
+        if not row.get(field):
+            return "Missing %s" % field
+
+    if row["type"] not in IMPORT_TYPES:
+        return "Unknown type %s" % row["type"]
+
+    required = {"talk": ["length"], "workshop": ["length", "attendees"]}
+    for field in required.get(row["type"], []):
+        if not row.get(field):
+            return "Missing %s for %s" % (field, row["type"])
+
+    return None
+
+
+def make_proposal(row, state, user):
+    proposal_cls = IMPORT_TYPES[row["type"]]
+    proposal = proposal_cls()
+
+    proposal.state = state
+    proposal.title = row["title"]
+    proposal.description = row["description"]
+
+    proposal.one_day = row.get("one_day") == "t"
+    proposal.needs_money = row.get("need_finance") == "t"
+
+    if proposal_cls is TalkProposal:
+        proposal.length = row["length"]
+
+    elif proposal_cls is WorkshopProposal:
+        proposal.length = row["length"]
+        proposal.attendees = row["attendees"]
+
+    else:
+        proposal.size = row.get("size")
+
+    proposal.user = user
+    return proposal
+
+
+def import_chunk(rows, state, faker, stats):
+    """ Import a list of (line number, row) pairs """
+    valid = []
+    for line, row in rows:
+        error = validate_import_row(row)
+        if error:
+            stats.errors.append((line, error))
+        else:
+            valid.append((line, row))
+
+    titles = {row["title"] for _, row in valid}
+    existing_titles = {
+        title
+        for title, in Proposal.query.filter(Proposal.title.in_(titles)).with_entities(
+            Proposal.title
+        )
+    }
+
+    emails = {get_import_email(row) for _, row in valid}
+    users = {u.email: u for u in User.query.filter(User.email.in_(emails))}
+
+    imported = 0
+    for line, row in valid:
+        if row["title"] in existing_titles:
+            stats.skipped += 1
+            continue
+        # Also catches duplicates within the file
+        existing_titles.add(row["title"])
+
+        email = get_import_email(row)
+        if email not in users:
+            users[email] = User(email, faker.name())
+            db.session.add(users[email])
+
+        db.session.add(make_proposal(row, state, users[email]))
+        imported += 1
+
+    try:
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        first, last = rows[0][0], rows[-1][0]
+        stats.errors.append((first, "Lines %s-%s not imported: %s" % (first, last, e)))
+        return
+
+    stats.imported += imported
+
+
+def import_proposals(reader, state="locked", chunk_size=IMPORT_CHUNK_SIZE):
+    """ Import proposals from a csv.DictReader, and return an ImportStats.
+
+        Proposals are skipped if one with the same title already exists, so
+        the import can be re-run. Users are created with an email based on
+        the id column, and reused on later runs.
+    """
+    from faker import Faker
+
+    faker = Faker()
+    stats = ImportStats()
+
+    # line_num is the last line of the row just read, as rows can span lines
+    rows = ((reader.line_num, row) for row in reader)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+
+        stats.rows += len(chunk)
+        import_chunk(chunk, state, faker, stats)
+        app.logger.info(
+            "Imported %s of %s rows (%.0f rows/s)",
+            stats.imported,
+            stats.rows,
+            stats.rows_per_second,
+        )
+
+    return stats
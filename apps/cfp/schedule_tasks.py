@@ -1,5 +1,7 @@
 """ CLI commands for scheduling """
 
+import json
+
 import click
 from flask import current_app as app
 
@@ -7,7 +9,6 @@ from main import db
 from models.cfp import Proposal, Venue
 
 from apps.cfp_review.base import send_email_for_proposal
-from .scheduler import Scheduler
 from . import cfp
 
 
@@ -49,6 +50,8 @@ def create_venues():
 @cfp.cli.command("set_rough_durations")
 def set_rough_durations():
     """ Assign durations to proposals based on the proposed length. """
+    from .scheduler import Scheduler
+
     scheduler = Scheduler()
     scheduler.set_rough_durations()
 
@@ -57,10 +60,65 @@ def set_rough_durations():
 @click.option(
     "-p", "--persist", is_flag=True, help="Persist changes rather than doing a dry run"
 )
-def run_schedule(persist):
+@click.option(
+    "-i",
+    "--incremental",
+    is_flag=True,
+    help="Only move unscheduled proposals (and any given with --proposal), "
+    "plus whatever's near them",
+)
+@click.option(
+    "--proposal",
+    "proposal_ids",
+    type=int,
+    multiple=True,
+    help="Proposal to reschedule in an incremental run",
+)
+@click.option(
+    "--time-limit",
+    type=float,
+    help="Seconds to spend improving an incremental schedule",
+)
+@click.option(
+    "--move-published",
+    is_flag=True,
+    help="Allow an incremental run to move proposals that are already scheduled",
+)
+def run_schedule(persist, incremental, proposal_ids, time_limit, move_published):
     """ Run the schedule constraint solver. This can take a while. """
+    from .scheduler import Scheduler
+
     scheduler = Scheduler()
-    scheduler.run(persist)
+    scheduler.run(
+        persist,
+        incremental=incremental,
+        proposal_ids=proposal_ids,
+        time_limit=time_limit,
+        fix_published=not move_published,
+    )
+
+
+@cfp.cli.command("schedule_benchmark")
+@click.option("--talks", type=int, default=100, help="Number of proposals")
+@click.option("--venues", type=int, default=3, help="Number of venues")
+@click.option("--changes", type=int, default=1, help="Proposals to reschedule")
+@click.option("--seed", type=int, default=0, help="Random seed")
+@click.option("--time-limit", type=float, help="Budget for the incremental run")
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False),
+    help="Append the results to this file, one JSON object per line",
+)
+def schedule_benchmark(talks, venues, changes, seed, time_limit, output):
+    """ Time full and incremental runs of the solver on a synthetic schedule. """
+    from .scheduler_benchmark import run_benchmark
+
+    result = run_benchmark(talks, venues, changes, seed, time_limit)
+    app.logger.info("Benchmark results: %s", result)
+
+    if output:
+        with open(output, "a") as f:
+            f.write(json.dumps(result) + "\n")
 
 
 @cfp.cli.command("apply_potential_schedule")
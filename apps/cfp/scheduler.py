@@ -1,4 +1,7 @@
 from collections import defaultdict
+from datetime import timedelta
+from time import monotonic
+
 from dateutil import parser
 from flask import current_app as app
 
@@ -14,6 +17,166 @@ from models.cfp import (
     VENUE_CAPACITY,
 )
 
+# How far around changed proposals, in hours, incremental runs let other
+# proposals move. None means everything can move.
+NEIGHBOURHOOD_RADII = [0, 1, 2, 4, 8, None]
+
+
+def is_placed(event):
+    return bool(event.get("time")) and bool(event.get("venue"))
+
+
+def get_event_slot(event):
+    start = parser.parse(str(event["time"]))
+    return start, start + timedelta(minutes=event["duration"])
+
+
+def pin_event(event):
+    """ Restrict an event to its current slot, so the solver can't move it. """
+    start, end = get_event_slot(event)
+    time_ranges = [{"start": str(start), "end": str(end)}]
+
+    pinned = dict(event)
+    pinned["valid_venues"] = [event["venue"]]
+    pinned["preferred_venues"] = [event["venue"]]
+    pinned["time_ranges"] = time_ranges
+    pinned["preferred_time_ranges"] = time_ranges
+    return pinned
+
+
+def get_neighbourhood(data, changed_ids, radius, fixed_ids=()):
+    """ The ids of events which may move when rescheduling changed_ids.
+
+        As well as the changed events themselves, this includes placed events
+        in a venue a changed event could use, within radius hours of either
+        its current slot or, if it hasn't been placed, its allowed times.
+        Events in fixed_ids never move unless they've changed.
+    """
+    by_id = {e["id"]: e for e in data}
+    free = {i for i in changed_ids if i in by_id}
+    if radius is None:
+        return free | {i for i in by_id if i not in fixed_ids}
+
+    if radius == 0:
+        return free
+
+    window = timedelta(hours=radius)
+    neighbours = set()
+    for changed in (by_id[i] for i in free):
+        if is_placed(changed):
+            start, end = get_event_slot(changed)
+            windows = [(start - window, end + window)]
+        else:
+            windows = [
+                (parser.parse(r["start"]) - window, parser.parse(r["end"]) + window)
+                for r in changed["time_ranges"]
+            ]
+
+        venues = set(changed["valid_venues"])
+        for event in data:
+            if event["id"] in free or event["id"] in fixed_ids:
+                continue
+            if not is_placed(event) or event["venue"] not in venues:
+                continue
+
+            start, end = get_event_slot(event)
+            if any(start < w_end and w_start < end for w_start, w_end in windows):
+                neighbours.add(event["id"])
+
+    return free | neighbours
+
+
+def get_schedule_quality(data, schedule):
+    """ How good a schedule is compared to the data it was produced from.
+
+        unscheduled and moved are bad, preferred is the number of preferred
+        venues and times which were satisfied.
+    """
+    by_id = {e["id"]: e for e in data}
+    quality = {"unscheduled": 0, "moved": 0, "preferred": 0}
+
+    for event in schedule:
+        if not is_placed(event):
+            quality["unscheduled"] += 1
+            continue
+
+        original = by_id[event["id"]]
+        start, end = get_event_slot(dict(event, duration=original["duration"]))
+
+        if is_placed(original) and (
+            str(original["venue"]) != str(event["venue"])
+            or get_event_slot(original)[0] != start
+        ):
+            quality["moved"] += 1
+
+        if event["venue"] in original["preferred_venues"]:
+            quality["preferred"] += 1
+
+        for r in original["preferred_time_ranges"]:
+            if parser.parse(r["start"]) <= start and end <= parser.parse(r["end"]):
+                quality["preferred"] += 1
+                break
+
+    return quality
+
+
+def quality_key(quality):
+    return (quality["unscheduled"], -quality["preferred"], quality["moved"])
+
+
+def schedule_incremental(
+    solve, data, changed_ids, fixed_ids=(), time_limit=None, progress=None
+):
+    """ Reschedule changed_ids, disturbing as little else as possible.
+
+        Starting from the current schedule, this solves with only the changed
+        events free to move, then widens the neighbourhood of events which can
+        move, keeping the best schedule found. It stops when time_limit (in
+        seconds) is up, or if there's no limit, at the first schedule found.
+        A solve in progress can't be interrupted, so the last one may overrun.
+
+        progress is called after each solve with the radius, the number of
+        events which could move, the elapsed time and the quality (or None).
+
+        Returns (schedule, quality), or (None, None) if nothing was found.
+    """
+    start_time = monotonic()
+    best = best_quality = None
+    last_size = None
+
+    for radius in NEIGHBOURHOOD_RADII:
+        free = get_neighbourhood(data, changed_ids, radius, fixed_ids)
+        if len(free) == last_size:
+            continue
+        last_size = len(free)
+
+        problem = [
+            pin_event(e) if is_placed(e) and e["id"] not in free else e for e in data
+        ]
+        quality = None
+        try:
+            schedule = solve(problem)
+        except Exception as e:
+            app.logger.warning(
+                "No schedule found moving %s events: %s", len(free), repr(e)
+            )
+        else:
+            quality = get_schedule_quality(data, schedule)
+            if best is None or quality_key(quality) < quality_key(best_quality):
+                best, best_quality = schedule, quality
+
+        elapsed = monotonic() - start_time
+        if progress:
+            progress(radius, len(free), elapsed, quality)
+
+        if time_limit is None:
+            if best is not None:
+                break
+        elif elapsed >= time_limit:
+            break
+
+    return best, best_quality
+
 
 class Scheduler(object):
     """ Automatic Scheduler
@@ -50,10 +213,12 @@ class Scheduler(object):
         for proposal in proposals:
             proposals_by_type[proposal.type].append(proposal)
 
+        venues_by_name = {v.name: v for v in Venue.query}
+
         capacity_by_type = defaultdict(dict)
         for type, venues in DEFAULT_VENUES.items():
             for venue in venues:
-                venue_id = Venue.query.filter(Venue.name == venue).one().id
+                venue_id = venues_by_name[venue].id
                 capacity_by_type[type][venue_id] = VENUE_CAPACITY[venue]
 
         proposal_data = []
@@ -80,22 +245,25 @@ class Scheduler(object):
                 # If a talk is allowed to happen outside main content hours,
                 # don't require it to be spaced from other things - we often
                 # have talks and related performances back-to-back
+                allowed_periods = proposal.get_allowed_time_periods_with_default()
                 spacing_slots = EVENT_SPACING.get(proposal.type, 1)
                 if proposal.type == "talk":
-                    for p in proposal.get_allowed_time_periods_with_default():
+                    for p in allowed_periods:
                         if p.start.hour < 9 or p.start.hour >= 20:
                             spacing_slots = 0
 
                 export = {
                     "id": proposal.id,
                     "duration": proposal.scheduled_duration,
-                    "speakers": [proposal.user.id],
+                    "speakers": [proposal.user_id],
                     "title": proposal.title,
-                    "valid_venues": [v.id for v in proposal.get_allowed_venues()],
+                    "valid_venues": [
+                        v.id for v in proposal.get_allowed_venues(venues_by_name)
+                    ],
                     "preferred_venues": preferred_venues,  # This supports a list, but we only want one for now
                     "time_ranges": [
                         {"start": str(p.start), "end": str(p.end)}
-                        for p in proposal.get_allowed_time_periods_with_default()
+                        for p in allowed_periods
                     ],
                     "preferred_time_ranges": [
                         {"start": str(p.start), "end": str(p.end)}
@@ -104,10 +272,10 @@ class Scheduler(object):
                     "spacing_slots": spacing_slots,
                 }
 
-                if proposal.scheduled_venue:
-                    export["venue"] = proposal.scheduled_venue.id
-                if proposal.potential_venue:
-                    export["venue"] = proposal.potential_venue.id
+                if proposal.scheduled_venue_id:
+                    export["venue"] = proposal.scheduled_venue_id
+                if proposal.potential_venue_id:
+                    export["venue"] = proposal.potential_venue_id
 
                 if proposal.scheduled_time:
                     export["time"] = str(proposal.scheduled_time)
@@ -175,30 +343,56 @@ class Scheduler(object):
         return True
 
     def apply_changes(self, schedule):
+        schedule = [e for e in schedule if is_placed(e)]
+        proposals = {
+            p.id: p
+            for p in Proposal.query.filter(Proposal.id.in_([e["id"] for e in schedule]))
+        }
+        venues = {v.id: v for v in Venue.query}
+
         changes = False
         for event in schedule:
-            if "time" not in event or not event["time"]:
-                continue
-            if "venue" not in event or not event["venue"]:
-                continue
-
-            proposal = Proposal.query.filter_by(id=event["id"]).one()
-            venue = Venue.query.get(event["venue"])
+            proposal = proposals[event["id"]]
+            venue = venues[int(event["venue"])]
             changes |= self.handle_schedule_change(proposal, venue, event["time"])
 
         if not changes:
             app.logger.info("No schedule changes generated")
 
-    def run(self, persist):
+    def get_published_ids(self):
+        return {
+            id
+            for id, in Proposal.query.filter(
+                Proposal.scheduled_time.isnot(None),
+                Proposal.scheduled_venue_id.isnot(None),
+            ).with_entities(Proposal.id)
+        }
+
+    def run(
+        self,
+        persist,
+        incremental=False,
+        proposal_ids=(),
+        time_limit=None,
+        fix_published=True,
+    ):
         self.set_rough_durations()
 
-        sm = SlotMachine()
         data = self.get_scheduler_data()
         if len(data) == 0:
             app.logger.error("No talks to schedule!")
             return
 
-        new_schedule = sm.schedule(data)
+        if incremental:
+            new_schedule = self.run_incremental(
+                data, proposal_ids, time_limit, fix_published
+            )
+            if new_schedule is None:
+                return
+        else:
+            sm = SlotMachine()
+            new_schedule = sm.schedule(data)
+
         self.apply_changes(new_schedule)
 
         if persist:
@@ -206,3 +400,43 @@ class Scheduler(object):
         else:
             app.logger.info("DRY RUN: Pass the `-p` flag to persist these changes")
             db.session.rollback()
+
+    def run_incremental(self, data, proposal_ids, time_limit, fix_published):
+        """ Only move proposals which haven't been placed, or are in proposal_ids,
+            plus whatever's needed to fit them in. Published slots stay put
+            unless fix_published is False.
+        """
+        changed_ids = {e["id"] for e in data if not is_placed(e)}
+        changed_ids |= set(proposal_ids)
+        if not changed_ids:
+            app.logger.info("Nothing to reschedule")
+            return None
+
+        fixed_ids = set()
+        if fix_published:
+            fixed_ids = self.get_published_ids() - changed_ids
+
+        def progress(radius, size, elapsed, quality):
+            app.logger.info(
+                "Radius %s: %s of %s events could move, %.1fs elapsed, quality %s",
+                radius,
+                size,
+                len(data),
+                elapsed,
+                quality,
+            )
+
+        schedule, quality = schedule_incremental(
+            lambda problem: SlotMachine().schedule(problem),
+            data,
+            changed_ids,
+            fixed_ids,
+            time_limit=time_limit,
+            progress=progress,
+        )
+        if schedule is None:
+            app.logger.error("No incremental schedule found")
+            return None
+
+        app.logger.info("Best schedule found: %s", quality)
+        return schedule
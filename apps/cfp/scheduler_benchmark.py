@@ -0,0 +1,154 @@
+""" Synthetic schedules for benchmarking the scheduler.
+
+    Run `flask cfp schedule_benchmark --output results.jsonl` on each release
+    to keep track of how long the solver takes and how good its schedules are.
+"""
+import random
+from datetime import datetime, timedelta
+from time import monotonic
+
+from slotmachine import SlotMachine
+
+from models.cfp import DAYS
+from .scheduler import (
+    is_placed,
+    get_event_slot,
+    get_schedule_quality,
+    schedule_incremental,
+)
+
+DURATIONS = [20, 30, 50]
+CONTENT_HOURS = (10, 20)
+# Minutes between talks in the same venue
+SPACING = 10
+
+
+def get_day_ranges():
+    return [
+        (
+            day + timedelta(hours=CONTENT_HOURS[0]),
+            day + timedelta(hours=CONTENT_HOURS[1]),
+        )
+        for day in sorted(DAYS.values())
+    ]
+
+
+def generate_problem(talk_count=100, venue_count=3, seed=0):
+    """ Scheduler data for talk_count talks across venue_count venues.
+
+        As if the schedule had already been run, talks are placed back-to-back
+        on days they're available, until the venues are full.
+    """
+    rng = random.Random(seed)
+    venues = list(range(1, venue_count + 1))
+    day_ranges = get_day_ranges()
+
+    # When the next talk can start in each venue on each day
+    next_start = {
+        (venue, day): start
+        for venue in venues
+        for day, (start, _) in enumerate(day_ranges)
+    }
+
+    data = []
+    for id in range(1, talk_count + 1):
+        days = sorted(
+            rng.sample(range(len(day_ranges)), rng.randint(1, len(day_ranges)))
+        )
+        event = {
+            "id": id,
+            "duration": rng.choice(DURATIONS),
+            "speakers": [id],
+            "title": "Talk {}".format(id),
+            "valid_venues": venues,
+            "preferred_venues": [rng.choice(venues)],
+            "time_ranges": [
+                {"start": str(day_ranges[d][0]), "end": str(day_ranges[d][1])}
+                for d in days
+            ],
+            "preferred_time_ranges": [],
+            "spacing_slots": 1,
+        }
+
+        slots = [(venue, day) for venue in venues for day in days]
+        rng.shuffle(slots)
+        for venue, day in slots:
+            start = next_start[(venue, day)]
+            end = start + timedelta(minutes=event["duration"])
+            if end <= day_ranges[day][1]:
+                event["venue"] = venue
+                event["time"] = str(start)
+                next_start[(venue, day)] = end + timedelta(minutes=SPACING)
+                break
+
+        data.append(event)
+
+    return data
+
+
+def make_changes(data, change_count, rng):
+    """ Make some placed talks unavailable on the day they're scheduled,
+        as if their speakers had changed plans.
+
+        Returns the ids of talks which need to move.
+    """
+    placed = [e for e in data if is_placed(e)]
+    changed = rng.sample(placed, min(change_count, len(placed)))
+
+    for event in changed:
+        start, _ = get_event_slot(event)
+        other_days = [
+            r for r in event["time_ranges"] if r["start"][:10] != str(start.date())
+        ]
+        if other_days:
+            event["time_ranges"] = other_days
+
+    return {e["id"] for e in changed} | {e["id"] for e in data if not is_placed(e)}
+
+
+def time_solve(solve):
+    start = monotonic()
+    try:
+        schedule, quality = solve()
+    except Exception as e:
+        return {"seconds": monotonic() - start, "error": repr(e)}
+
+    result = {"seconds": monotonic() - start}
+    if quality is not None:
+        result.update(quality)
+    else:
+        result["error"] = "No schedule found"
+    return result
+
+
+def run_benchmark(
+    talk_count=100, venue_count=3, change_count=1, seed=0, time_limit=None
+):
+    """ Solve a synthetic schedule from scratch and incrementally, recording
+        how long each took and the quality of the result.
+    """
+    data = generate_problem(talk_count, venue_count, seed)
+    changed_ids = make_changes(data, change_count, random.Random(seed))
+
+    def full():
+        schedule = SlotMachine().schedule([dict(e) for e in data])
+        return schedule, get_schedule_quality(data, schedule)
+
+    def incremental():
+        return schedule_incremental(
+            lambda problem: SlotMachine().schedule(problem),
+            data,
+            changed_ids,
+            time_limit=time_limit,
+        )
+
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "talks": talk_count,
+        "venues": venue_count,
+        "changes": len(changed_ids),
+        "seed": seed,
+        "time_limit": time_limit,
+        "full": time_solve(full),
+        "incremental": time_solve(incremental),
+    }
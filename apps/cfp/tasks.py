@@ -1,15 +1,13 @@
 import click
 from csv import DictReader
 
-from faker import Faker
 from flask import current_app as app
 
-from main import db
-from models.cfp import Proposal, TalkProposal, WorkshopProposal, InstallationProposal
-from models.user import User
+from models.cfp import Proposal
 from apps.cfp_review.base import send_email_for_proposal
 
 from . import cfp
+from .proposal_import import import_proposals, IMPORT_CHUNK_SIZE
 
 
 @cfp.cli.command("import")
@@ -21,52 +19,31 @@ from . import cfp
     default="locked",
     help="The state to import the proposals as",
 )
-def csv_import(csv_file, state):
+@click.option(
+    "--chunk-size",
+    type=int,
+    default=IMPORT_CHUNK_SIZE,
+    help="How many rows to import in each transaction",
+)
+def csv_import(csv_file, state, chunk_size):
     """ Import a previous schedule for testing"""
-    faker = Faker()
     # id, title, description, length, need_finance,
     # one_day, type, experience, attendees, size
-    reader = DictReader(csv_file)
-    count = 0
-    for row in reader:
-        if Proposal.query.filter_by(title=row["title"]).first():
-            continue
-
-        user = User("cfp_%s@test.invalid" % count, faker.name())
-        db.session.add(user)
-
-        proposal = (
-            TalkProposal()
-            if row["type"] == u"talk"
-            else WorkshopProposal()
-            if row["type"] == u"workshop"
-            else InstallationProposal()
-        )
-
-        proposal.state = state
-        proposal.title = row["title"]
-        proposal.description = row["description"]
-
-        proposal.one_day = True if row.get("one_day") == "t" else False
-        proposal.needs_money = True if row.get("need_finance") == "t" else False
-
-        if row["type"] == "talk":
-            proposal.length = row["length"]
-
-        elif row["type"] == "workshop":
-            proposal.length = row["length"]
-            proposal.attendees = row["attendees"]
-
-        else:
-            proposal.size = row["size"]
-
-        proposal.user = user
-        db.session.add(proposal)
-
-        db.session.commit()
-        count += 1
-
-    app.logger.info("Imported %s proposals" % count)
+    stats = import_proposals(DictReader(csv_file), state, chunk_size)
+
+    for line, error in stats.errors:
+        app.logger.warning("Line %s: %s", line, error)
+
+    app.logger.info(
+        "Imported %s proposals from %s rows in %.1fs (%.0f rows/s), "
+        "skipped %s existing, %s errors",
+        stats.imported,
+        stats.rows,
+        stats.seconds,
+        stats.rows_per_second,
+        stats.skipped,
+        len(stats.errors),
+    )
 
 
 @cfp.cli.command("email_check")
@@ -5,6 +5,7 @@ from models.cfp import Proposal
 from main import db
 from . import cfp_review, anon_required, get_proposal_sort_dict, get_next_proposal_to
 from .forms import AnonymiseProposalForm
+from .review_queue import add_to_review_queues
 
 
 @cfp_review.route("/anonymisation")
@@ -52,6 +53,7 @@ def anonymise_proposal(proposal_id):
             prop.description = form.description.data
             prop.set_state("anonymised")
             prop.anonymiser_id = current_user.id
+            add_to_review_queues(prop)
             db.session.commit()
             app.logger.info("Sending proposal %s for review", proposal_id)
 
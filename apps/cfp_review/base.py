@@ -1,6 +1,5 @@
 from datetime import timedelta
-from collections import defaultdict, Counter
-from itertools import combinations
+from collections import defaultdict
 
 import dateutil
 from flask import (
@@ -16,11 +15,19 @@ from flask import (
 )
 from flask_login import current_user
 from flask_mail import Message
-from sqlalchemy import func, exists, select
+from sqlalchemy import func, exists
 from sqlalchemy.orm import joinedload
 
 from main import db, mail, external_url
-from .majority_judgement import calculate_max_normalised_score
+from ..common import BatchTemplate
+from .scores import get_vote_scores
+from .review_queue import review_again
+from .vote_stats import (
+    get_proposal_vote_stats,
+    summarise_vote_stats,
+    get_reviewer_progress,
+)
+from .clashfinder import find_clashes, find_clashes_for
 from models.cfp import (
     Proposal,
     CFPMessage,
@@ -33,8 +40,8 @@ from models.cfp import (
     DAYS,
     DEFAULT_VENUES,
     EVENT_SPACING,
-    FavouriteProposal,
 )
+from models.email import EmailBatch, QueuedEmail
 from models.user import User
 from models.purchase import Ticket
 from .forms import (
@@ -149,68 +156,62 @@ def proposals():
     )
 
 
-def send_email_for_proposal(proposal, reason="still-considered", from_address=None):
-    proposal_title = proposal.title
+def get_proposal_email(proposal, reason, proposal_title):
+    """ The subject and template for an email about a proposal """
+    if reason == "accepted":
+        subject = 'Your EMF proposal "%s" has been accepted!' % proposal_title
+        template = "cfp_review/email/accepted_msg.txt"
 
-    while True:
-        if reason == "accepted":
-            app.logger.info("Sending accepted email for proposal %s", proposal.id)
-            subject = 'Your EMF proposal "%s" has been accepted!' % proposal_title
-            template = "cfp_review/email/accepted_msg.txt"
+    elif reason == "still-considered":
+        subject = 'We\'re still considering your EMF proposal "%s"' % proposal_title
+        template = "cfp_review/email/not_accepted_msg.txt"
 
-        elif reason == "still-considered":
-            app.logger.info(
-                "Sending still-considered email for proposal %s", proposal.id
-            )
-            subject = 'We\'re still considering your EMF proposal "%s"' % proposal_title
-            template = "cfp_review/email/not_accepted_msg.txt"
+    elif reason == "rejected":
+        subject = 'Your EMF proposal "%s" was not accepted.' % proposal_title
+        template = "emails/cfp-rejected.txt"
 
-        elif reason == "rejected":
-            app.logger.info("Sending rejected email for proposal %s", proposal.id)
-            proposal.has_rejected_email = True
-            subject = 'Your EMF proposal "%s" was not accepted.' % proposal_title
-            template = "emails/cfp-rejected.txt"
+    elif reason == "check-your-slot":
+        subject = (
+            "Your EMF proposal '%s' has been scheduled, please check your slot"
+            % proposal_title
+        )
+        template = "emails/cfp-check-your-slot.txt"
 
-        elif reason == "check-your-slot":
-            app.logger.info(
-                "Sending check-your-slot email for proposal %s", proposal.id
-            )
-            subject = (
-                "Your EMF proposal '%s' has been scheduled, please check your slot"
-                % proposal_title
-            )
-            template = "emails/cfp-check-your-slot.txt"
+    elif reason == "please-finalise":
+        subject = "We need information about your EMF proposal '%s'" % proposal_title
+        template = "emails/cfp-please-finalise.txt"
 
-        elif reason == "please-finalise":
-            app.logger.info(
-                "Sending please-finalise email for proposal %s", proposal.id
-            )
-            subject = (
-                "We need information about your EMF proposal '%s'" % proposal_title
-            )
-            template = "emails/cfp-please-finalise.txt"
+    elif reason == "reserve-list":
+        subject = "Your EMF proposal '%s', and EMF tickets" % proposal_title
+        template = "emails/cfp-reserve-list.txt"
 
-        elif reason == "reserve-list":
-            app.logger.info("Sending reserve-list email for proposal %s", proposal.id)
-            subject = "Your EMF proposal '%s', and EMF tickets" % proposal_title
-            template = "emails/cfp-reserve-list.txt"
+    elif reason == "scheduled":
+        subject = "Your EMF %s has been scheduled ('%s')" % (
+            proposal.human_type,
+            proposal_title,
+        )
+        template = "emails/cfp-slot-scheduled.txt"
 
-        elif reason == "scheduled":
-            subject = "Your EMF %s has been scheduled ('%s')" % (
-                proposal.human_type,
-                proposal_title,
-            )
-            template = "emails/cfp-slot-scheduled.txt"
+    elif reason == "moved":
+        subject = "Your EMF %s slot has been moved ('%s')" % (
+            proposal.human_type,
+            proposal_title,
+        )
+        template = "emails/cfp-slot-moved.txt"
 
-        elif reason == "moved":
-            subject = "Your EMF %s slot has been moved ('%s')" % (
-                proposal.human_type,
-                proposal_title,
-            )
-            template = "emails/cfp-slot-moved.txt"
+    else:
+        raise Exception("Unknown cfp proposal email type %s" % reason)
 
-        else:
-            raise Exception("Unknown cfp proposal email type %s" % reason)
+    return subject, template
+
+
+def send_email_for_proposal(proposal, reason="still-considered", from_address=None):
+    proposal_title = proposal.title
+    if reason == "rejected":
+        proposal.has_rejected_email = True
+
+    while True:
+        subject, template = get_proposal_email(proposal, reason, proposal_title)
 
         app.logger.info("Sending %s email for proposal %s", reason, proposal.id)
 
@@ -251,6 +252,55 @@ def send_email_for_proposal(proposal, reason="still-considered", from_address=No
                 return False
 
 
+def queue_emails_for_proposals(proposal_reasons, description, from_address=None):
+    """ Queue emails about proposals to be sent in the background, as
+        (proposal, reason) pairs, and return the EmailBatch.
+
+        Each template is only loaded once. The emails are added to the
+        session, so commit them along with whatever they're about.
+    """
+    batch = EmailBatch(description)
+    db.session.add(batch)
+
+    send_from = from_address or app.config["CONTENT_EMAIL"]
+    templates = {}
+    for proposal, reason in proposal_reasons:
+        if reason == "rejected":
+            proposal.has_rejected_email = True
+
+        subject, template = get_proposal_email(proposal, reason, proposal.title)
+        fallback_subject, _ = get_proposal_email(proposal, reason, "")
+        if template not in templates:
+            templates[template] = BatchTemplate(template)
+
+        body = templates[template].render(
+            user=proposal.user,
+            proposal=proposal,
+            reserve_ticket_link=app.config["RESERVE_LIST_TICKET_LINK"],
+        )
+        db.session.add(
+            QueuedEmail(
+                batch, send_from, proposal.user.email, subject, body, fallback_subject
+            )
+        )
+
+    app.logger.info("Queued %s emails for %s", len(proposal_reasons), description)
+    return batch
+
+
+@cfp_review.route("/email-batches/<int:batch_id>")
+@admin_required
+def email_batch(batch_id):
+    batch = EmailBatch.query.get_or_404(batch_id)
+    failed = batch.emails.filter(QueuedEmail.error.isnot(None)).order_by(QueuedEmail.id)
+    return render_template(
+        "cfp_review/email_batch.html",
+        batch=batch,
+        progress=batch.get_progress(),
+        failed=failed.all(),
+    )
+
+
 @cfp_review.route("/proposals/<int:proposal_id>/convert", methods=["GET", "POST"])
 @admin_required
 def convert_proposal(proposal_id):
@@ -525,6 +575,10 @@ def message_batch():
     form = SendMessageForm()
     if form.validate_on_submit():
         if form.send.data:
+            batch = EmailBatch("Message to %s proposals" % len(proposals))
+            db.session.add(batch)
+            template = BatchTemplate("cfp_review/email/new_message.txt")
+
             for proposal in proposals:
                 msg = CFPMessage()
                 msg.is_to_admin = False
@@ -533,29 +587,32 @@ def message_batch():
                 msg.message = form.message.data
 
                 db.session.add(msg)
-                db.session.commit()
 
                 app.logger.info(
-                    "Sending message from %s to %s", current_user.id, proposal.user_id
+                    "Queueing message from %s to %s", current_user.id, proposal.user_id
                 )
 
                 msg_url = external_url("cfp.proposal_messages", proposal_id=proposal.id)
-                msg = Message(
-                    "New message about your EMF proposal",
-                    sender=app.config["CONTENT_EMAIL"],
-                    recipients=[proposal.user.email],
-                )
-                msg.body = render_template(
-                    "cfp_review/email/new_message.txt",
+                body = template.render(
                     url=msg_url,
                     to_user=proposal.user,
                     from_user=current_user,
                     proposal=proposal,
                 )
-                mail.send(msg)
+                db.session.add(
+                    QueuedEmail(
+                        batch,
+                        app.config["CONTENT_EMAIL"],
+                        proposal.user.email,
+                        "New message about your EMF proposal",
+                        body,
+                    )
+                )
+
+            db.session.commit()
 
             flash("Messaged %s proposals" % len(proposals), "info")
-            return redirect(url_for(".proposals", **request.args))
+            return redirect(url_for(".email_batch", batch_id=batch.id))
 
     return render_template(
         "cfp_review/message_batch.html", form=form, proposals=proposals
@@ -565,15 +622,12 @@ def message_batch():
 def get_vote_summary_sort_args(parameters):
     sort_keys = {
         # Notes == unread first then by date
-        "notes": lambda p: (
-            p[0].get_unread_vote_note_count() > 0,
-            p[0].get_total_note_count(),
-        ),
+        "notes": lambda p: (p[1]["unread"] > 0, p[1]["notes"]),
         "date": lambda p: p[0].created,
         "title": lambda p: p[0].title.lower(),
-        "votes": lambda p: p[1].get("voted", 0),
-        "blocked": lambda p: p[1].get("blocked", 0),
-        "recused": lambda p: p[1].get("recused", 0),
+        "votes": lambda p: p[1]["states"].get("voted", 0),
+        "blocked": lambda p: p[1]["states"].get("blocked", 0),
+        "recused": lambda p: p[1]["states"].get("recused", 0),
     }
 
     sort_by_key = parameters.get("sort_by")
@@ -593,47 +647,12 @@ def vote_summary():
     )
 
     proposals = proposal_query.order_by("modified").all()
+    stats = get_proposal_vote_stats(proposal_query)
+    summary = summarise_vote_stats([p.id for p in proposals], stats)
 
-    proposals_with_counts = []
-    summary = {
-        "notes_total": 0,
-        "notes_unread": 0,
-        "blocked_total": 0,
-        "recused_total": 0,
-        "voted_total": 0,
-        "min_votes": None,
-        "max_votes": 0,
-    }
-
-    for prop in proposals:
-        state_counts = {}
-        vote_count = len([v for v in prop.votes if v.state == "voted"])
-
-        if summary["min_votes"] is None or summary["min_votes"] > vote_count:
-            summary["min_votes"] = vote_count
-
-        if summary["max_votes"] < vote_count:
-            summary["max_votes"] = vote_count
-
-        for v in prop.votes:
-            # Update proposal values
-            state_counts.setdefault(v.state, 0)
-            state_counts[v.state] += 1
-
-            # Update note stats
-            if v.note is not None:
-                summary["notes_total"] += 1
+    empty = {"states": {}, "notes": 0, "unread": 0}
+    proposals_with_counts = [(prop, stats.get(prop.id, empty)) for prop in proposals]
 
-            if v.note is not None and not v.has_been_read:
-                summary["notes_unread"] += 1
-
-            # State stats
-            if v.state in ("voted", "blocked", "recused"):
-                summary[v.state + "_total"] += 1
-
-        proposals_with_counts.append((prop, state_counts))
-
-    # sort_key = lambda p: (p[0].get_unread_vote_note_count() > 0, p[0].created)
     sort_args = get_vote_summary_sort_args(request.args)
     proposals_with_counts.sort(**sort_args)
 
@@ -641,6 +660,7 @@ def vote_summary():
         "cfp_review/vote_summary.html",
         summary=summary,
         proposals_with_counts=proposals_with_counts,
+        reviewer_progress=get_reviewer_progress(),
     )
 
 
@@ -664,6 +684,7 @@ def proposal_votes(proposal_id):
                 if vote.state in states_to_set:
                     vote.set_state("stale")
                     vote.note = None
+                    review_again(vote.user_id, proposal)
                     stale_count += 1
 
             if stale_count:
@@ -676,6 +697,7 @@ def proposal_votes(proposal_id):
                 if form_vote.resolve.data and vote.state in ["blocked"]:
                     vote.set_state("resolved")
                     vote.note = None
+                    review_again(vote.user_id, proposal)
                     update_count += 1
 
             if update_count:
@@ -687,6 +709,7 @@ def proposal_votes(proposal_id):
                 if vote.state == "blocked":
                     vote.set_state("resolved")
                     vote.note = None
+                    review_again(vote.user_id, proposal)
                     resolved_count += 1
 
         if msg:
@@ -726,6 +749,7 @@ def close_round():
         Proposal.query.with_entities(Proposal, vote_subquery.c.count)
         .join(vote_subquery, Proposal.id == vote_subquery.c.proposal_id)
         .filter(Proposal.state.in_(["anonymised", "reviewed"]))
+        .options(joinedload(Proposal.user))
         .order_by(vote_subquery.c.count.desc())
         .all()
     )
@@ -768,7 +792,9 @@ def close_round():
 @cfp_review.route("/rank", methods=["GET", "POST"])
 @admin_required
 def rank():
-    proposals = Proposal.query.filter_by(state="reviewed")
+    proposals = Proposal.query.filter_by(state="reviewed").options(
+        joinedload(Proposal.user)
+    )
 
     types = request.args.getlist("type")
     if types:
@@ -776,12 +802,8 @@ def rank():
 
     proposals = proposals.all()
     form = AcceptanceForm()
-    scored_proposals = []
-
-    for prop in proposals:
-        score_list = [v.vote for v in prop.votes if v.state == "voted"]
-        score = calculate_max_normalised_score(score_list)
-        scored_proposals.append((prop, score))
+    scores = get_vote_scores()
+    scored_proposals = [(prop, scores.get(prop.id, 0)) for prop in proposals]
 
     scored_proposals = sorted(scored_proposals, key=lambda p: p[1], reverse=True)
 
@@ -790,6 +812,7 @@ def rank():
         if form.confirm.data:
             min_score = session["min_score"]
             count = 0
+            emails = []
             for (prop, score) in scored_proposals:
 
                 if score >= min_score:
@@ -800,24 +823,26 @@ def rank():
                         "accepted",
                         "accepted_reject",
                     ):
-                        send_email_for_proposal(prop, reason="accepted")
+                        emails.append((prop, "accepted"))
 
                 else:
                     if form.confirm_type.data == "accepted_unaccepted":
-                        send_email_for_proposal(prop, reason="still-considered")
+                        emails.append((prop, "still-considered"))
 
                     elif form.confirm_type.data == "accepted_reject":
                         prop.set_state("rejected")
-                        prop.has_rejected_email = True
-                        send_email_for_proposal(prop, reason="rejected")
+                        emails.append((prop, "rejected"))
 
-                db.session.commit()
+            batch = queue_emails_for_proposals(
+                emails, "Acceptance emails for %s proposals" % (types or "all")
+            )
+            db.session.commit()
 
             del session["min_score"]
             msg = "Accepted %s %s proposals; min score: %s" % (count, types, min_score)
             app.logger.info(msg)
             flash(msg, "info")
-            return redirect(url_for(".proposals", state="accepted"))
+            return redirect(url_for(".email_batch", batch_id=batch.id))
 
         elif form.set_score.data:
             preview = True
@@ -916,6 +941,7 @@ def scheduler():
         .filter(Proposal.type.in_(["talk", "workshop", "youthworkshop", "performance"]))
         .all()
     )
+    venues_by_name = {v.name: v for v in Venue.query}
 
     schedule_data = []
     for proposal in proposals:
@@ -923,9 +949,9 @@ def scheduler():
             "id": proposal.id,
             "duration": proposal.scheduled_duration,
             "is_potential": False,
-            "speakers": [proposal.user.id],
+            "speakers": [proposal.user_id],
             "text": proposal.display_title,
-            "valid_venues": [v.id for v in proposal.get_allowed_venues()],
+            "valid_venues": [v.id for v in proposal.get_allowed_venues(venues_by_name)],
             "valid_time_ranges": [
                 {"start": str(p.start), "end": str(p.end)}
                 for p in proposal.get_allowed_time_periods_with_default()
@@ -979,10 +1005,13 @@ def scheduler():
 @admin_required
 def scheduler_update():
     proposal = Proposal.query.filter_by(id=request.form["id"]).one()
-    proposal.potential_time = dateutil.parser.parse(request.form["time"]).replace(
-        tzinfo=None
-    )
-    proposal.potential_venue_id = request.form["venue"]
+    time = dateutil.parser.parse(request.form["time"]).replace(tzinfo=None)
+    venue_id = int(request.form["venue"])
+    if not proposal.can_be_scheduled_at(venue_id, time):
+        abort(400)
+
+    proposal.potential_time = time
+    proposal.potential_venue_id = venue_id
 
     changed = True
     if proposal.potential_time == proposal.scheduled_time and str(
@@ -993,37 +1022,13 @@ def scheduler_update():
         changed = False
 
     db.session.commit()
-    return jsonify({"changed": changed})
+
+    clashes = find_clashes_for(proposal)
+    return jsonify({"changed": changed, "clashes": clashes})
 
 
 @cfp_review.route("/clashfinder")
 @schedule_required
 def clashfinder():
-    select_st = select([FavouriteProposal])
-    res = db.session.execute(select_st)
-
-    user_counts = defaultdict(list)
-    popularity = Counter()
-    for user, proposal in res:
-        user_counts[user].append(proposal)
-
-    for proposals in user_counts.values():
-        popularity.update(combinations(proposals, 2))
-
-    clashes = []
-    offset = 0
-    for ((id1, id2), count) in popularity.most_common()[:1000]:
-        offset += 1
-        prop1 = Proposal.query.get(id1)
-        prop2 = Proposal.query.get(id2)
-        if prop1.overlaps_with(prop2):
-            clashes.append(
-                {
-                    "proposal_1": prop1,
-                    "proposal_2": prop2,
-                    "favourites": count,
-                    "number": offset,
-                }
-            )
-
+    clashes = find_clashes(1000)
     return render_template("cfp_review/clashfinder.html", clashes=clashes)
@@ -0,0 +1,160 @@
+""" Find proposals which are often favourited together but scheduled at the same time.
+
+    Co-favourite counts are the sparse product of the user-proposal favourites
+    matrix with itself, which Postgres can do with a self-join much faster than
+    we can by enumerating pairs in Python.
+"""
+from datetime import timedelta
+
+from sqlalchemy import select, func, and_
+
+from main import db
+from models.cfp import Proposal, FavouriteProposal
+
+
+def get_favourite_pair_counts(limit=None):
+    """ Pairs of proposals favourited by the same people, most common first.
+
+        Returns a list of ((proposal_id_1, proposal_id_2), count), where
+        proposal_id_1 < proposal_id_2.
+    """
+    fav_1 = FavouriteProposal.alias("fav_1")
+    fav_2 = FavouriteProposal.alias("fav_2")
+    count = func.count().label("count")
+
+    query = (
+        select([fav_1.c.proposal_id, fav_2.c.proposal_id, count])
+        .select_from(
+            fav_1.join(
+                fav_2,
+                and_(
+                    fav_1.c.user_id == fav_2.c.user_id,
+                    fav_1.c.proposal_id < fav_2.c.proposal_id,
+                ),
+            )
+        )
+        .group_by(fav_1.c.proposal_id, fav_2.c.proposal_id)
+        .order_by(count.desc(), fav_1.c.proposal_id, fav_2.c.proposal_id)
+    )
+    if limit is not None:
+        query = query.limit(limit)
+
+    return [((id_1, id_2), count) for id_1, id_2, count in db.session.execute(query)]
+
+
+def get_favourite_counts_for(proposal_id):
+    """ How many people favourited each other proposal along with this one. """
+    fav_1 = FavouriteProposal.alias("fav_1")
+    fav_2 = FavouriteProposal.alias("fav_2")
+
+    query = (
+        select([fav_2.c.proposal_id, func.count()])
+        .select_from(
+            fav_1.join(
+                fav_2,
+                and_(
+                    fav_1.c.user_id == fav_2.c.user_id,
+                    fav_1.c.proposal_id != fav_2.c.proposal_id,
+                ),
+            )
+        )
+        .where(fav_1.c.proposal_id == proposal_id)
+        .group_by(fav_2.c.proposal_id)
+    )
+
+    return dict(db.session.execute(query).fetchall())
+
+
+def get_proposal_interval(proposal):
+    """ When a proposal is on, preferring its potential time if it has one.
+
+        Returns None if it hasn't been scheduled.
+    """
+    start = proposal.potential_time or proposal.scheduled_time
+    if start is None or not proposal.scheduled_duration:
+        return None
+    return (start, start + timedelta(minutes=proposal.scheduled_duration))
+
+
+def intervals_overlap(interval_1, interval_2):
+    """ Whether two (start, end) intervals overlap. Ones which only touch,
+        i.e. back-to-back talks, don't.
+    """
+    return interval_1[0] < interval_2[1] and interval_2[0] < interval_1[1]
+
+
+def find_overlapping_pairs(intervals):
+    """ Find all overlapping pairs in a list of (id, start, end) intervals
+        by sweeping through them in start order.
+
+        Returns a set of (id_1, id_2) tuples, where id_1 < id_2.
+    """
+    pairs = set()
+    active = []
+    for id, start, end in sorted(intervals, key=lambda i: i[1]):
+        active = [a for a in active if a[2] > start]
+        for other_id, _, _ in active:
+            pairs.add((min(id, other_id), max(id, other_id)))
+        active.append((id, start, end))
+
+    return pairs
+
+
+def find_clashes(limit=1000):
+    """ Clashes among the most commonly co-favourited pairs of proposals.
+
+        "number" is the position of the pair in that list.
+    """
+    pair_counts = get_favourite_pair_counts(limit)
+    proposal_ids = {id for pair, _ in pair_counts for id in pair}
+    if not proposal_ids:
+        return []
+
+    proposals = {p.id: p for p in Proposal.query.filter(Proposal.id.in_(proposal_ids))}
+
+    intervals = []
+    for proposal in proposals.values():
+        interval = get_proposal_interval(proposal)
+        if interval:
+            intervals.append((proposal.id, *interval))
+    overlapping = find_overlapping_pairs(intervals)
+
+    clashes = []
+    for number, (pair, count) in enumerate(pair_counts, 1):
+        if pair in overlapping:
+            clashes.append(
+                {
+                    "proposal_1": proposals[pair[0]],
+                    "proposal_2": proposals[pair[1]],
+                    "favourites": count,
+                    "number": number,
+                }
+            )
+
+    return clashes
+
+
+def find_clashes_for(proposal):
+    """ Proposals which clash with this one and share favourites with it,
+        most favourites first. This only looks at the one proposal, so it's
+        quick enough to run every time it moves.
+    """
+    interval = get_proposal_interval(proposal)
+    counts = get_favourite_counts_for(proposal.id)
+    if interval is None or not counts:
+        return []
+
+    clashes = []
+    for other in Proposal.query.filter(Proposal.id.in_(counts.keys())):
+        other_interval = get_proposal_interval(other)
+        if other_interval and intervals_overlap(interval, other_interval):
+            clashes.append(
+                {
+                    "id": other.id,
+                    "title": other.display_title,
+                    "favourites": counts[other.id],
+                }
+            )
+
+    clashes.sort(key=lambda c: (-c["favourites"], c["id"]))
+    return clashes
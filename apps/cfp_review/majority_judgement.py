@@ -23,6 +23,7 @@ The majority judgement algorithm is this:
        median rating from the member's score
     5. Repeat steps 2-4 until the submissions are sorted or each group is empty
 """
+from functools import lru_cache
 
 
 class MajorityJudgementException(Exception):
@@ -61,7 +62,7 @@ def calculate_score(score_list, base=3):
     if len(score_list) == 0:
         return None
     score_list = sorted(list(score_list)[:])
-    res = []
+    res = 0
     while score_list:
         score = get_floor_median(score_list)
         if not (0 <= score < base):
@@ -69,12 +70,77 @@ def calculate_score(score_list, base=3):
                 ("Incorrectly set base. Got %s, " "expected 0 <= values < %s")
                 % (score, base)
             )
-        res.append(str(score))
+        # Add the score as the next digit in the given base
+        res = res * base + score
         score_list.remove(score)
 
-    res = "".join(res)
-    # Use int to cast from an arbitrary base
-    return int(res, base)
+    return res
+
+
+@lru_cache(maxsize=None)
+def get_majority_judgement_order(length):
+    """
+    The positions, in a sorted score list of the given length, that the MJ
+    algorithm takes its digits from.
+
+    Which position holds the median in each round only depends on how many
+    ratings are left, so this is the same for every list of the same length.
+
+    e.g. for a list of length 4 the order is (1, 2, 0, 3)
+    """
+    positions = list(range(length))
+    order = []
+    while positions:
+        position = get_floor_median(positions)
+        order.append(position)
+        positions.remove(position)
+    return tuple(order)
+
+
+def calculate_scores(score_lists, base=3):
+    """
+    Calculate the MJ score for many submissions at once.
+
+    score_lists is a dict of submission to list of ratings. Returns a dict of
+    submission to score, which will match calculate_score for each list.
+    Submissions with no ratings are left out.
+
+    Rather than repeatedly finding and removing the median, this reorders the
+    sorted ratings using get_majority_judgement_order, which is cached for
+    each length, and reads them off as digits.
+    """
+    scores = {}
+    for key, score_list in score_lists.items():
+        if not score_list:
+            continue
+
+        score_list = sorted(score_list)
+        if not (0 <= score_list[0] and score_list[-1] < base):
+            bad_score = score_list[0] if score_list[0] < 0 else score_list[-1]
+            raise MajorityJudgementException(
+                ("Incorrectly set base. Got %s, " "expected 0 <= values < %s")
+                % (bad_score, base)
+            )
+
+        score = 0
+        for position in get_majority_judgement_order(len(score_list)):
+            score = score * base + score_list[position]
+        scores[key] = score
+
+    return scores
+
+
+def calculate_max_normalised_scores(score_lists, base=3):
+    """
+    Calculate calculate_max_normalised_score for many submissions at once.
+
+    Unlike calculate_scores, submissions with no ratings score 0.
+    """
+    scores = calculate_scores(score_lists, base)
+    return {
+        key: float(scores[key]) / (base ** len(score_list) - 1) if score_list else 0
+        for key, score_list in score_lists.items()
+    }
 
 
 def calculate_max_normalised_score(score_list, base=3):
@@ -85,8 +151,8 @@ def calculate_max_normalised_score(score_list, base=3):
     if not score_list:
         return 0
 
-    max_score_digit = str(base - 1)
-    max_score = int(max_score_digit * len(score_list), base)
+    # The largest number with len(score_list) digits in this base
+    max_score = base ** len(score_list) - 1
     return float(calculate_score(score_list, base)) / max_score
 
 
@@ -0,0 +1,199 @@
+""" Each reviewer's queue of proposals to review.
+
+    Queues are kept in the review_queue table, so finding the next proposal
+    is an index lookup. They're topped up from the proposals with the fewest
+    votes, so votes are spread evenly across proposals.
+"""
+from sqlalchemy import func, exists
+from sqlalchemy.orm import aliased
+
+from main import db
+from models.cfp import Proposal, CFPVote, ReviewQueueEntry
+from models.user import User
+from .vote_stats import REVIEWED_TYPES
+
+REVIEW_QUEUE_SIZE = 30
+# Votes in these states mean the reviewer needs to look at the proposal again
+REVIEW_AGAIN_STATES = ["new", "resolved", "stale"]
+
+
+def can_review(user, proposal):
+    if proposal.state != "anonymised":
+        return False
+
+    if user.has_permission("cfp_admin"):
+        return True
+
+    if proposal.user_id == user.id:
+        return False
+
+    # Only admins review installations, and youth workshops are reviewed separately
+    return proposal.type in REVIEWED_TYPES
+
+
+def get_reviewable_proposals(user):
+    proposal_query = Proposal.query.filter(Proposal.state == "anonymised")
+
+    if not user.has_permission("cfp_admin"):
+        proposal_query = proposal_query.filter(
+            Proposal.user_id != user.id, Proposal.type.in_(REVIEWED_TYPES)
+        )
+
+    return proposal_query
+
+
+def get_review_queue(user):
+    """ The proposals in a reviewer's queue, in order.
+
+        Sets is_new on each proposal if it should be highlighted.
+    """
+    entries = (
+        ReviewQueueEntry.query.join(Proposal)
+        .filter(ReviewQueueEntry.user_id == user.id, Proposal.state == "anonymised")
+        .order_by(ReviewQueueEntry.position)
+        .with_entities(Proposal, ReviewQueueEntry.is_new)
+    )
+
+    proposals = []
+    for proposal, is_new in entries:
+        proposal.is_new = is_new
+        proposals.append(proposal)
+    return proposals
+
+
+def fill_review_queue(user, size=REVIEW_QUEUE_SIZE, proposals=None):
+    """ Top up a reviewer's queue to size proposals.
+
+        Proposals they need to look at again come first, then the ones with
+        the fewest votes, in random order. Candidates can be limited by
+        passing a query of proposals the reviewer can review.
+    """
+    if proposals is None:
+        proposals = get_reviewable_proposals(user)
+
+    ReviewQueueEntry.query.filter(
+        ReviewQueueEntry.user_id == user.id,
+        ReviewQueueEntry.proposal_id.in_(
+            Proposal.query.filter(Proposal.state != "anonymised")
+            .with_entities(Proposal.id)
+            .subquery()
+        ),
+    ).delete(synchronize_session=False)
+
+    count, last_position = (
+        db.session.query(func.count(), func.max(ReviewQueueEntry.position))
+        .filter(ReviewQueueEntry.user_id == user.id)
+        .one()
+    )
+    if count >= size:
+        return
+
+    user_votes = aliased(CFPVote, CFPVote.query.filter_by(user_id=user.id).subquery())
+    vote_counts = (
+        db.session.query(CFPVote.proposal_id, func.count().label("count"))
+        .filter(CFPVote.state == "voted")
+        .group_by(CFPVote.proposal_id)
+        .subquery()
+    )
+    queued = exists().where(
+        (ReviewQueueEntry.user_id == user.id)
+        & (ReviewQueueEntry.proposal_id == Proposal.id)
+    )
+
+    candidates = (
+        proposals.outerjoin(user_votes)
+        .outerjoin(vote_counts, vote_counts.c.proposal_id == Proposal.id)
+        .filter(
+            user_votes.id.is_(None) | user_votes.state.in_(REVIEW_AGAIN_STATES),
+            ~queued,
+        )
+        .order_by(
+            user_votes.id.is_(None),
+            func.coalesce(vote_counts.c.count, 0),
+            func.random(),
+        )
+        .with_entities(Proposal.id, user_votes.id)
+        .limit(size - count)
+    )
+
+    position = last_position or 0
+    for proposal_id, vote_id in candidates:
+        position += 1
+        db.session.add(
+            ReviewQueueEntry(user.id, proposal_id, position, is_new=vote_id is not None)
+        )
+
+
+def clear_review_queue(user):
+    ReviewQueueEntry.query.filter_by(user_id=user.id).delete()
+
+
+def remove_from_review_queue(user, proposal):
+    ReviewQueueEntry.query.filter_by(user_id=user.id, proposal_id=proposal.id).delete()
+
+
+def review_again(user_id, proposal):
+    """ Put a proposal at the front of a reviewer's queue, e.g. because
+        their vote has gone stale.
+    """
+    entry = ReviewQueueEntry.query.get((user_id, proposal.id))
+    first_position = (
+        db.session.query(func.min(ReviewQueueEntry.position))
+        .filter(ReviewQueueEntry.user_id == user_id)
+        .scalar()
+    )
+    position = (first_position or 0) - 1
+
+    if entry is None:
+        db.session.add(ReviewQueueEntry(user_id, proposal.id, position, is_new=True))
+    else:
+        entry.position = position
+        entry.is_new = True
+
+
+def add_to_review_queues(proposal):
+    """ Add a newly anonymised proposal to the end of every queue that's in use. """
+    reviewers = User.query.filter(
+        exists().where(ReviewQueueEntry.user_id == User.id)
+    ).all()
+    last_positions = dict(
+        db.session.query(ReviewQueueEntry.user_id, func.max(ReviewQueueEntry.position))
+        .group_by(ReviewQueueEntry.user_id)
+        .all()
+    )
+
+    already_queued = {
+        user_id
+        for user_id, in db.session.query(ReviewQueueEntry.user_id).filter_by(
+            proposal_id=proposal.id
+        )
+    }
+
+    for reviewer in reviewers:
+        if reviewer.id in already_queued or not can_review(reviewer, proposal):
+            continue
+
+        position = last_positions[reviewer.id] + 1
+        db.session.add(
+            ReviewQueueEntry(reviewer.id, proposal.id, position, is_new=True)
+        )
+
+
+def get_next_in_review_queue(user, proposal_id):
+    """ The entry after proposal_id in a reviewer's queue, and how many
+        entries are left from there, or (None, 0).
+    """
+    entry = ReviewQueueEntry.query.get((user.id, proposal_id))
+    if entry is None:
+        return None, 0
+
+    following = ReviewQueueEntry.query.join(Proposal).filter(
+        ReviewQueueEntry.user_id == user.id,
+        ReviewQueueEntry.position > entry.position,
+        Proposal.state == "anonymised",
+    )
+
+    next_entry = following.order_by(ReviewQueueEntry.position).first()
+    if next_entry is None:
+        return None, 0
+    return next_entry, following.count()
@@ -0,0 +1,58 @@
+""" Majority judgement scores for all proposals, calculated in one go.
+
+    Scores are cached, and the cache is cleared whenever a vote changes.
+"""
+from collections import defaultdict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from main import db, cache
+from models.cfp import CFPVote
+from .majority_judgement import calculate_max_normalised_scores
+
+
+@cache.cached(timeout=60, key_prefix="get_vote_scores")
+def get_vote_scores():
+    """ Max normalised score for each proposal with votes, by proposal id. """
+    votes = (
+        db.session.query(CFPVote.proposal_id, CFPVote.vote)
+        .filter(CFPVote.state == "voted")
+        .order_by(CFPVote.proposal_id, CFPVote.vote)
+    )
+
+    score_lists = defaultdict(list)
+    for proposal_id, vote in votes:
+        score_lists[proposal_id].append(vote)
+
+    return calculate_max_normalised_scores(score_lists)
+
+
+def refresh_vote_scores():
+    cache.delete(get_vote_scores.make_cache_key())
+
+
+@event.listens_for(Session, "after_flush")
+def vote_change(session, flush_context):
+    for obj in session.new | session.deleted:
+        if isinstance(obj, CFPVote):
+            session.info["votes_changed"] = True
+            return
+
+    for obj in session.dirty:
+        if isinstance(obj, CFPVote) and session.is_modified(
+            obj, include_collections=False
+        ):
+            session.info["votes_changed"] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def vote_commit(session):
+    if session.info.pop("votes_changed", False):
+        refresh_vote_scores()
+
+
+@event.listens_for(Session, "after_rollback")
+def vote_rollback(session):
+    session.info.pop("votes_changed", None)
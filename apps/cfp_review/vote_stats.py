@@ -0,0 +1,134 @@
+""" Vote counts for the review team, calculated in the database.
+
+    The vote summary used to load every vote for every proposal, and count
+    notes for each one separately. This gets everything it needs from a
+    single grouped query.
+"""
+from sqlalchemy import func
+
+from main import db
+from models.cfp import Proposal, CFPVote, VOTE_STATES
+from models.permission import Permission
+from models.user import User
+
+# Non-admin reviewers don't see installations or youth workshops
+REVIEWED_TYPES = ["talk", "workshop"]
+CAST_VOTE_STATES = ["voted", "blocked", "recused"]
+
+
+def get_proposal_vote_stats(proposal_query):
+    """ Vote counts for each proposal in proposal_query, by proposal id.
+
+        "states" only contains states with at least one vote. "notes" and
+        "unread" match Proposal.get_total_note_count and
+        Proposal.get_unread_vote_note_count. "unread_notes" is the number of
+        votes with notes which haven't been read.
+    """
+    proposal_ids = proposal_query.with_entities(Proposal.id).subquery()
+
+    columns = [func.count().filter(CFPVote.state == state) for state in VOTE_STATES]
+    columns += [
+        func.count().filter(CFPVote.note != ""),
+        func.count().filter(CFPVote.has_been_read.is_(False)),
+        func.count().filter(
+            CFPVote.note.isnot(None) & CFPVote.has_been_read.is_(False)
+        ),
+        func.count(CFPVote.note),
+    ]
+
+    query = (
+        db.session.query(CFPVote.proposal_id, *columns)
+        .filter(CFPVote.proposal_id.in_(proposal_ids))
+        .group_by(CFPVote.proposal_id)
+    )
+
+    stats = {}
+    for proposal_id, *counts in query:
+        state_counts = dict(zip(VOTE_STATES, counts))
+        notes, unread, unread_notes, all_notes = counts[len(VOTE_STATES) :]
+        stats[proposal_id] = {
+            "states": {s: c for s, c in state_counts.items() if c},
+            "notes": notes,
+            "unread": unread,
+            "unread_notes": unread_notes,
+            "all_notes": all_notes,
+        }
+
+    return stats
+
+
+def summarise_vote_stats(proposal_ids, stats):
+    """ Totals across all proposals, for the top of the vote summary. """
+    summary = {
+        "notes_total": 0,
+        "notes_unread": 0,
+        "blocked_total": 0,
+        "recused_total": 0,
+        "voted_total": 0,
+        "min_votes": None,
+        "max_votes": 0,
+    }
+
+    empty = {"states": {}, "unread_notes": 0, "all_notes": 0}
+    for proposal_id in proposal_ids:
+        proposal_stats = stats.get(proposal_id, empty)
+        vote_count = proposal_stats["states"].get("voted", 0)
+
+        if summary["min_votes"] is None or summary["min_votes"] > vote_count:
+            summary["min_votes"] = vote_count
+
+        if summary["max_votes"] < vote_count:
+            summary["max_votes"] = vote_count
+
+        summary["notes_total"] += proposal_stats["all_notes"]
+        summary["notes_unread"] += proposal_stats["unread_notes"]
+
+        for state in CAST_VOTE_STATES:
+            summary[state + "_total"] += proposal_stats["states"].get(state, 0)
+
+    return summary
+
+
+def get_reviewer_progress():
+    """ How many proposals each reviewer has voted on, out of the number
+        they've been asked to review, i.e. anonymised talks and workshops
+        which aren't their own.
+
+        Returns a list of (user, votes cast, proposals to review).
+    """
+    reviewable = Proposal.query.filter(
+        Proposal.state == "anonymised", Proposal.type.in_(REVIEWED_TYPES)
+    )
+    reviewable_count = reviewable.count()
+
+    own_counts = dict(
+        reviewable.with_entities(Proposal.user_id, func.count())
+        .group_by(Proposal.user_id)
+        .all()
+    )
+
+    cast_counts = dict(
+        db.session.query(CFPVote.user_id, func.count())
+        .filter(
+            CFPVote.state.in_(CAST_VOTE_STATES),
+            CFPVote.proposal_id.in_(reviewable.with_entities(Proposal.id).subquery()),
+        )
+        .group_by(CFPVote.user_id)
+        .all()
+    )
+
+    reviewers = (
+        User.query.join(User.permissions)
+        .filter(Permission.name == "cfp_reviewer")
+        .order_by(User.name)
+        .all()
+    )
+
+    return [
+        (
+            reviewer,
+            cast_counts.get(reviewer.id, 0),
+            reviewable_count - own_counts.get(reviewer.id, 0),
+        )
+        for reviewer in reviewers
+    ]
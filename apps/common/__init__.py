@@ -149,6 +149,20 @@ def send_template_email(subject, to, sender, template, **kwargs):
     mail.send(msg)
 
 
+class BatchTemplate(object):
+    """ Renders a template many times, e.g. for a batch of emails, only
+        loading it and running the context processors once.
+    """
+
+    def __init__(self, template_name):
+        self.template = app.jinja_env.get_or_select_template(template_name)
+        self.context = {}
+        app.update_template_context(self.context)
+
+    def render(self, **context):
+        return self.template.render(dict(self.context, **context))
+
+
 def create_current_user(email: str, name: str):
     user = User(email, name)
 
@@ -5,8 +5,22 @@ from collections import OrderedDict
 from main import db
 from models import to_dict
 
+# Rows fetched at a time from server-side cursors
+EXPORT_BATCH_SIZE = 1000
+
 
 class ExportEncoder(JSONEncoder):
+    """ Encodes exports as it reads them.
+
+        Queries are streamed from a server-side cursor, and lists are
+        converted item by item, so large tables don't have to fit in memory.
+    """
+
+    def __init__(self, **kwargs):
+        # Generators are how we stream
+        kwargs["iterable_as_array"] = True
+        super().__init__(**kwargs)
+
     def default(self, obj):
         if isinstance(obj, datetime):
             return obj.isoformat(" ")
@@ -25,11 +39,11 @@ class ExportEncoder(JSONEncoder):
                 obj = dct
 
             if isinstance(obj, db.Model.query_class):
-                return [_iterconvert(o) for o in obj]
+                return (_iterconvert(o) for o in obj.yield_per(EXPORT_BATCH_SIZE))
             elif isinstance(obj, db.Model):
                 return to_dict(obj)
             elif isinstance(obj, (list, tuple)):
-                return [_iterconvert(o) for o in obj]
+                return (_iterconvert(o) for o in obj)
             elif isinstance(obj, dict):
                 items = obj.items()
                 if not isinstance(obj, OrderedDict):
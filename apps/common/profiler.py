@@ -0,0 +1,151 @@
+""" A sampling profiler for individual requests in production.
+
+    A request is profiled if:
+      - an admin adds ?_profile=1, or
+      - it has an X-Profile-Token header matching PROFILE_TOKEN, or
+      - it's picked at random, at the rate for its endpoint in
+        PROFILE_SAMPLE_RATES, e.g. {"schedule.main_year": 0.01}.
+
+    While it runs, a thread records the request thread's stack every
+    PROFILE_INTERVAL seconds. SQL and template rendering times are also
+    recorded, and the profile is saved to the request_profile table, which
+    keeps the last PROFILE_BUFFER_SIZE profiles. Browse them at
+    /admin/profiles.
+
+    Requests which aren't profiled only pay for a couple of dict lookups.
+"""
+import hmac
+import random
+import sys
+import time
+from collections import Counter
+from threading import Event, Thread, get_ident
+
+from flask import (
+    g,
+    request,
+    before_render_template,
+    template_rendered,
+    current_app as app,
+)
+from flask_login import current_user
+
+from main import db
+from models.request_profile import RequestProfile
+from .query_stats import get_query_stats
+
+
+def get_stack(frame):
+    frames = []
+    while frame is not None:
+        frames.append(
+            "%s:%s" % (frame.f_globals.get("__name__", "?"), frame.f_code.co_name)
+        )
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+
+class Sampler:
+    """ Counts the stacks a thread is in, until stopped """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = Event()
+        self.thread = Thread(target=self.run, name="profiler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[get_stack(frame)] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+class RequestProfiler:
+    def __init__(self, reason, interval):
+        self.reason = reason
+        self.started = time.time()
+        self.template_duration = 0
+        self.template_started = None
+        self.sampler = Sampler(get_ident(), interval)
+
+
+def get_profile_reason():
+    """ Why to profile this request, or None """
+    if request.args.get("_profile"):
+        if current_user.is_authenticated and current_user.has_permission("admin"):
+            return "admin"
+
+    token = request.headers.get("X-Profile-Token")
+    if token and app.config.get("PROFILE_TOKEN"):
+        if hmac.compare_digest(token, app.config["PROFILE_TOKEN"]):
+            return "token"
+
+    rate = app.config.get("PROFILE_SAMPLE_RATES", {}).get(request.endpoint)
+    if rate and random.random() < rate:
+        return "sample"
+
+    return None
+
+
+def start_profile():
+    reason = get_profile_reason()
+    if reason is None:
+        return
+
+    g.profiler = RequestProfiler(reason, app.config.get("PROFILE_INTERVAL", 0.005))
+    g.profiler.sampler.start()
+
+
+def finish_profile(response):
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return
+
+    profiler.sampler.stop()
+    query_stats = get_query_stats()
+    profile = {
+        "method": request.method,
+        "path": request.full_path.rstrip("?"),
+        "endpoint": request.endpoint,
+        "status_code": response.status_code,
+        "reason": profiler.reason,
+        "duration": time.time() - profiler.started,
+        "sql_count": query_stats.count if query_stats else 0,
+        "sql_duration": query_stats.seconds if query_stats else 0,
+        "template_duration": profiler.template_duration,
+        "sample_interval": profiler.sampler.interval,
+        "stacks": dict(profiler.sampler.stacks),
+    }
+    save_profile(profile, app.config.get("PROFILE_BUFFER_SIZE", 200))
+
+
+def save_profile(profile, buffer_size):
+    # Separately from the request's session, which may not be committed
+    table = RequestProfile.__table__
+    with db.engine.begin() as connection:
+        id = connection.execute(table.insert().returning(table.c.id), profile).scalar()
+        connection.execute(table.delete().where(table.c.id <= id - buffer_size))
+
+
+@before_render_template.connect
+def start_template_timer(sender, template, context, **extra):
+    profiler = g.get("profiler")
+    if profiler is not None and profiler.template_started is None:
+        profiler.template_started = time.time()
+
+
+@template_rendered.connect
+def stop_template_timer(sender, template, context, **extra):
+    profiler = g.get("profiler")
+    if profiler is not None and profiler.template_started is not None:
+        profiler.template_duration += time.time() - profiler.template_started
+        profiler.template_started = None
@@ -0,0 +1,72 @@
+""" Counts the SQL queries made by each request.
+
+    The totals are exported to Prometheus by endpoint. Queries slower than
+    SLOW_QUERY_SECONDS are logged as they finish, and statements repeated
+    more than REPEATED_QUERY_LIMIT times in one request, which usually
+    means a relationship is being loaded in a loop, are logged at the end.
+"""
+import logging
+import time
+from collections import Counter
+
+from flask import g, has_app_context, current_app as app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger(__name__)
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+
+    def repeated(self, limit):
+        """ Statements run more than limit times, most frequent first """
+        return [(s, c) for s, c in self.statements.most_common() if c > limit]
+
+
+def start_query_stats():
+    g.query_stats = QueryStats()
+
+
+def get_query_stats():
+    """ The current request's stats, if we're counting """
+    if not has_app_context():
+        return None
+    return g.get("query_stats")
+
+
+def log_query_stats(stats, endpoint):
+    limit = app.config.get("REPEATED_QUERY_LIMIT", 10)
+    for statement, count in stats.repeated(limit):
+        log.warning(
+            "Possible N+1 in %s, statement ran %s of %s queries: %s",
+            endpoint,
+            count,
+            stats.count,
+            " ".join(statement.split()),
+        )
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_start_time"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["query_start_time"]
+    stats = get_query_stats()
+    if stats is None:
+        return
+
+    stats.record(statement, seconds)
+    if seconds > app.config.get("SLOW_QUERY_SECONDS", 0.5):
+        log.warning("Slow query (%.3fs): %s", seconds, " ".join(statement.split()))
@@ -1,12 +1,7 @@
 import io
-from lxml import etree
 import asyncio
 
 from flask import Markup, render_template, current_app as app
-from pyppeteer.launcher import launch
-import barcode
-from barcode.writer import ImageWriter, SVGWriter
-import segno
 
 from main import external_url
 from models import event_year
@@ -60,6 +55,7 @@ def render_receipt(user, png=False, pdf=False):
 def render_pdf(url, html):
     # This needs to fetch URLs found within the page, so if
     # you're running a dev server, use app.run(processes=2)
+    from pyppeteer.launcher import launch
 
     async def to_pdf():
         browser = await launch(
@@ -96,6 +92,8 @@ def render_pdf(url, html):
 
 
 def make_qrfile(data, **kwargs):
+    import segno
+
     qrfile = io.BytesIO()
     qr = segno.make_qr(data)
     qr.save(qrfile, **kwargs)
@@ -104,6 +102,8 @@ def make_qrfile(data, **kwargs):
 
 
 def format_inline_qr(data):
+    from lxml import etree
+
     qrfile = make_qrfile(data, kind="svg", svgclass=None)
 
     root = etree.XML(qrfile.read())
@@ -121,6 +121,10 @@ def make_qr_png(url):
 
 
 def format_inline_barcode(data):
+    from lxml import etree
+    import barcode
+    from barcode.writer import SVGWriter
+
     barcodefile = io.BytesIO()
 
     # data is written into the SVG without a CDATA, so base64 encode it
@@ -139,6 +143,9 @@ def format_inline_barcode(data):
 
 
 def make_barcode_png(data, **options):
+    import barcode
+    from barcode.writer import ImageWriter
+
     barcodefile = io.BytesIO()
 
     code128 = barcode.get("code128", data, writer=ImageWriter())
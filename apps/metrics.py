@@ -1,4 +1,17 @@
-from flask import Response, Blueprint
+""" Prometheus metrics.
+
+    Request metrics are collected by each worker and combined by
+    MultiProcessCollector. Business metrics (purchases, payments and so on)
+    are counted from a snapshot in the cache, so scrapes don't touch the
+    database. When the snapshot is older than METRICS_SNAPSHOT_SECONDS, the
+    worker which gets the lock rebuilds it in the background, and other
+    scrapes carry on serving the old one. emf_metrics_snapshot_age_seconds
+    says how old it is.
+"""
+import time
+from threading import Thread
+
+from flask import Response, Blueprint, current_app as app
 from prometheus_client import (
     PlatformCollector,
     CollectorRegistry,
@@ -7,13 +20,16 @@ from prometheus_client import (
 )
 from prometheus_client.core import GaugeMetricFamily, Histogram, Counter
 from prometheus_client.multiprocess import MultiProcessCollector
+import pendulum
 from sqlalchemy import cast, String
 
+from main import cache
 from models import count_groups
 from models.payment import Payment
 from models.product import Product
 from models.purchase import Purchase, AdmissionTicket
 from models.cfp import Proposal
+from models.scheduled_task import ScheduledTaskResult
 
 metrics = Blueprint("metric", __name__)
 
@@ -23,11 +39,119 @@ request_duration = Histogram(
 request_total = Counter(
     "emf_request_total", "Total request count", ["endpoint", "method", "http_status"]
 )
+request_query_count = Histogram(
+    "emf_request_queries",
+    "SQL queries per request",
+    ["endpoint", "method"],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, float("inf")),
+)
+request_query_duration = Histogram(
+    "emf_request_query_duration_seconds",
+    "Time spent in SQL queries per request",
+    ["endpoint", "method"],
+)
+
+SNAPSHOT_KEY = "metrics_snapshot"
+SNAPSHOT_LOCK_KEY = "metrics_snapshot_lock"
+
+# name: (description, labels)
+BUSINESS_METRICS = {
+    "emf_purchases": ("Tickets purchased", ["product", "state", "type"]),
+    "emf_payments": ("Payments received", ["provider", "state"]),
+    "emf_attendees": ("Attendees", ["checked_in", "badged_up"]),
+    "emf_proposals": ("CfP Submissions", ["type", "state"]),
+    "emf_scheduled_task_duration_seconds": ("Last run time of each task", ["task"]),
+    "emf_scheduled_task_lag_seconds": ("How late each task last started", ["task"]),
+    "emf_scheduled_task_failures": ("Failed task runs in the last day", ["task"]),
+}
+
+
+def get_groups(query, *entities):
+    # Plain tuples, so they can be pickled into the cache
+    return [tuple(row) for row in count_groups(query, *entities)]
+
+
+def get_task_stats():
+    """ (duration, lag) of each task's latest run, as (value, name) pairs """
+    latest = (
+        ScheduledTaskResult.query.distinct(ScheduledTaskResult.name)
+        .order_by(ScheduledTaskResult.name, ScheduledTaskResult.start_time.desc())
+        .all()
+    )
+    durations = [(r.duration.total_seconds(), r.name) for r in latest]
+    lags = [(r.result.get("lag", 0), r.name) for r in latest]
+    return durations, lags
+
+
+def build_snapshot():
+    """ Counts for each business metric, as (count, *labels) """
+    task_durations, task_lags = get_task_stats()
+    return {
+        "generated": time.time(),
+        "emf_purchases": get_groups(
+            Purchase.query.join(Product), Product.name, Purchase.state, Purchase.type
+        ),
+        "emf_payments": get_groups(Payment.query, Payment.provider, Payment.state),
+        "emf_attendees": get_groups(
+            AdmissionTicket.query,
+            cast(AdmissionTicket.checked_in, String),
+            cast(AdmissionTicket.badge_issued, String),
+        ),
+        "emf_proposals": get_groups(Proposal.query, Proposal.type, Proposal.state),
+        "emf_scheduled_task_duration_seconds": task_durations,
+        "emf_scheduled_task_lag_seconds": task_lags,
+        "emf_scheduled_task_failures": get_groups(
+            ScheduledTaskResult.query.filter(
+                ScheduledTaskResult.start_time > pendulum.now().subtract(days=1),
+                ScheduledTaskResult.result["exception"] != None,  # noqa: E711
+            ),
+            ScheduledTaskResult.name,
+        ),
+    }
+
+
+def refresh_snapshot():
+    snapshot = build_snapshot()
+    cache.set(SNAPSHOT_KEY, snapshot, timeout=0)
+    return snapshot
+
 
+def refresh_snapshot_in_background(flask_app):
+    def refresh():
+        with flask_app.app_context():
+            try:
+                refresh_snapshot()
+            except Exception:
+                flask_app.logger.exception("Failed to refresh metrics snapshot")
+            finally:
+                cache.delete(SNAPSHOT_LOCK_KEY)
 
-def gauge_groups(gauge, query, *entities):
-    for count, *key in count_groups(query, *entities):
-        gauge.add_metric(key, count)
+    Thread(target=refresh, name="metrics-snapshot", daemon=True).start()
+
+
+def get_snapshot():
+    """ The latest snapshot, which is refreshed if it's too old.
+
+        Only if there's no snapshot at all (e.g. the cache was cleared)
+        does this wait for the database.
+    """
+    interval = app.config.get("METRICS_SNAPSHOT_SECONDS", 60)
+    snapshot = cache.get(SNAPSHOT_KEY)
+    if snapshot is not None and time.time() - snapshot["generated"] < interval:
+        return snapshot
+
+    # Only one worker refreshes at a time. The lock expires in case it dies.
+    if not cache.add(SNAPSHOT_LOCK_KEY, True, timeout=interval):
+        return snapshot
+
+    if snapshot is None:
+        try:
+            return refresh_snapshot()
+        finally:
+            cache.delete(SNAPSHOT_LOCK_KEY)
+
+    refresh_snapshot_in_background(app._get_current_object())
+    return snapshot
 
 
 class ExternalMetrics:
@@ -37,46 +161,44 @@ class ExternalMetrics:
 
     def collect(self):
         # Strictly, we should include all possible combinations, with 0
+        snapshot = get_snapshot()
+        if snapshot is None:
+            return []
 
-        emf_purchases = GaugeMetricFamily(
-            "emf_purchases", "Tickets purchased", labels=["product", "state", "type"]
-        )
-        emf_payments = GaugeMetricFamily(
-            "emf_payments", "Payments received", labels=["provider", "state"]
-        )
-        emf_attendees = GaugeMetricFamily(
-            "emf_attendees", "Attendees", labels=["checked_in", "badged_up"]
-        )
-        emf_proposals = GaugeMetricFamily(
-            "emf_proposals", "CfP Submissions", labels=["type", "state"]
-        )
+        families = []
+        for name, (description, labels) in BUSINESS_METRICS.items():
+            gauge = GaugeMetricFamily(name, description, labels=labels)
+            for count, *key in snapshot[name]:
+                gauge.add_metric(key, count)
+            families.append(gauge)
 
-        gauge_groups(
-            emf_purchases,
-            Purchase.query.join(Product),
-            Product.name,
-            Purchase.state,
-            Purchase.type,
-        )
-        gauge_groups(emf_payments, Payment.query, Payment.provider, Payment.state)
-        gauge_groups(
-            emf_attendees,
-            AdmissionTicket.query,
-            cast(AdmissionTicket.checked_in, String),
-            cast(AdmissionTicket.badge_issued, String),
+        families.append(
+            GaugeMetricFamily(
+                "emf_metrics_snapshot_age_seconds",
+                "Age of the business metrics snapshot",
+                value=time.time() - snapshot["generated"],
+            )
         )
-        gauge_groups(emf_proposals, Proposal.query, Proposal.type, Proposal.state)
+        return families
 
-        return [emf_purchases, emf_payments, emf_attendees, emf_proposals]
+
+_registry = None
+
+
+def get_registry():
+    """ Collectors read their data on each scrape, so they're set up once """
+    global _registry
+    if _registry is None:
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+        PlatformCollector(registry)
+        ExternalMetrics(registry)
+        _registry = registry
+    return _registry
 
 
 @metrics.route("/metrics")
 def collect_metrics():
-    registry = CollectorRegistry()
-    MultiProcessCollector(registry)
-    PlatformCollector(registry)
-    ExternalMetrics(registry)
-
-    data = generate_latest(registry)
+    data = generate_latest(get_registry())
 
     return Response(data, mimetype=CONTENT_TYPE_LATEST)
@@ -17,10 +17,9 @@ from flask import (
 from flask_login import login_required
 from flask_mail import Message
 from wtforms import SubmitField
-import gocardless_pro.errors
 from sqlalchemy.orm.exc import NoResultFound
 
-from main import db, mail, external_url, gocardless_client, csrf
+from main import db, mail, external_url, gocardless_pro, gocardless_client, csrf
 from models import event_year
 from models.payment import GoCardlessPayment
 from ..common import feature_enabled
@@ -4,13 +4,12 @@ from flask_login import login_required
 from wtforms import StringField, SubmitField
 from wtforms.validators import ValidationError
 from wtforms.fields.html5 import IntegerRangeField
-import gocardless_pro.errors
 
 from . import payments
 from .common import get_user_payment_or_abort
 from ..common import feature_flag
 from ..common.forms import Form
-from main import db, gocardless_client
+from main import db, gocardless_pro, gocardless_client
 from models import RefundRequest
 
 
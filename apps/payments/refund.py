@@ -1,5 +1,4 @@
 from decimal import Decimal
-from stripe.error import StripeError
 from flask import current_app as app, render_template
 from flask_mail import Message
 
@@ -31,7 +30,7 @@ def create_stripe_refund(
         stripe_refund = stripe.Refund.create(
             charge=payment.charge_id, amount=refund.amount_int, metadata=metadata
         )
-    except StripeError as e:
+    except stripe.error.StripeError as e:
         raise RefundException("Error creating Stripe refund") from e
 
     if stripe_refund.status not in ("succeeded", "pending"):
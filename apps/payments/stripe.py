@@ -23,7 +23,6 @@ from flask_login import login_required, current_user
 from flask_mail import Message
 from wtforms import SubmitField
 from sqlalchemy.orm.exc import NoResultFound
-from stripe.error import AuthenticationError
 
 from main import db, stripe, mail, csrf
 from models.payment import StripePayment
@@ -416,7 +415,7 @@ def stripe_validate():
     try:
         webhooks = stripe.WebhookEndpoint.list()
         result.append((True, "Connection to Stripe API succeeded"))
-    except AuthenticationError as e:
+    except stripe.error.AuthenticationError as e:
         result.append((False, f"Connecting to Stripe failed: {e}"))
         return result
 
@@ -1,5 +1,6 @@
 from flask import current_app as app
-import pytransferwise
+
+from main import pytransferwise
 
 
 def transferwise_validate():
@@ -1,6 +1,5 @@
 import html
 import random
-import pendulum
 from collections import defaultdict
 
 from flask import render_template, redirect, url_for, flash, request, abort
@@ -18,9 +17,10 @@ from models.admin_message import AdminMessage
 
 from ..common import feature_flag
 
-from . import schedule, event_tz
+from . import schedule
 from .historic import talks_historic, item_historic, historic_talk_data
 from .data import _get_scheduled_proposals, _get_upcoming, _get_priority_sorted_venues
+from .upcoming import get_now
 
 
 @schedule.route("/schedule/")
@@ -236,8 +236,7 @@ def now_and_next():
 
 @schedule.route("/time-machine")
 def time_machine():
-    # now = pendulum.datetime(2018, 8, 31, 12, 00, tz=event_tz)
-    now = pendulum.now(event_tz)
+    now = get_now()
     now_time = now.time()
     now_weekday = now.weekday()
 
@@ -271,6 +270,8 @@ def time_machine():
             if talk["start_date"].time() <= now_time:
                 talks_now[year][talk["venue"]].append(talk)
             else:
+                # The historic data is shared, so copy it rather than modify it
+                talk = dict(talk)
                 talk["starts_in"] = talk["start_date"].time() - now_time
                 talks_next[year][talk["venue"]].append(talk)
 
@@ -1,16 +1,76 @@
-import pendulum  # preferred over datetime
-from collections import defaultdict
+import secrets
+from urllib.parse import quote
 from flask_login import current_user
 from slugify import slugify_unicode as slugify
+from sqlalchemy import event, literal
+from sqlalchemy.orm import Session, joinedload, selectinload
 
-from models.cfp import Proposal, Venue
-from models.ical import CalendarSource
+from main import db, cache
+from models import event_year
+from models.cfp import Proposal, Venue, FavouriteProposal
+from models.ical import CalendarSource, CalendarEvent, FavouriteCalendarEvent
+from models.map import MapObject
 
 from main import external_url
 from . import event_tz
+from .upcoming import UpcomingIndex, get_now
 
 
-def _get_proposal_dict(proposal, favourites_ids):
+def _scheduled_proposals_query():
+    """ All scheduled proposals, with everything the schedule needs loaded up front.
+
+        Subclass columns (e.g. workshop cost) live on the same table, so
+        with_polymorphic avoids a refresh query per workshop.
+    """
+    return (
+        Proposal.query.with_polymorphic("*")
+        .filter(
+            Proposal.state.in_(["accepted", "finished"]),
+            Proposal.scheduled_time.isnot(None),
+            Proposal.scheduled_venue_id.isnot(None),
+            Proposal.scheduled_duration.isnot(None),
+        )
+        .options(joinedload(Proposal.scheduled_venue), joinedload(Proposal.user))
+    )
+
+
+def _published_calendar_sources():
+    return CalendarSource.query.filter_by(enabled=True, published=True).options(
+        joinedload(CalendarSource.mapobj), selectinload(CalendarSource.events)
+    )
+
+
+def _schedule_link_base():
+    """ Build the URL prefix for schedule items once, rather than calling
+        url_for for every item.
+    """
+    return external_url(".main_year", year=event_year())
+
+
+def _get_favourite_ids(user):
+    """ Fetch the IDs of a user's favourites in one query, without loading the objects. """
+    proposal_ids = db.session.query(
+        literal("proposal").label("kind"), FavouriteProposal.c.proposal_id.label("id")
+    ).filter(FavouriteProposal.c.user_id == user.id)
+    event_ids = db.session.query(
+        literal("external").label("kind"), FavouriteCalendarEvent.c.event_id
+    ).filter(FavouriteCalendarEvent.c.user_id == user.id)
+
+    proposal_favourites = set()
+    external_favourites = set()
+    for kind, id in proposal_ids.union_all(event_ids):
+        if kind == "proposal":
+            proposal_favourites.add(id)
+        else:
+            external_favourites.add(id)
+
+    return proposal_favourites, external_favourites
+
+
+def _get_proposal_dict(proposal, favourites_ids, link_base=None):
+    if link_base is None:
+        link_base = _schedule_link_base()
+
     res = {
         "id": proposal.id,
         "slug": proposal.slug,
@@ -27,8 +87,8 @@ def _get_proposal_dict(proposal, favourites_ids):
         "may_record": proposal.may_record,
         "is_fave": proposal.id in favourites_ids,
         "source": "database",
-        "link": external_url(".line_up_proposal", proposal_id=proposal.id),
     }
+    res["link"] = "{}/{}-{}".format(link_base, proposal.id, quote(res["slug"]))
     if proposal.type in ["workshop", "youthworkshop"]:
         res["cost"] = proposal.display_cost
         res["equipment"] = proposal.display_participant_equipment
@@ -36,14 +96,27 @@ def _get_proposal_dict(proposal, favourites_ids):
     return res
 
 
-def _get_ical_dict(event, favourites_ids):
+def _get_ical_dict(event, favourites_ids, link_base=None, latlon=None):
+    """ If latlon is passed in, it should be the event source's location,
+        which saves decoding the map geometry for every event.
+    """
+    if link_base is None:
+        link_base = _schedule_link_base()
+
+    if latlon is None:
+        latlon = event.latlon
+
+    map_link = None
+    if latlon:
+        map_link = "https://map.emfcamp.org/#20/%s/%s" % (latlon[0], latlon[1])
+
     res = {
         "id": -event.id,
         "start_date": event_tz.localize(event.start_dt),
         "end_date": event_tz.localize(event.end_dt),
         "venue": event.location or "(Unknown)",
-        "latlon": event.latlon,
-        "map_link": event.map_link,
+        "latlon": latlon,
+        "map_link": map_link,
         "title": event.summary,
         "speaker": "",
         "user_id": None,
@@ -52,7 +125,7 @@ def _get_ical_dict(event, favourites_ids):
         "may_record": False,
         "is_fave": event.id in favourites_ids,
         "source": "external",
-        "link": external_url(".line_up_external", event_id=event.id),
+        "link": "{}/external/{}".format(link_base, event.id),
     }
     if event.type in ["workshop", "youthworkshop"]:
         res["cost"] = event.display_cost
@@ -61,84 +134,160 @@ def _get_ical_dict(event, favourites_ids):
     return res
 
 
-def _get_scheduled_proposals(filter_obj={}, override_user=None):
-    if override_user:
-        user = override_user
-    else:
-        user = current_user
-
-    if user.is_anonymous:
-        proposal_favourites = external_favourites = []
-    else:
-        proposal_favourites = [f.id for f in user.favourites]
-        external_favourites = [f.id for f in user.calendar_favourites]
+def _build_schedule():
+    link_base = _schedule_link_base()
 
-    schedule = Proposal.query.filter(
-        Proposal.state.in_(["accepted", "finished"]),
-        Proposal.scheduled_time.isnot(None),
-        Proposal.scheduled_venue_id.isnot(None),
-        Proposal.scheduled_duration.isnot(None),
-    ).all()
-
-    schedule = [_get_proposal_dict(p, proposal_favourites) for p in schedule]
+    schedule = [
+        _get_proposal_dict(p, set(), link_base) for p in _scheduled_proposals_query()
+    ]
 
-    ical_sources = CalendarSource.query.filter_by(enabled=True, published=True)
+    for source in _published_calendar_sources():
+        if not source.events:
+            continue
 
-    for source in ical_sources:
+        latlon = source.latlon
         for e in source.events:
-            d = _get_ical_dict(e, external_favourites)
+            d = _get_ical_dict(e, set(), link_base, latlon)
             d["venue"] = source.mapobj.name
             schedule.append(d)
 
-    if "is_favourite" in filter_obj and filter_obj["is_favourite"]:
-        schedule = [s for s in schedule if s.get("is_fave", False)]
+    return schedule
 
-    if "venue" in filter_obj:
-        schedule = [s for s in schedule if s["venue"] in filter_obj.getlist("venue")]
 
-    return schedule
+@cache.cached(timeout=60, key_prefix="get_schedule_snapshot")
+def _get_schedule_snapshot():
+    """ The schedule without any per-user data, shared between requests.
 
+        Callers must copy items before modifying them, as the simple cache
+        hands out the same objects every time.
+    """
+    return _build_schedule()
 
-def _get_upcoming(filter_obj={}, override_user=None):
-    # now = pendulum.now(event_tz)
-    now = pendulum.datetime(2018, 8, 31, 13, 0, tz=event_tz)
-    proposals = _get_scheduled_proposals(filter_obj, override_user)
-    upcoming = [_convert_time_to_str(p) for p in proposals if p["end_date"] > now]
 
-    upcoming = sorted(upcoming, key=lambda p: p["start_date"])
+@cache.cached(timeout=60, key_prefix="get_schedule_version")
+def _get_schedule_version():
+    """ Changes whenever the schedule does, so per-process data can be rebuilt. """
+    return secrets.token_hex(8)
+
+
+# Cached functions derived from the snapshot, which need clearing along with it
+schedule_caches = [_get_schedule_snapshot, _get_schedule_version]
+
+_upcoming_index = None
 
-    limit = filter_obj.get("limit", default=2, type=int)
 
-    # Already filtered by venue in _get_scheduled_proposals
-    if limit <= 0:
-        return upcoming
+def get_upcoming_index():
+    global _upcoming_index
 
-    by_venue = defaultdict(list)
-    for p in upcoming:
-        by_venue[p["venue"]].append(p)
+    version = _get_schedule_version()
+    if _upcoming_index is None or _upcoming_index.version != version:
+        _upcoming_index = UpcomingIndex(_get_schedule_snapshot(), version)
+    return _upcoming_index
 
-    res = {slugify(k.lower()): v[:limit] for k, v in by_venue.items()}
 
+def refresh_schedule_cache():
+    for f in schedule_caches:
+        cache.delete(f.make_cache_key())
+
+
+SCHEDULE_MODELS = (Proposal, Venue, CalendarSource, CalendarEvent, MapObject)
+
+
+@event.listens_for(Session, "after_flush")
+def schedule_change(session, flush_context):
+    for obj in session.new | session.deleted:
+        if isinstance(obj, SCHEDULE_MODELS):
+            session.info["schedule_changed"] = True
+            return
+
+    for obj in session.dirty:
+        # Favouriting touches the proposal's collections, which we don't care about
+        if isinstance(obj, SCHEDULE_MODELS) and session.is_modified(
+            obj, include_collections=False
+        ):
+            session.info["schedule_changed"] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def schedule_commit(session):
+    if session.info.pop("schedule_changed", False):
+        refresh_schedule_cache()
+
+
+@event.listens_for(Session, "after_rollback")
+def schedule_rollback(session):
+    session.info.pop("schedule_changed", None)
+
+
+def _get_user_favourite_ids(user):
+    if user.is_anonymous:
+        return set(), set()
+    return _get_favourite_ids(user)
+
+
+def _with_favourites(events, favourite_ids):
+    """ Copies of shared schedule items, with is_fave set for one user """
+    proposal_favourites, external_favourites = favourite_ids
+
+    res = []
+    for e in events:
+        if e["source"] == "database":
+            is_fave = e["id"] in proposal_favourites
+        else:
+            is_fave = -e["id"] in external_favourites
+        res.append(dict(e, is_fave=is_fave))
     return res
 
 
-def _convert_time_to_str(event):
-    event["start_time"] = event["start_date"].strftime("%H:%M")
-    event["end_time"] = event["end_date"].strftime("%H:%M")
+def _get_scheduled_proposals(filter_obj={}, override_user=None):
+    if override_user:
+        user = override_user
+    else:
+        user = current_user
+
+    schedule = _with_favourites(_get_schedule_snapshot(), _get_user_favourite_ids(user))
 
-    event["start_date"] = event["start_date"].strftime("%Y-%m-%d %H:%M:00")
-    event["end_date"] = event["end_date"].strftime("%Y-%m-%d %H:%M:00")
-    return event
+    if "is_favourite" in filter_obj and filter_obj["is_favourite"]:
+        schedule = [s for s in schedule if s.get("is_fave", False)]
+
+    if "venue" in filter_obj:
+        schedule = [s for s in schedule if s["venue"] in filter_obj.getlist("venue")]
+
+    return schedule
+
+
+def _get_upcoming(filter_obj={}, override_user=None, now=None):
+    if now is None:
+        now = get_now()
+
+    limit = filter_obj.get("limit", default=2, type=int)
+    venues = filter_obj.getlist("venue")
+
+    if filter_obj.get("is_favourite"):
+        # Favourites are per-user, so don't touch the shared index
+        schedule = _get_scheduled_proposals(filter_obj, override_user)
+        return UpcomingIndex(schedule).upcoming(now, limit=limit)
+
+    upcoming = get_upcoming_index().upcoming(now, venues, limit)
+
+    # The index is shared between users, so add favourites to copies
+    favourite_ids = _get_user_favourite_ids(override_user or current_user)
+    if isinstance(upcoming, list):
+        return _with_favourites(upcoming, favourite_ids)
+    return {
+        venue: _with_favourites(events, favourite_ids)
+        for venue, events in upcoming.items()
+    }
 
 
 def _get_priority_sorted_venues(venues_to_allow):
     main_venues = Venue.query.filter().all()
     main_venue_names = [(v.name, "main", v.priority) for v in main_venues]
 
-    ical_sources = CalendarSource.query.filter_by(enabled=True, published=True)
     ical_source_names = [
         (v.mapobj.name, "ical", v.priority)
-        for v in ical_sources
+        for v in _published_calendar_sources()
         if v.mapobj and v.events
     ]
 
@@ -1,8 +1,10 @@
 import json
+import hashlib
 from icalendar import Calendar, Event
-from flask import request, abort, app, Response
+from flask import request, abort, current_app as app, Response
 from flask_login import current_user
 
+from main import cache
 from models import event_year
 from models.user import User
 from models.cfp import Proposal
@@ -13,9 +15,14 @@ from .historic import feed_historic
 from .data import (
     _get_scheduled_proposals,
     _get_proposal_dict,
-    _convert_time_to_str,
+    _get_favourite_ids,
+    _get_schedule_snapshot,
+    schedule_caches,
+    _scheduled_proposals_query,
+    _schedule_link_base,
     _get_upcoming,
 )
+from .upcoming import _convert_time_to_str
 from . import schedule
 
 
@@ -46,18 +53,10 @@ def schedule_frab(year):
     if year != event_year():
         return feed_historic(year, "frab")
 
-    schedule = (
-        Proposal.query.filter(
-            Proposal.state.in_(["accepted", "finished"]),
-            Proposal.scheduled_time.isnot(None),
-            Proposal.scheduled_venue_id.isnot(None),
-            Proposal.scheduled_duration.isnot(None),
-        )
-        .order_by(Proposal.scheduled_time)
-        .all()
-    )
+    schedule = _scheduled_proposals_query().order_by(Proposal.scheduled_time)
 
-    schedule = [_get_proposal_dict(p, []) for p in schedule]
+    link_base = _schedule_link_base()
+    schedule = [_get_proposal_dict(p, set(), link_base) for p in schedule]
 
     frab = export_frab(schedule)
 
@@ -80,21 +79,50 @@ def schedule_ical(year):
     cal.add("version", "2.0")
 
     for event in schedule:
-        cal_event = Event()
-        cal_event.add("uid", event["id"])
-        cal_event.add("summary", event["title"])
-        cal_event.add("description", _format_event_description(event))
-        cal_event.add("location", event["venue"])
-        cal_event.add("dtstart", event["start_date"])
-        cal_event.add("dtend", event["end_date"])
-        cal.add_component(cal_event)
+        cal.add_component(_make_ical_event(event))
 
     return Response(cal.to_ical(), mimetype="text/calendar")
 
 
-@schedule.route("/favourites.json")
-@feature_flag("LINE_UP")
-def favourites_json():
+def _make_ical_event(event):
+    cal_event = Event()
+    cal_event.add("uid", event["id"])
+    cal_event.add("summary", event["title"])
+    cal_event.add("description", _format_event_description(event))
+    cal_event.add("location", event["venue"])
+    cal_event.add("dtstart", event["start_date"])
+    cal_event.add("dtend", event["end_date"])
+    return cal_event
+
+
+@cache.cached(timeout=60, key_prefix="get_favourite_fragments")
+def _get_favourite_fragments():
+    """ Pre-serialise each schedule item for the favourites feeds.
+
+        Returns a version hash for the whole schedule, and a list of
+        (kind, id, venue, json, ical) tuples in schedule order.
+    """
+    fragments = []
+    version = hashlib.sha1()
+    for event in _get_schedule_snapshot():
+        if event["source"] == "database":
+            key = ("proposal", event["id"])
+        else:
+            key = ("external", -event["id"])
+
+        cal_event = _make_ical_event(event)
+        event = _convert_time_to_str(dict(event, is_fave=True))
+        fragment = (*key, event["venue"], json.dumps(event), cal_event.to_ical())
+        fragments.append(fragment)
+        version.update(fragment[3].encode("utf-8") + fragment[4])
+
+    return {"version": version.hexdigest(), "fragments": fragments}
+
+
+schedule_caches.append(_get_favourite_fragments)
+
+
+def _favourites_user():
     code = request.args.get("token", None)
     user = None
     if code:
@@ -103,31 +131,64 @@ def favourites_json():
         user = current_user
     if not user:
         abort(404)
-
-    schedule = [
-        _convert_time_to_str(p)
-        for p in _get_scheduled_proposals(request.args, override_user=user)
-        if p["is_fave"]
+    return user
+
+
+def _favourites_response(user, fmt, generate, mimetype):
+    """ Stream the user's favourites from the shared fragments, or send a 304
+        if the client already has this version.
+    """
+    proposal_favourites, external_favourites = _get_favourite_ids(user)
+    data = _get_favourite_fragments()
+
+    venues = request.args.getlist("venue")
+    fragments = [
+        f
+        for f in data["fragments"]
+        if (f[0] == "proposal" and f[1] in proposal_favourites)
+        or (f[0] == "external" and f[1] in external_favourites)
     ]
+    if venues:
+        fragments = [f for f in fragments if f[2] in venues]
 
-    # NB this is JSON in a top-level array (security issue for low-end browsers)
-    return Response(json.dumps(schedule), mimetype="application/json")
+    etag = hashlib.sha1(
+        "{}:{}:{}:{}:{}".format(
+            fmt, user.id, user.name, data["version"], [f[:2] for f in fragments]
+        ).encode("utf-8")
+    ).hexdigest()
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(generate(fragments), mimetype=mimetype)
+
+    response.set_etag(etag)
+    response.cache_control.private = True
+    return response
+
+
+@schedule.route("/favourites.json")
+@feature_flag("LINE_UP")
+def favourites_json():
+    user = _favourites_user()
+
+    def generate(fragments):
+        # NB this is JSON in a top-level array (security issue for low-end browsers)
+        yield "["
+        for i, f in enumerate(fragments):
+            if i:
+                yield ","
+            yield f[3]
+        yield "]"
+
+    return _favourites_response(user, "json", generate, "application/json")
 
 
 @schedule.route("/favourites.ical")
 @schedule.route("/favourites.ics")
 @feature_flag("LINE_UP")
 def favourites_ical():
-    code = request.args.get("token", None)
-    user = None
-    if code:
-        user = User.get_by_api_token(app.config.get("SECRET_KEY"), str(code))
-    if not current_user.is_anonymous:
-        user = current_user
-    if not user:
-        abort(404)
-
-    schedule = _get_scheduled_proposals(request.args, override_user=user)
+    user = _favourites_user()
     title = "EMF {} Favourites for {}".format(event_year(), user.name)
 
     cal = Calendar()
@@ -136,19 +197,16 @@ def favourites_ical():
     cal.add("X-WR-CALDESC", title)
     cal.add("version", "2.0")
 
-    for event in schedule:
-        if not event["is_fave"]:
-            continue
-        cal_event = Event()
-        cal_event.add("uid", event["id"])
-        cal_event.add("summary", event["title"])
-        cal_event.add("description", _format_event_description(event))
-        cal_event.add("location", event["venue"])
-        cal_event.add("dtstart", event["start_date"])
-        cal_event.add("dtend", event["end_date"])
-        cal.add_component(cal_event)
+    # Splice the pre-serialised events into an otherwise empty calendar
+    header, footer = cal.to_ical().rsplit(b"END:VCALENDAR", 1)
 
-    return Response(cal.to_ical(), mimetype="text/calendar")
+    def generate(fragments):
+        yield header
+        for f in fragments:
+            yield f[4]
+        yield b"END:VCALENDAR" + footer
+
+    return _favourites_response(user, "ical", generate, "text/calendar")
 
 
 @schedule.route("/now-and-next.json")
@@ -171,9 +229,9 @@ def item_json(year, proposal_id, slug=None):
         abort(404)
 
     if not current_user.is_anonymous:
-        favourites_ids = [f.id for f in current_user.favourites]
+        favourites_ids, _ = _get_favourite_ids(current_user)
     else:
-        favourites_ids = []
+        favourites_ids = set()
 
     data = _get_proposal_dict(proposal, favourites_ids)
 
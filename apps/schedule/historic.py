@@ -2,6 +2,9 @@
 
     These are served from static files in this repository as the database is wiped every year.
 """
+from collections import defaultdict
+from functools import lru_cache
+
 from flask import render_template, abort, redirect, url_for, send_file
 from dateutil.parser import parse as date_parse
 
@@ -25,16 +28,25 @@ def parse_event(event):
     return event
 
 
+@lru_cache(maxsize=None)
+def load_historic_schedule(year):
+    """ Parse a year's archived schedule into a dict of ID to event.
+
+        The archive never changes, so this is only done once per process.
+        Don't modify the results.
+    """
+    events = {}
+    for event in load_archive_file(year, "public", "schedule.json"):
+        events.setdefault(event["id"], parse_event(event))
+    return events
+
+
 def item_historic(year, proposal_id, slug):
     """ Handler to display a detail page for a schedule item."""
     abort_if_invalid_year(year)
 
-    #  We might want to look at performance here but I'm not sure it's a huge issue at the moment
-    data = load_archive_file(year, "public", "schedule.json")
-    for item in data:
-        if item["id"] == proposal_id:
-            break
-    else:
+    item = load_historic_schedule(year).get(proposal_id)
+    if item is None:
         abort(404)
 
     correct_slug = proposal_slug(item["title"])
@@ -43,42 +55,50 @@ def item_historic(year, proposal_id, slug):
             url_for(".item", year=year, proposal_id=proposal_id, slug=correct_slug)
         )
 
-    return render_template(
-        "schedule/historic/item.html", event=parse_event(item), year=year
-    )
+    return render_template("schedule/historic/item.html", event=item, year=year)
 
 
+@lru_cache(maxsize=None)
 def historic_talk_data(year):
-    schedule = load_archive_file(year, "public", "schedule.json")
+    """ Archived talks and workshops grouped by venue, sorted by title.
+
+        This is cached like load_historic_schedule, so don't modify the results.
+    """
+    schedule = load_historic_schedule(year)
     event_data = load_archive_file(year, "event.json", raise_404=False)
 
-    stage_events = []
-    workshop_events = []
-    youth_events = []
+    events_by_type = {"stage": [], "workshop": [], "youth": []}
+    titles_seen = defaultdict(set)
 
-    for event in [parse_event(event) for event in schedule]:
+    for event in schedule.values():
         if event["source"] == "external":
             continue
 
         # Hack to remove Stitch's "hilarious" failed <script>
         if "<script>" in event.get("speaker", ""):
+            event = dict(event)
             event["speaker"] = event["speaker"][
                 0 : event["speaker"].find("<script>")
             ]  # "Some idiot"
 
         # All official (non-external) content is on a stage or workshop, so we don't care about anything that isn't
         if event["type"] in ("talk", "performance"):
-            events_list = stage_events
+            event_type = "stage"
         elif event["type"] == "workshop":
-            events_list = workshop_events
+            event_type = "workshop"
         elif event["type"] == "youthworkshop":
-            events_list = youth_events
+            event_type = "youth"
         else:
             continue
 
         # Make sure it's not already in the list (basically repeated workshops)
-        if not any(e["title"] == event["title"] for e in events_list):
-            events_list.append(event)
+        if event["title"] not in titles_seen[event_type]:
+            titles_seen[event_type].add(event["title"])
+            events_by_type[event_type].append(event)
+
+    stage_events = events_by_type["stage"]
+    workshop_events = events_by_type["workshop"]
+    youth_events = events_by_type["youth"]
 
     def sort_key(event):
         # Sort should avoid leading punctuation and whitespace and be case-insensitive
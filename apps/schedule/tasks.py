@@ -3,9 +3,10 @@ import json
 from collections import OrderedDict
 
 from flask import current_app as app
+from sqlalchemy.orm import selectinload
 
 from main import db
-from models.ical import CalendarSource
+from models.ical import CalendarSource, refresh_calendar_sources
 
 from . import schedule
 
@@ -41,8 +42,12 @@ def create_calendars(self):
 
 @schedule.cli.command("refresh_calendars")
 def refresh_calendars(self):
-    for source in CalendarSource.query.filter_by(enabled=True).all():
-        source.refresh()
+    sources = (
+        CalendarSource.query.filter_by(enabled=True)
+        .options(selectinload(CalendarSource.events))
+        .all()
+    )
+    refresh_calendar_sources(sources)
 
     db.session.commit()
 
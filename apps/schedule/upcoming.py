@@ -0,0 +1,125 @@
+""" Now & Next
+
+    The now-and-next pages run on screens around site and refresh constantly,
+    so rather than rebuilding the schedule for each request we keep an index of
+    events per venue in each process, sorted by start time. This is rebuilt
+    whenever the schedule snapshot changes, and the output for each minute is
+    cached, so most requests are a dictionary lookup.
+"""
+from bisect import bisect_right
+from collections import defaultdict
+
+import pendulum
+from flask import current_app as app
+from slugify import slugify_unicode as slugify
+
+from . import event_tz
+
+
+def get_now():
+    """ The current time at the event.
+
+        Set SCHEDULE_NOW in the config to pretend it's a different time,
+        e.g. to test the now-and-next displays before the event.
+    """
+    fake_now = app.config.get("SCHEDULE_NOW")
+    if fake_now:
+        return pendulum.parse(fake_now, tz=event_tz)
+    return pendulum.now(event_tz)
+
+
+class VenueTimeline:
+    """ Events in one venue, sorted by start time.
+
+        max_ends[i] is the latest end time of events[:i + 1], which lets us stop
+        looking for events still running once everything before has finished.
+    """
+
+    def __init__(self, events):
+        self.events = sorted(events, key=lambda e: e["start_date"])
+        self.starts = [e["start_date"] for e in self.events]
+
+        self.max_ends = []
+        for e in self.events:
+            if self.max_ends:
+                self.max_ends.append(max(self.max_ends[-1], e["end_date"]))
+            else:
+                self.max_ends.append(e["end_date"])
+
+    def upcoming(self, now, limit=None):
+        """ Events which haven't finished by now, in start order. """
+        first_future = bisect_right(self.starts, now)
+
+        running = []
+        i = first_future - 1
+        while i >= 0 and self.max_ends[i] > now:
+            if self.events[i]["end_date"] > now:
+                running.append(self.events[i])
+            i -= 1
+        running.reverse()
+
+        if limit is None:
+            return running + self.events[first_future:]
+        return (running + self.events[first_future : first_future + limit])[:limit]
+
+
+class UpcomingIndex:
+    """ A VenueTimeline for each venue, plus one for the whole schedule. """
+
+    def __init__(self, schedule, version=None):
+        self.version = version
+
+        by_venue = defaultdict(list)
+        for event in schedule:
+            by_venue[event["venue"]].append(event)
+
+        self.venues = {v: VenueTimeline(events) for v, events in by_venue.items()}
+        self.everything = VenueTimeline(schedule)
+        self._results = {}
+
+    def upcoming(self, now, venues=None, limit=2):
+        """ Upcoming events grouped by slugified venue name, or a flat list of
+            everything upcoming if limit is 0 or less.
+
+            Results are cached for each minute, so now is rounded down.
+        """
+        now = now.replace(second=0, microsecond=0)
+        venues = tuple(sorted(venues)) if venues else None
+
+        results = self._results
+        if results.get("minute") != now:
+            results = self._results = {"minute": now}
+
+        key = (venues, limit)
+        if key not in results:
+            results[key] = self._upcoming(now, venues, limit)
+        return results[key]
+
+    def _upcoming(self, now, venues, limit):
+        if limit <= 0:
+            events = self.everything.upcoming(now)
+            if venues:
+                events = [e for e in events if e["venue"] in venues]
+            return [_convert_time_to_str(dict(e)) for e in events]
+
+        res = {}
+        for venue, timeline in self.venues.items():
+            if venues and venue not in venues:
+                continue
+
+            events = timeline.upcoming(now, limit)
+            if events:
+                res[slugify(venue.lower())] = [
+                    _convert_time_to_str(dict(e)) for e in events
+                ]
+
+        return res
+
+
+def _convert_time_to_str(event):
+    event["start_time"] = event["start_date"].strftime("%H:%M")
+    event["end_time"] = event["end_date"].strftime("%H:%M")
+
+    event["start_date"] = event["start_date"].strftime("%Y-%m-%d %H:%M:00")
+    event["end_date"] = event["end_date"].strftime("%Y-%m-%d %H:%M:00")
+    return event
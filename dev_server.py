@@ -3,7 +3,7 @@ import logger
 import random
 import shutil
 
-from main import create_app, db
+from main import create_app, reset_db_after_fork
 from flask import request, _request_ctx_stack
 from flask_mail import email_dispatched
 
@@ -24,7 +24,7 @@ ppid = os.getpid()
 @app.before_request
 def fix_shared_state():
     if os.getpid() != ppid:
-        db.engine.dispose()
+        reset_db_after_fork()
         random.seed()
 
 
@@ -4,6 +4,9 @@ import prometheus_client.multiprocess
 
 
 def on_starting(server):
+    # With --preload, this runs after the app is loaded, so removes any
+    # files the master has created. Workers create their own when they
+    # first record a value, as prometheus_client checks the pid.
     prometheus_dir = os.environ.get("prometheus_multiproc_dir")
 
     if os.path.exists(prometheus_dir):
@@ -11,6 +14,15 @@ def on_starting(server):
     os.makedirs(prometheus_dir, exist_ok=True)
 
 
+def post_fork(server, worker):
+    # With --preload, the app is created once in the master, and workers
+    # inherit it. They mustn't share its connections, though.
+    from main import init_worker
+    from wsgi import flask_app
+
+    init_worker(flask_app)
+
+
 def child_exit(server, worker):
     # this keeps livesum and liveall accurate
     # other metrics will hang around until restart
@@ -1,4 +1,6 @@
 import time
+import types
+import importlib
 import yaml
 import secrets
 import logging
@@ -21,9 +23,6 @@ from flask_wtf import CSRFProtect
 from flask_cors import CORS
 from loggingmanager import create_logging_manager, set_user_id
 from werkzeug.exceptions import HTTPException
-import stripe
-import pytransferwise
-import gocardless_pro
 
 
 # If we have logging handlers set up here, don't touch them.
@@ -46,6 +45,80 @@ naming_convention = {
 }
 db = SQLAlchemy(metadata=MetaData(naming_convention=naming_convention))
 
+# Connections and sessions inherited from our parent process, see
+# reset_db_after_fork
+_inherited_from_parent = []
+
+
+def reset_db_after_fork():
+    """ Give a forked process its own connections. Needs an app context.
+
+        Connections inherited from the parent share its sockets, so they
+        mustn't be used or even closed here, as closing them would end the
+        parent's sessions too. Instead, the parent's pool and session are
+        kept alive, and replaced with empty ones.
+    """
+    if db.session.registry.has():
+        _inherited_from_parent.append(db.session.registry())
+        db.session.registry.clear()
+
+    _inherited_from_parent.append(db.engine.pool)
+    db.engine.pool = db.engine.pool.recreate()
+
+
+class LazyModule(types.ModuleType):
+    """ A module which isn't imported until it's first used.
+
+        Payment libraries are slow to import and big, and most processes
+        (CLI commands, and most requests) never touch them. Functions
+        registered with configure are run on the module once it's imported,
+        or straight away if it already has been.
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._module = None
+        self._configure = []
+
+    def configure(self, func):
+        self._configure.append(func)
+        if self._module is not None:
+            func(self._module)
+        return func
+
+    def _load(self):
+        if self._module is None:
+            module = importlib.import_module(self.__name__)
+            for func in self._configure:
+                func(module)
+            self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        module = self._load()
+        try:
+            return getattr(module, attr)
+        except AttributeError:
+            # e.g. gocardless_pro.errors, which isn't imported by its parent
+            return importlib.import_module(module.__name__ + "." + attr)
+
+
+class LazyClient(object):
+    """ An API client which is created when it's first used """
+
+    def __init__(self):
+        self._factory = None
+        self._client = None
+
+    def configure(self, factory):
+        self._factory = factory
+        self._client = None
+
+    def __getattr__(self, attr):
+        if self._client is None:
+            self._client = self._factory()
+        return getattr(self._client, attr)
+
 
 def include_object(object, name, type_, reflected, compare_to):
     if (type_, name, reflected) == ("table", "spatial_ref_sys", True):
@@ -69,7 +142,10 @@ mail = Mail()
 login_manager = LoginManager()
 static_digest = FlaskStaticDigest()
 toolbar = DebugToolbarExtension()
-gocardless_client = None
+stripe = LazyModule("stripe")
+pytransferwise = LazyModule("pytransferwise")
+gocardless_pro = LazyModule("gocardless_pro")
+gocardless_client = LazyClient()
 volunteer_admin = None
 
 
@@ -90,12 +166,25 @@ def create_app(dev_server=False, config_override=None):
         else:
             logging.root.setLevel(logging.DEBUG)
 
-    from apps.metrics import request_duration, request_total
+    from apps.metrics import (
+        request_duration,
+        request_total,
+        request_query_count,
+        request_query_duration,
+    )
+    from apps.common.query_stats import (
+        start_query_stats,
+        get_query_stats,
+        log_query_stats,
+    )
+    from apps.common.profiler import start_profile, finish_profile
 
     # Must be run before crsf.init_app
     @app.before_request
     def before_request():
         request._start_time = time.time()
+        start_query_stats()
+        start_profile()
 
     @app.after_request
     def after_request(response):
@@ -110,6 +199,18 @@ def create_app(dev_server=False, config_override=None):
         request_total.labels(
             request.endpoint, request.method, response.status_code
         ).inc()
+
+        stats = get_query_stats()
+        if stats is not None:
+            request_query_count.labels(request.endpoint, request.method).observe(
+                stats.count
+            )
+            request_query_duration.labels(request.endpoint, request.method).observe(
+                stats.seconds
+            )
+            log_query_stats(stats, request.endpoint)
+
+        finish_profile(response)
         return response
 
     for extension in (csrf, cache, db, mail, static_digest, toolbar):
@@ -144,14 +245,22 @@ def create_app(dev_server=False, config_override=None):
 
     login_manager.anonymous_user = load_anonymous_user
 
-    global gocardless_client
-    gocardless_client = gocardless_pro.Client(
-        access_token=app.config["GOCARDLESS_ACCESS_TOKEN"],
-        environment=app.config["GOCARDLESS_ENVIRONMENT"],
+    # Payment libraries are only imported when they're first used
+    gocardless_client.configure(
+        lambda: gocardless_pro.Client(
+            access_token=app.config["GOCARDLESS_ACCESS_TOKEN"],
+            environment=app.config["GOCARDLESS_ENVIRONMENT"],
+        )
     )
-    stripe.api_key = app.config["STRIPE_SECRET_KEY"]
-    pytransferwise.environment = app.config["TRANSFERWISE_ENVIRONMENT"]
-    pytransferwise.api_key = app.config["TRANSFERWISE_API_TOKEN"]
+
+    @stripe.configure
+    def configure_stripe(module):
+        module.api_key = app.config["STRIPE_SECRET_KEY"]
+
+    @pytransferwise.configure
+    def configure_transferwise(module):
+        module.environment = app.config["TRANSFERWISE_ENVIRONMENT"]
+        module.api_key = app.config["TRANSFERWISE_API_TOKEN"]
 
     @app.before_request
     def load_per_request_state():
@@ -336,6 +445,26 @@ def create_app(dev_server=False, config_override=None):
     return app
 
 
+def warm_app(app):
+    """ Do work which every worker would otherwise repeat on its first
+        requests. When gunicorn preloads the app, this is then shared
+        between workers by copy-on-write, rather than each having a copy.
+
+        The mappers are already configured when models is imported.
+    """
+    app.url_map.update()
+    for name in app.jinja_loader.list_templates():
+        app.jinja_env.get_template(name)
+
+
+def init_worker(app):
+    """ Set up per-process state in a newly forked worker """
+    with app.app_context():
+        reset_db_after_fork()
+    # Cache clients may hold sockets, so make new ones
+    cache.init_app(app)
+
+
 def external_url(endpoint, **values):
     """ Generate an absolute external URL. If you need to override this,
         you're probably doing something wrong.
@@ -7,7 +7,7 @@ from dateutil.parser import parse
 from flask import current_app as app
 
 from main import db
-from sqlalchemy import true, inspect
+from sqlalchemy import JSON, case, true, inspect
 from sqlalchemy.orm.base import NO_VALUE
 from sqlalchemy.sql.functions import func
 from sqlalchemy_continuum.utils import version_class, transaction_class
@@ -102,7 +102,25 @@ def export_attr_counts(cls, attrs):
 
 
 def export_attr_edits(cls, attrs):
-    edits_iter = iter_attr_edits(cls, attrs)
+    if can_count_edits_in_sql(cls, attrs):
+        count, maxes, totals = count_attr_edits_in_sql(cls, attrs)
+    else:
+        count, maxes, totals = count_attr_edits(iter_attr_edits(cls, attrs), attrs)
+
+    edits = OrderedDict()
+    for a in attrs:
+        if count == 0:
+            edits[a] = {"max": 0, "avg": Decimal("0.00")}
+
+        else:
+            avg = Decimal(totals[a]) / count
+            edits[a] = {"max": maxes[a], "avg": avg.quantize(Decimal("0.01"))}
+
+    return edits
+
+
+def count_attr_edits(edits_iter, attrs):
+    """ Returns the number of objects, and the max and total edits of each attr """
     maxes = dict.fromkeys(attrs, 0)
     totals = dict.fromkeys(attrs, 0)
     count = 0
@@ -113,16 +131,68 @@ def export_attr_edits(cls, attrs):
             totals[a] += len(attr_times[a])
         count += 1
 
-    edits = OrderedDict()
-    for a in attrs:
-        if count == 0:
-            edits[a] = {"max": 0, "avg": Decimal("0.00")}
+    return count, maxes, totals
 
-        else:
-            avg = Decimal(totals[a]) / count
-            edits[a] = {"max": maxes[a], "avg": avg.quantize(Decimal("0.01"))}
 
-    return edits
+def can_count_edits_in_sql(cls, attrs):
+    # Postgres can't compare json values
+    columns = inspect(version_class(cls)).columns
+    return db.engine.dialect.name == "postgresql" and not any(
+        isinstance(columns[a].type, JSON) for a in attrs
+    )
+
+
+def count_attr_edits_in_sql(cls, attrs):
+    """ As count_attr_edits(iter_attr_edits(cls, attrs), attrs), but in the DB.
+
+        A version edits an attr if it's the first version of its object, or the
+        attr differs from the previous version's. These are summed per object,
+        then the max and total over all objects are returned.
+    """
+    pk_cols = [k for k in inspect(cls).primary_key]
+
+    cls_version = version_class(cls)
+    pk_cols_version = [getattr(cls_version, k.name) for k in pk_cols]
+
+    def over(f):
+        return f.over(partition_by=pk_cols_version, order_by=cls_version.transaction_id)
+
+    first = over(func.row_number()) == 1
+
+    def edited(attr):
+        col = getattr(cls_version, attr)
+        return case([(first | over(func.lag(col)).is_distinct_from(col), 1)], else_=0)
+
+    versions = (
+        db.session.query(
+            *[c.label("pk_%s" % i) for i, c in enumerate(pk_cols_version)],
+            *[edited(a).label("edited_%s" % i) for i, a in enumerate(attrs)]
+        )
+        .select_from(cls_version)
+        .join(cls_version.transaction)
+        .subquery()
+    )
+
+    pks = [versions.c["pk_%s" % i] for i in range(len(pk_cols))]
+    objects = (
+        db.session.query(
+            *[
+                func.sum(versions.c["edited_%s" % i]).label("edits_%s" % i)
+                for i in range(len(attrs))
+            ]
+        )
+        .group_by(*pks)
+        .subquery()
+    )
+
+    edits = [objects.c["edits_%s" % i] for i in range(len(attrs))]
+    count, *stats = db.session.query(
+        func.count(), *[func.max(e) for e in edits], *[func.sum(e) for e in edits]
+    ).one()
+
+    maxes = {a: int(m or 0) for a, m in zip(attrs, stats[: len(attrs)])}
+    totals = {a: int(t or 0) for a, t in zip(attrs, stats[len(attrs) :])}
+    return count, maxes, totals
 
 
 def iter_attr_edits(cls, attrs, query=None):
@@ -140,6 +210,8 @@ def iter_attr_edits(cls, attrs, query=None):
         query.join(cls_version.transaction)
         .with_entities(*pk_cols_version + attrs_version + [cls_transaction.issued_at])
         .order_by(*pk_cols_version + [cls_version.transaction_id])
+        # Stream rows from a server-side cursor, as version tables are big
+        .yield_per(1000)
     )
 
     def get_pk(row):
@@ -177,5 +249,7 @@ from .map import *  # noqa: F401,F403
 from .admin_message import *  # noqa: F401,F403
 from .volunteer import *  # noqa: F401,F403
 from .village import *  # noqa: F401,F403
+from .search import *  # noqa: F401,F403
+from .request_profile import *  # noqa: F401,F403
 
 db.configure_mappers()
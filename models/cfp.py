@@ -1,5 +1,6 @@
 from datetime import datetime, timedelta
 from collections import namedtuple, defaultdict
+from functools import lru_cache
 from dateutil.parser import parse as parse_date
 import re
 from itertools import groupby
@@ -249,6 +250,136 @@ def make_periods_contiguous(time_periods):
     return contiguous_periods
 
 
+def fix_hard_time_limits(type, time_periods):
+    # This should be fixed by the string periods being burned and replaced
+    if type in HARD_START_LIMIT:
+        trimmed_periods = []
+        for p in time_periods:
+            if (
+                p.start.hour <= HARD_START_LIMIT[type][0]
+                and p.start.minute < HARD_START_LIMIT[type][1]
+            ):
+                p = period(p.start.replace(minute=HARD_START_LIMIT[type][1]), p.end)
+            trimmed_periods.append(p)
+        time_periods = trimmed_periods
+    return time_periods
+
+
+# Parsing availability is slow, and it rarely changes, so these are cached
+# on the values they're calculated from. They return tuples, as callers
+# (including make_periods_contiguous) may modify lists.
+
+
+@lru_cache(maxsize=None)
+def get_allowed_time_periods(type, allowed_times, available_times):
+    time_periods = []
+
+    if allowed_times:
+        for p in allowed_times.split("\n"):
+            if p:
+                start, end = p.split(" > ")
+                try:
+                    time_periods.append(
+                        period(parse_date(start.strip()), parse_date(end.strip()))
+                    )
+                # If someone has entered garbage, dump the lot
+                except ValueError:
+                    time_periods = []
+                    break
+
+    # If we've not overridden it, use the user-specified periods
+    if not time_periods and available_times:
+        for p in available_times.split(","):
+            if p:
+                time_periods.append(timeslot_to_period(p.strip(), type=type))
+
+    time_periods = fix_hard_time_limits(type, time_periods)
+    return tuple(make_periods_contiguous(time_periods))
+
+
+@lru_cache(maxsize=None)
+def get_allowed_time_periods_with_default(type, allowed_times, available_times):
+    allowed_time_periods = list(
+        get_allowed_time_periods(type, allowed_times, available_times)
+    )
+    if not allowed_time_periods:
+        allowed_time_periods = [
+            timeslot_to_period(ts, type=type) for ts in PROPOSAL_TIMESLOTS[type]
+        ]
+
+    allowed_time_periods = fix_hard_time_limits(type, allowed_time_periods)
+    return tuple(make_periods_contiguous(allowed_time_periods))
+
+
+@lru_cache(maxsize=None)
+def get_preferred_time_periods_with_default(type):
+    preferred_time_periods = [
+        timeslot_to_period(ts, type=type) for ts in PREFERRED_TIMESLOTS.get(type, [])
+    ]
+
+    preferred_time_periods = fix_hard_time_limits(type, preferred_time_periods)
+    return tuple(make_periods_contiguous(preferred_time_periods))
+
+
+@lru_cache(maxsize=None)
+def get_allowed_venue_names(type, allowed_venues):
+    if allowed_venues:
+        return tuple(v.strip() for v in allowed_venues.split(","))
+    return tuple(DEFAULT_VENUES[type])
+
+
+# Times are also represented as bitmasks of 10-minute slots, counting from
+# midnight on the first day, so checking whether a proposal can go somewhere
+# is a bitwise operation. Venues are bitmasks of venue ids.
+SLOT_MINUTES = 10
+SLOT_EPOCH = min(DAYS.values())
+
+
+def get_slot(time, round_up=False):
+    slot, remainder = divmod(time - SLOT_EPOCH, timedelta(minutes=SLOT_MINUTES))
+    if round_up and remainder:
+        slot += 1
+    return max(slot, 0)
+
+
+def get_period_slot_mask(start, end):
+    """ The slots which lie entirely between start and end """
+    first = get_slot(start, round_up=True)
+    last = get_slot(end)
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def get_event_slot_mask(start, duration):
+    """ The slots an event starting at start for duration minutes touches """
+    end = start + timedelta(minutes=int(duration))
+    first = get_slot(start)
+    last = max(get_slot(end, round_up=True), first + 1)
+    return ((1 << (last - first)) - 1) << first
+
+
+def slots_fit(event_mask, allowed_mask):
+    return event_mask & ~allowed_mask == 0
+
+
+def get_venue_mask(venue_ids):
+    mask = 0
+    for venue_id in venue_ids:
+        mask |= 1 << int(venue_id)
+    return mask
+
+
+@lru_cache(maxsize=None)
+def get_allowed_slot_mask(type, allowed_times, available_times):
+    mask = 0
+    for p in get_allowed_time_periods_with_default(
+        type, allowed_times, available_times
+    ):
+        mask |= get_period_slot_mask(p.start, p.end)
+    return mask
+
+
 def get_available_proposal_minutes():
     minutes = defaultdict(int)
     for type, slots in PROPOSAL_TIMESLOTS.items():
@@ -550,17 +681,19 @@ class Proposal(db.Model):
         )
         return admission_tickets > 0 or self.user.will_have_ticket
 
-    def get_allowed_venues(self):
+    def get_allowed_venues(self, venues_by_name=None):
+        """ Pass in venues_by_name to avoid a query, e.g. when looking at
+            lots of proposals at once.
+        """
         # FIXME: this should reference a foreign key instead
-        if self.allowed_venues:
-            venue_names = [v.strip() for v in self.allowed_venues.split(",")]
-        else:
-            venue_names = DEFAULT_VENUES[self.type]
-
+        venue_names = get_allowed_venue_names(self.type, self.allowed_venues)
         if not venue_names:
             return []
 
-        found = Venue.query.filter(Venue.name.in_(venue_names)).all()
+        if venues_by_name is not None:
+            found = [venues_by_name[n] for n in venue_names if n in venues_by_name]
+        else:
+            found = Venue.query.filter(Venue.name.in_(venue_names)).all()
         # If we didn't actually find all the venues we're using, bail hard
         if len(found) != len(venue_names):
             raise InvalidVenueException("Invalid Venue in allowed_venues!")
@@ -571,45 +704,14 @@ class Proposal(db.Model):
         return ",".join([v.name for v in self.get_allowed_venues()])
 
     def fix_hard_time_limits(self, time_periods):
-        # This should be fixed by the string periods being burned and replaced
-        if self.type in HARD_START_LIMIT:
-            trimmed_periods = []
-            for p in time_periods:
-                if (
-                    p.start.hour <= HARD_START_LIMIT[self.type][0]
-                    and p.start.minute < HARD_START_LIMIT[self.type][1]
-                ):
-                    p = period(
-                        p.start.replace(minute=HARD_START_LIMIT[self.type][1]), p.end
-                    )
-                trimmed_periods.append(p)
-            time_periods = trimmed_periods
-        return time_periods
+        return fix_hard_time_limits(self.type, time_periods)
 
     def get_allowed_time_periods(self):
-        time_periods = []
-
-        if self.allowed_times:
-            for p in self.allowed_times.split("\n"):
-                if p:
-                    start, end = p.split(" > ")
-                    try:
-                        time_periods.append(
-                            period(parse_date(start.strip()), parse_date(end.strip()))
-                        )
-                    # If someone has entered garbage, dump the lot
-                    except ValueError as e:
-                        time_periods = []
-                        break
-
-        # If we've not overridden it, use the user-specified periods
-        if not time_periods and self.available_times:
-            for p in self.available_times.split(","):
-                if p:
-                    time_periods.append(timeslot_to_period(p.strip(), type=self.type))
-
-        time_periods = self.fix_hard_time_limits(time_periods)
-        return make_periods_contiguous(time_periods)
+        return list(
+            get_allowed_time_periods(
+                self.type, self.allowed_times, self.available_times
+            )
+        )
 
     def get_allowed_time_periods_serialised(self):
         return "\n".join(
@@ -617,24 +719,35 @@ class Proposal(db.Model):
         )
 
     def get_allowed_time_periods_with_default(self):
-        allowed_time_periods = self.get_allowed_time_periods()
-        if not allowed_time_periods:
-            allowed_time_periods = [
-                timeslot_to_period(ts, type=self.type)
-                for ts in PROPOSAL_TIMESLOTS[self.type]
-            ]
-
-        allowed_time_periods = self.fix_hard_time_limits(allowed_time_periods)
-        return make_periods_contiguous(allowed_time_periods)
+        return list(
+            get_allowed_time_periods_with_default(
+                self.type, self.allowed_times, self.available_times
+            )
+        )
 
     def get_preferred_time_periods_with_default(self):
-        preferred_time_periods = [
-            timeslot_to_period(ts, type=self.type)
-            for ts in PREFERRED_TIMESLOTS.get(self.type, [])
-        ]
+        return list(get_preferred_time_periods_with_default(self.type))
+
+    @property
+    def allowed_slot_mask(self):
+        return get_allowed_slot_mask(
+            self.type, self.allowed_times, self.available_times
+        )
+
+    def get_allowed_venue_mask(self, venues_by_name=None):
+        return get_venue_mask(v.id for v in self.get_allowed_venues(venues_by_name))
 
-        preferred_time_periods = self.fix_hard_time_limits(preferred_time_periods)
-        return make_periods_contiguous(preferred_time_periods)
+    def can_be_scheduled_at(self, venue_id, start, venues_by_name=None):
+        """ Whether this proposal is allowed in a venue at a time """
+        if not self.scheduled_duration:
+            return False
+
+        if not self.get_allowed_venue_mask(venues_by_name) & get_venue_mask([venue_id]):
+            return False
+
+        return slots_fit(
+            get_event_slot_mask(start, self.scheduled_duration), self.allowed_slot_mask,
+        )
 
     def overlaps_with(self, other):
         if self.potential_start_date:
@@ -871,6 +984,33 @@ class CFPVote(db.Model):
         return data
 
 
+class ReviewQueueEntry(db.Model):
+    """ A proposal waiting for a reviewer to look at it.
+
+        Each reviewer sees their queue in position order.
+    """
+
+    __tablename__ = "review_queue"
+    __export_data__ = False
+    __table_args__ = (
+        db.Index("ix_review_queue_user_id_position", "user_id", "position"),
+    )
+
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    proposal_id = db.Column(db.Integer, db.ForeignKey("proposal.id"), primary_key=True)
+    position = db.Column(db.Integer, nullable=False)
+    # Whether to highlight it, e.g. because the reviewer needs to look again
+    is_new = db.Column(db.Boolean, nullable=False, default=False)
+
+    proposal = db.relationship(Proposal)
+
+    def __init__(self, user_id, proposal_id, position, is_new=False):
+        self.user_id = user_id
+        self.proposal_id = proposal_id
+        self.position = position
+        self.is_new = is_new
+
+
 class Venue(db.Model):
     __tablename__ = "venue"
     __export_data__ = False
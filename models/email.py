@@ -1,7 +1,7 @@
 from datetime import datetime
 from main import db
 
-from sqlalchemy import func, select
+from sqlalchemy import case, func, select
 from sqlalchemy.orm import column_property
 
 
@@ -49,3 +49,57 @@ EmailJob.recipient_count = column_property(
     ),
     deferred=True,
 )
+
+
+class EmailBatch(db.Model):
+    """ A batch of emails which have each been rendered for their recipient,
+        e.g. CfP notifications, queued to be sent in the background.
+    """
+
+    __tablename__ = "email_batch"
+    __export_data__ = False
+    id = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String, nullable=False)
+    created = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    emails = db.relationship("QueuedEmail", backref="batch", lazy="dynamic")
+
+    def __init__(self, description):
+        self.description = description
+
+    def get_progress(self):
+        """ Counts of emails in this batch by status: queued, sent or failed """
+        status = case(
+            [
+                (QueuedEmail.sent.is_(True), "sent"),
+                (QueuedEmail.error.isnot(None), "failed"),
+            ],
+            else_="queued",
+        )
+        counts = dict(
+            self.emails.with_entities(status, func.count()).group_by(status).all()
+        )
+        return {s: counts.get(s, 0) for s in ("queued", "sent", "failed")}
+
+
+class QueuedEmail(db.Model):
+    __tablename__ = "queued_email"
+    __export_data__ = False
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.Integer, db.ForeignKey("email_batch.id"), nullable=False)
+    sender = db.Column(db.String, nullable=False)
+    recipient = db.Column(db.String, nullable=False)
+    subject = db.Column(db.String, nullable=False)
+    # Used if sending with subject fails, see send_queued_email
+    fallback_subject = db.Column(db.String)
+    body = db.Column(db.String, nullable=False)
+    sent = db.Column(db.Boolean, nullable=False, default=False, index=True)
+    error = db.Column(db.String)
+
+    def __init__(self, batch, sender, recipient, subject, body, fallback_subject=None):
+        self.batch = batch
+        self.sender = sender
+        self.recipient = recipient
+        self.subject = subject
+        self.body = body
+        self.fallback_subject = fallback_subject
@@ -1,18 +1,42 @@
+import logging
 import requests
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from geoalchemy2.shape import to_shape
 from icalendar import Calendar
 import pendulum
-from shapely.geometry import Point
 from slugify import slugify_unicode
 from sqlalchemy import UniqueConstraint, func, select
 from sqlalchemy.orm import column_property
-from sqlalchemy.orm.exc import NoResultFound
 
 from main import db
 from models import event_start, event_end
 
+log = logging.getLogger(__name__)
+
+# Seconds to wait for a calendar host
+FETCH_TIMEOUT = 10
+
+
+def fetch_calendar(url, etag=None, last_modified=None, timeout=FETCH_TIMEOUT):
+    """ Fetch a calendar feed, returning the response and how long it took.
+
+        If etag or last_modified are given, this makes a conditional request,
+        and the response will be a 304 if the feed hasn't changed. This doesn't
+        touch the database, so it's safe to call from other threads.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    start = time.monotonic()
+    response = requests.get(url, headers=headers, timeout=timeout)
+    response.raise_for_status()
+    return response, time.monotonic() - start
+
 
 class CalendarSource(db.Model):
     __tablename__ = "calendar_source"
@@ -32,6 +56,13 @@ class CalendarSource(db.Model):
     contact_phone = db.Column(db.String)
     contact_email = db.Column(db.String)
 
+    # Details of the last fetch
+    etag = db.Column(db.String)
+    last_modified = db.Column(db.String)
+    fetch_duration = db.Column(db.Float)
+    fetch_size = db.Column(db.Integer)
+    events_changed = db.Column(db.Integer)
+
     user = db.relationship("User", backref="calendar_sources")
     mapobj = db.relationship("MapObject")
 
@@ -56,15 +87,46 @@ class CalendarSource(db.Model):
 
         return data
 
-    def refresh(self):
-        request = requests.get(self.url)
+    def refresh(self, conditional=False, timeout=FETCH_TIMEOUT):
+        """ Fetch and update this calendar's events, returning a list of alerts.
+
+            If conditional is set, send the validators from the last fetch,
+            and leave events untouched if the feed hasn't changed.
+        """
+        if conditional:
+            response, duration = fetch_calendar(
+                self.url, self.etag, self.last_modified, timeout=timeout
+            )
+        else:
+            response, duration = fetch_calendar(self.url, timeout=timeout)
+
+        return self.update_from_response(response, duration)
+
+    def update_from_response(self, response, duration):
+        self.refreshed_at = pendulum.now()
+        self.fetch_duration = duration
+
+        if response.status_code == 304:
+            self.fetch_size = 0
+            self.events_changed = 0
+            return []
 
-        cal = Calendar.from_ical(request.text)
+        self.fetch_size = len(response.content)
+        alerts = self.update_events(response.text)
+
+        # Only once the events are updated, or a broken feed would never be retried
+        self.etag = response.headers.get("ETag")
+        self.last_modified = response.headers.get("Last-Modified")
+        return alerts
+
+    def update_events(self, ical_text):
+        cal = Calendar.from_ical(ical_text)
         if self.name is None:
             self.name = cal.get("X-WR-CALNAME")
 
-        for event in self.events:
-            event.displayed = False
+        # Fetch existing events in one go, rather than looking each one up
+        existing_events = {event.uid: event for event in self.events}
+        changed = set()
 
         local_tz = pendulum.timezone("Europe/London")
         alerts = []
@@ -146,31 +208,43 @@ class CalendarSource(db.Model):
                     )
                     out_of_range_event = True
 
-                try:
-                    event = CalendarEvent.query.filter_by(
-                        source_id=self.id, uid=uid
-                    ).one()
-
-                except NoResultFound:
+                event = existing_events.get(uid)
+                if event is None:
                     event = CalendarEvent(uid=uid)
                     self.events.append(event)
+                    existing_events[uid] = event
                     if len(self.events) > 1000:
                         raise Exception("Too many events in feed")
 
-                event.start_dt = start_dt
-                event.end_dt = end_dt
-                event.summary = component.get("summary")
-                event.description = component.get("description")
-                event.location = component.get("location")
-                event.displayed = True
-
-        self.refreshed_at = pendulum.now()
+                values = {
+                    "start_dt": start_dt,
+                    "end_dt": end_dt,
+                    "summary": component.get("summary"),
+                    "description": component.get("description"),
+                    "location": component.get("location"),
+                    "displayed": True,
+                }
+                # Only touch changed events, so unchanged ones aren't updated
+                for attr, value in values.items():
+                    if getattr(event, attr) != value:
+                        setattr(event, attr, value)
+                        changed.add(uid)
+
+        for uid, event in existing_events.items():
+            if uid not in uids_seen and event.displayed is not False:
+                event.displayed = False
+                changed.add(uid)
+
+        self.events_changed = len(changed)
 
         return alerts
 
     @property
     def latlon(self):
         if self.mapobj:
+            from geoalchemy2.shape import to_shape
+            from shapely.geometry import Point
+
             obj = to_shape(self.mapobj.geom)
             if isinstance(obj, Point):
                 return (obj.y, obj.x)
@@ -185,6 +259,44 @@ class CalendarSource(db.Model):
         return events
 
 
+def refresh_calendar_sources(sources, max_workers=8, timeout=FETCH_TIMEOUT):
+    """ Refresh several calendar sources, fetching them concurrently.
+
+        Only the HTTP requests run in worker threads - responses are processed
+        here as they arrive, as the session isn't thread-safe. Feeds which
+        haven't changed since the last fetch are skipped. Each source is
+        updated in a savepoint, so one that fails is left as it was.
+
+        Returns a dict of source to a list of alerts, or the exception raised.
+    """
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(fetch_calendar, s.url, s.etag, s.last_modified, timeout): s
+            for s in sources
+        }
+        for future in as_completed(futures):
+            source = futures[future]
+            try:
+                response, duration = future.result()
+                with db.session.begin_nested():
+                    results[source] = source.update_from_response(response, duration)
+            except Exception as e:
+                log.warning("Error refreshing calendar %s: %r", source, e)
+                results[source] = e
+                continue
+
+            log.info(
+                "Refreshed calendar %s in %.2fs: %s bytes, %s events changed",
+                source,
+                source.fetch_duration,
+                source.fetch_size,
+                source.events_changed,
+            )
+
+    return results
+
+
 FavouriteCalendarEvent = db.Table(
     "favourite_calendar_event",
     db.Model.metadata,
@@ -22,6 +22,10 @@ anon_states = {"reserved", "cancelled"}
 allowed_states = set(PURCHASE_STATES.keys())
 
 
+# Methods on AdmissionTicket which can be replayed from an offline gate
+CHECKIN_ACTIONS = ["check_in", "undo_check_in", "badge_up", "undo_badge_up"]
+
+
 class CheckinStateException(Exception):
     pass
 
@@ -270,6 +274,35 @@ class PurchaseTransfer(db.Model):
         )
 
 
+class CheckinSyncEvent(db.Model):
+    """ A check-in recorded at an offline arrivals gate, and replayed here.
+
+        The id is generated at the gate, so replaying the same event again
+        returns the original result rather than applying it twice.
+    """
+
+    __tablename__ = "checkin_sync_event"
+    __export_data__ = False
+    id = db.Column(db.String, primary_key=True)
+    ticket_id = db.Column(db.Integer, db.ForeignKey("purchase.id"), nullable=False)
+    action = db.Column(db.String, nullable=False)
+    occurred = db.Column(db.DateTime, nullable=False)
+    synced = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # ok, conflict or rejected
+    result = db.Column(db.String, nullable=False)
+    message = db.Column(db.String)
+
+    ticket = db.relationship(Purchase)
+
+    def __init__(self, id, ticket_id, action, occurred, result, message=None):
+        self.id = id
+        self.ticket_id = ticket_id
+        self.action = action
+        self.occurred = occurred
+        self.result = result
+        self.message = message
+
+
 class PurchaseStateException(Exception):
     pass
 
@@ -0,0 +1,51 @@
+from datetime import datetime
+
+from main import db
+
+
+class RequestProfile(db.Model):
+    """ A sampled profile of one request, kept in a ring buffer.
+
+        stacks maps collapsed stacks ("module:function;module:function")
+        to the number of samples seen in them.
+    """
+
+    __tablename__ = "request_profile"
+    __export_data__ = False
+    id = db.Column(db.Integer, primary_key=True)
+    started = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    method = db.Column(db.String, nullable=False)
+    path = db.Column(db.String, nullable=False)
+    endpoint = db.Column(db.String, index=True)
+    status_code = db.Column(db.Integer)
+    # Why it was profiled: admin, token or sample
+    reason = db.Column(db.String, nullable=False)
+    duration = db.Column(db.Float, nullable=False)
+    sql_count = db.Column(db.Integer, nullable=False, default=0)
+    sql_duration = db.Column(db.Float, nullable=False, default=0)
+    template_duration = db.Column(db.Float, nullable=False, default=0)
+    sample_interval = db.Column(db.Float, nullable=False)
+    stacks = db.Column(db.JSON, nullable=False)
+
+    @property
+    def sample_count(self):
+        return sum(self.stacks.values())
+
+    def get_top_frames(self, limit=30):
+        """ (frame, samples in it or its callees, samples in it) by inclusive samples """
+        inclusive = {}
+        exclusive = {}
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            for frame in set(frames):
+                inclusive[frame] = inclusive.get(frame, 0) + count
+            exclusive[frames[-1]] = exclusive.get(frames[-1], 0) + count
+
+        top = sorted(inclusive.items(), key=lambda i: i[1], reverse=True)[:limit]
+        return [(frame, count, exclusive.get(frame, 0)) for frame, count in top]
+
+    def to_folded(self):
+        """ Collapsed stacks, for flamegraph.pl, speedscope or similar """
+        return "".join(
+            "%s %s\n" % (stack, count) for stack, count in sorted(self.stacks.items())
+        )
@@ -14,26 +14,47 @@
     Tasks are run in a separate process by the `flask periodic` command
     and do not run by default in dev. This process is run by cron so
     granularity is no better than a few minutes.
+
+    Due tasks run concurrently, each in its own forked process, so a slow
+    task doesn't hold up the others, and one which runs past its timeout
+    (15 minutes unless given, e.g. `@scheduled_task(minutes=1,
+    timeout=pendulum.duration(minutes=5))`) can be killed. A Postgres
+    advisory lock is held for each running task, so several runners can
+    overlap without running a task twice.
 """
+import hashlib
 import pendulum
 import logging
 from functools import wraps
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import wait
+
+from sqlalchemy import func, select
 
-from main import db
+from main import db, reset_db_after_fork
 
 tasks = []
 log = logging.getLogger(__name__)
 
+DEFAULT_TIMEOUT = pendulum.duration(minutes=15)
+
 
 class ScheduledTask(object):
-    def __init__(self, func, duration):
+    def __init__(self, func, duration, timeout=DEFAULT_TIMEOUT):
         self.func = func
         self.duration = duration
+        self.timeout = timeout
 
     @property
     def name(self):
         return self.func.__module__ + "." + self.func.__name__
 
+    @property
+    def lock_id(self):
+        """ A stable 64-bit key for this task's advisory lock """
+        digest = hashlib.sha256(("scheduled_task:" + self.name).encode()).digest()
+        return int.from_bytes(digest[:8], "big", signed=True)
+
     def __repr__(self):
         return f"<ScheduledTask: {self.name}, every {self.duration}>"
 
@@ -71,12 +92,12 @@ class ScheduledTaskResult(db.Model):
         ).delete()
 
 
-def scheduled_task(**kwargs):
+def scheduled_task(timeout=DEFAULT_TIMEOUT, **kwargs):
     def decorator(f):
         duration = pendulum.duration(**kwargs)
         if duration < pendulum.duration(minutes=1):
             raise ValueError("Please provide a duration greater than 1 minute")
-        tasks.append(ScheduledTask(f, duration))
+        tasks.append(ScheduledTask(f, duration, timeout))
 
         @wraps(f)
         def wrapper(*args, **kwargs):
@@ -87,27 +108,134 @@ def scheduled_task(**kwargs):
     return decorator
 
 
-def execute_scheduled_tasks():
-    # Take an exclusive lock on the ScheduledTaskResult table to prevent tasks colliding
-    db.session.execute(
-        f"LOCK TABLE {ScheduledTaskResult.__tablename__} IN EXCLUSIVE MODE"
-    )
-    tasks_to_run = []
-    for task in tasks:
-        res = ScheduledTaskResult.get_latest_run(task.name)
-        if res is None or res.start_time + task.duration < pendulum.now():
-            tasks_to_run.append(task)
-
-    log.info("Running %s periodic tasks...", len(tasks_to_run))
-    for task in tasks_to_run:
-        log.info("Running %s", task.name)
-        result = ScheduledTaskResult(task.name)
+def get_due_time(task):
+    """ When the task should have run, or None if it's not due yet """
+    res = ScheduledTaskResult.get_latest_run(task.name)
+    if res is None:
+        return pendulum.now()
+
+    due = pendulum.instance(res.start_time) + task.duration
+    if due < pendulum.now():
+        return due
+    return None
+
+
+def run_task_in_child(task, conn):
+    reset_db_after_fork()
+    try:
+        conn.send({"returnval": task.func()})
+    except Exception as e:
+        log.exception("Error running %s", task.name)
+        conn.send({"exception": repr(e)})
+    finally:
+        db.session.remove()
+        conn.close()
+
+
+class TaskRun(object):
+    """ A task running in a child process, while we hold its lock """
+
+    def __init__(self, task, lock, due):
+        self.task = task
+        self.lock = lock
+        self.received = False
+        self.message = None
+        self.result = ScheduledTaskResult(task.name)
+        self.result.result["lag"] = (self.result.start_time - due).total_seconds()
+
+        # Don't let the child inherit a connection in use
+        db.session.commit()
+        db.session.close()
+
+        self.conn, child_conn = Pipe(duplex=False)
+        self.process = Process(
+            target=run_task_in_child, args=(task, child_conn), name=task.name
+        )
+        self.process.start()
+        child_conn.close()
+
+    @property
+    def timed_out(self):
+        return pendulum.now() - self.result.start_time > self.task.timeout
+
+    def receive(self):
+        """ Read the child's result, so a large one doesn't block it """
+        if self.received or not self.conn.poll():
+            return
+        self.received = True
         try:
-            result.result["returnval"] = task.func()
-        except Exception as e:
-            result.result["exception"] = repr(e)
-        result.finish()
-        db.session.add(result)
+            self.message = self.conn.recv()
+        except EOFError:
+            # It died before sending anything
+            pass
+
+    def finish(self):
+        self.receive()
+        if self.process.is_alive():
+            self.process.terminate()
+            self.result.result["exception"] = "Timed out after %s" % self.task.timeout
+        elif self.message is not None:
+            self.result.result.update(self.message)
+        else:
+            self.result.result["exception"] = "Exited with code %s" % (
+                self.process.exitcode
+            )
+        self.process.join()
+        self.conn.close()
+
+        self.result.finish()
+        db.session.add(self.result)
+        db.session.commit()
+
+        # Only now can another runner start it again
+        self.lock.close()
+        log.info(
+            "Finished %s in %.1fs", self.task.name, self.result.duration.total_seconds()
+        )
+
+
+def start_task(task):
+    """ Start the task if it's due and not already running, returning a TaskRun """
+    # The lock is held until its transaction ends, or the connection is lost
+    lock = db.engine.connect()
+    lock.begin()
+    if not lock.execute(
+        select([func.pg_try_advisory_xact_lock(task.lock_id)])
+    ).scalar():
+        log.info("%s is already running", task.name)
+        lock.close()
+        return None
+
+    # Check again now we have the lock, in case another runner just finished it
+    due = get_due_time(task)
+    if due is None:
+        lock.close()
+        return None
+
+    log.info("Running %s", task.name)
+    return TaskRun(task, lock, due)
+
+
+def execute_scheduled_tasks(max_workers=4):
+    due_tasks = [t for t in tasks if get_due_time(t) is not None]
+    log.info("Running %s periodic tasks...", len(due_tasks))
+
+    running = []
+    while due_tasks or running:
+        while due_tasks and len(running) < max_workers:
+            run = start_task(due_tasks.pop(0))
+            if run is not None:
+                running.append(run)
+
+        if not running:
+            break
+
+        wait([r.process.sentinel for r in running] + [r.conn for r in running], 1)
+        for run in list(running):
+            run.receive()
+            if not run.process.is_alive() or run.timed_out:
+                run.finish()
+                running.remove(run)
 
     ScheduledTaskResult.cleanup()
     db.session.commit()
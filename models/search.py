@@ -0,0 +1,258 @@
+""" A read model for the admin search box.
+
+    Each searchable object has one row in search_entry, with free text for
+    full-text search, and a row in search_reference for each identifier an
+    admin might paste in (emails, provider payment ids, bank refs), which
+    are matched exactly or by prefix.
+
+    Entries are updated in the same flush as the objects they describe, so
+    they're always consistent with the data. Run `flask admin
+    rebuild_search_index` to populate them from scratch.
+"""
+from sqlalchemy import Index, event, inspect, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from main import db
+from .cfp import Proposal
+from .payment import Payment, BankTransaction
+from .purchase import Purchase
+from .user import User
+from .village import Village
+
+
+class SearchEntry(db.Model):
+    __tablename__ = "search_entry"
+    __export_data__ = False
+    type = db.Column(db.String, primary_key=True)
+    object_id = db.Column(db.Integer, primary_key=True)
+    # The user this object belongs to, if any
+    user_id = db.Column(db.Integer)
+    title = db.Column(db.String, nullable=False)
+    detail = db.Column(db.String, nullable=False, default="")
+    text = db.Column(db.String, nullable=False, default="")
+
+
+class SearchReference(db.Model):
+    __tablename__ = "search_reference"
+    __export_data__ = False
+    type = db.Column(db.String, primary_key=True)
+    object_id = db.Column(db.Integer, primary_key=True)
+    # Lowercased
+    reference = db.Column(db.String, primary_key=True)
+
+
+Index(
+    "ix_search_entry_tsearch",
+    text("to_tsvector('simple', text)"),
+    postgresql_using="gin",
+)
+# text_pattern_ops lets prefix searches (LIKE 'abc%') use the index
+Index(
+    "ix_search_reference_reference",
+    SearchReference.reference,
+    postgresql_ops={"reference": "text_pattern_ops"},
+)
+
+
+def index_user(user):
+    return {
+        "user_id": user.id,
+        "title": user.name,
+        "detail": user.email,
+        "text": "%s %s" % (user.name, user.email.replace("@", " ")),
+        "references": [user.email],
+    }
+
+
+def index_payment(payment):
+    references = [
+        getattr(payment, attr, None)
+        for attr in ["bankref", "gcid", "mandate", "charge_id", "intent_id"]
+    ]
+    return {
+        "user_id": payment.user_id,
+        "title": "%s payment %s" % (payment.provider, payment.id),
+        "detail": "%s %s %s" % (payment.state, payment.amount, payment.currency),
+        "text": "%s payment" % payment.provider,
+        "references": [str(payment.id)] + references,
+    }
+
+
+def index_purchase(purchase):
+    # Unclaimed purchases from anonymous baskets have no page to link to
+    if purchase.owner_id is None:
+        return None
+
+    return {
+        "user_id": purchase.owner_id,
+        "title": "Purchase %s" % purchase.id,
+        "detail": "%s %s" % (purchase.product.display_name, purchase.state),
+        "text": "%s %s" % (purchase.type, purchase.product.display_name),
+        "references": [str(purchase.id)],
+    }
+
+
+def index_proposal(proposal):
+    return {
+        "user_id": proposal.user_id,
+        "title": proposal.title,
+        "detail": "%s %s" % (proposal.type, proposal.state),
+        "text": "%s %s" % (proposal.title, proposal.published_names or ""),
+        "references": [str(proposal.id)],
+    }
+
+
+def index_village(village):
+    return {
+        "user_id": None,
+        "title": village.name,
+        "detail": "",
+        "text": "%s %s" % (village.name, village.description or ""),
+        "references": [str(village.id)],
+    }
+
+
+def index_bank_transaction(txn):
+    return {
+        "user_id": None,
+        "title": txn.payee,
+        "detail": "%s %s" % (txn.posted.date(), txn.amount),
+        "text": txn.payee,
+        "references": [txn.fit_id],
+    }
+
+
+# type: (class, indexer, attributes which affect the entry)
+# Indexers return None for objects which shouldn't be searchable
+SEARCH_TYPES = {
+    "user": (User, index_user, ["name", "email"]),
+    "payment": (
+        Payment,
+        index_payment,
+        ["state", "amount_int", "bankref", "gcid", "mandate", "charge_id", "intent_id"],
+    ),
+    "purchase": (Purchase, index_purchase, ["owner_id", "state", "product_id"]),
+    "proposal": (
+        Proposal,
+        index_proposal,
+        ["title", "published_names", "state", "type"],
+    ),
+    "village": (Village, index_village, ["name", "description"]),
+    "bank_transaction": (BankTransaction, index_bank_transaction, ["payee", "fit_id"]),
+}
+
+
+def get_search_type(obj):
+    for type, (cls, _, _) in SEARCH_TYPES.items():
+        if isinstance(obj, cls):
+            return type
+    return None
+
+
+def write_search_entries(connection, type, objects):
+    """ Replace the entries for objects, which must all be of type.
+        Returns the number of entries written.
+    """
+    _, indexer, _ = SEARCH_TYPES[type]
+    entries = []
+    references = []
+    unindexed = []
+    for obj in objects:
+        entry = indexer(obj)
+        if entry is None:
+            unindexed.append(obj.id)
+            continue
+
+        for reference in set(filter(None, entry.pop("references"))):
+            references.append(
+                {"type": type, "object_id": obj.id, "reference": reference.lower()}
+            )
+        entry.update({"type": type, "object_id": obj.id})
+        entries.append(entry)
+
+    if unindexed:
+        delete_search_entries(connection, type, unindexed)
+    if not entries:
+        return 0
+
+    stmt = insert(SearchEntry.__table__)
+    connection.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["type", "object_id"],
+            set_={c: stmt.excluded[c] for c in ["user_id", "title", "detail", "text"]},
+        ),
+        entries,
+    )
+    delete_search_references(connection, type, [obj.id for obj in objects])
+    if references:
+        connection.execute(SearchReference.__table__.insert(), references)
+    return len(entries)
+
+
+def delete_search_references(connection, type, object_ids):
+    table = SearchReference.__table__
+    connection.execute(
+        table.delete().where((table.c.type == type) & table.c.object_id.in_(object_ids))
+    )
+
+
+def delete_search_entries(connection, type, object_ids):
+    table = SearchEntry.__table__
+    connection.execute(
+        table.delete().where((table.c.type == type) & table.c.object_id.in_(object_ids))
+    )
+    delete_search_references(connection, type, object_ids)
+
+
+def needs_reindex(obj, attrs):
+    state = inspect(obj)
+    return any(
+        attr in state.attrs and state.attrs[attr].history.has_changes()
+        for attr in attrs
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def update_search_entries(session, flush_context):
+    changed = {}
+    deleted = {}
+    for obj in session.new | session.dirty:
+        type = get_search_type(obj)
+        if type is None:
+            continue
+        if obj in session.new or needs_reindex(obj, SEARCH_TYPES[type][2]):
+            changed.setdefault(type, []).append(obj)
+
+    for obj in session.deleted:
+        type = get_search_type(obj)
+        if type is not None:
+            deleted.setdefault(type, []).append(obj.id)
+
+    if not changed and not deleted:
+        return
+
+    connection = session.connection()
+    for type, objects in changed.items():
+        write_search_entries(connection, type, objects)
+    for type, object_ids in deleted.items():
+        delete_search_entries(connection, type, object_ids)
+
+
+def rebuild_search_index(batch_size=1000):
+    """ Recreate every entry, e.g. after adding a type. Returns the count. """
+    connection = db.session.connection()
+    connection.execute(SearchReference.__table__.delete())
+    connection.execute(SearchEntry.__table__.delete())
+
+    count = 0
+    for type, (cls, _, _) in SEARCH_TYPES.items():
+        batch = []
+        for obj in cls.query.order_by(cls.id).yield_per(batch_size):
+            batch.append(obj)
+            if len(batch) >= batch_size:
+                count += write_search_entries(connection, type, batch)
+                batch = []
+        count += write_search_entries(connection, type, batch)
+
+    return count
@@ -8,6 +8,7 @@ import time
 import struct
 import re
 from collections import defaultdict
+from functools import lru_cache
 
 from sqlalchemy import func, Index, text
 from sqlalchemy.orm.exc import NoResultFound
@@ -24,11 +25,16 @@ CHECKIN_CODE_LEN = 16
 checkin_code_re = r"[0-9a-zA-Z_-]{%s}" % CHECKIN_CODE_LEN
 
 
-def _generate_hmac(prefix, key, msg):
+# Verified codes for tokens which don't expire, which are polled or scanned often
+VERIFIED_CODE_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=64)
+def _get_hmac_context(prefix, key):
     """
-    Generate a keyed HMAC for a unique purpose. You don't want to call this directly.
+    An HMAC which has already been fed the key and prefix, to be copied.
 
-    This returns bytes because we don't want to assume the encoding of msg.
+    Only call copy() on this, never update().
     """
     if isinstance(key, str):
         key = key.encode("utf-8")
@@ -36,10 +42,25 @@ def _generate_hmac(prefix, key, msg):
     if isinstance(prefix, str):
         prefix = prefix.encode("utf-8")
 
+    return hmac.new(key, prefix, digestmod=hashlib.sha256)
+
+
+def _get_hmac(prefix, key, msg):
+    mac = _get_hmac_context(prefix, key).copy()
+    mac.update(msg)
+    return mac
+
+
+def _generate_hmac(prefix, key, msg):
+    """
+    Generate a keyed HMAC for a unique purpose. You don't want to call this directly.
+
+    This returns bytes because we don't want to assume the encoding of msg.
+    """
     if isinstance(msg, str):
         msg = msg.encode("utf-8")
 
-    mac = hmac.new(key, prefix + msg, digestmod=hashlib.sha256)
+    mac = _get_hmac(prefix, key, msg)
     # Truncate the digest to 20 base64 characters (120 bits)
     return msg + b"-" + base64.urlsafe_b64encode(mac.digest())[:20]
 
@@ -78,6 +99,7 @@ def verify_timed_hmac(prefix, key, current_timestamp, code, valid_hours):
     return None
 
 
+@lru_cache(maxsize=VERIFIED_CODE_CACHE_SIZE)
 def verify_unlimited_hmac(prefix, key, code):
     # FIXME: this should raise an exception instead of returning None on error
     try:
@@ -93,15 +115,9 @@ def verify_unlimited_hmac(prefix, key, code):
 
 
 def generate_unlimited_short_hmac(prefix, key, user_id, version=1):
-    if isinstance(key, str):
-        key = key.encode("utf-8")
-
-    if isinstance(prefix, str):
-        prefix = prefix.encode("utf-8")
-
     # H = short (< 65536), B = byte (< 256)
     msg = struct.pack("HB", user_id, version)
-    mac = hmac.new(key, prefix + msg, digestmod=hashlib.sha256)
+    mac = _get_hmac(prefix, key, msg)
 
     # An input length that's a multiple of 3 ensures no wasted output
     # 9 bytes (72 bits) won't resist offline attacks, so be careful
@@ -112,6 +128,7 @@ def generate_unlimited_short_hmac(prefix, key, user_id, version=1):
     return code
 
 
+@lru_cache(maxsize=VERIFIED_CODE_CACHE_SIZE)
 def verify_unlimited_short_hmac(prefix, key, code):
     msg = base64.urlsafe_b64decode(code.encode("utf-8")[:4])
     user_id, version = struct.unpack("HB", msg)
@@ -0,0 +1,66 @@
+from apps.admin.search import search_entries, to_query
+from main import db
+from models.product import PriceTier
+from models.purchase import Purchase
+from models.search import SearchEntry
+from models.village import Village
+
+
+def search(q):
+    return [(entry.type, entry.object_id, exact) for entry, exact in search_entries(q)]
+
+
+def test_to_query():
+    assert to_query("Test User") == "test:* & user:*"
+    assert to_query("a&b | !c") == "a:* & b:* & c:*"
+    assert to_query("  ") == ""
+
+
+def test_admin_search(user):
+    village = Village()
+    village.name = "Test Searchable Village"
+    db.session.add(village)
+    db.session.commit()
+
+    # Entries are written as objects are flushed
+    entry = SearchEntry.query.get(("user", user.id))
+    assert entry.title == user.name
+
+    assert ("user", user.id, False) in search("test us")
+    assert ("village", village.id, False) in search("searchable vil")
+    assert ("user", user.id, False) not in search("searchable")
+
+    # Exact references come first
+    assert search(user.email.upper())[0] == ("user", user.id, True)
+    assert search("test_user@exa")[0] == ("user", user.id, False)
+
+    user.name = "Renamed Searchable"
+    db.session.commit()
+    assert ("user", user.id, False) in search("renamed")
+
+    db.session.delete(village)
+    db.session.commit()
+    assert SearchEntry.query.get(("village", village.id)) is None
+
+    user.name = "Test User"
+    db.session.commit()
+
+
+def test_ownerless_purchase(user):
+    # e.g. from an abandoned anonymous basket, which has no page to link to
+    tier = PriceTier.query.filter_by(name="full-std").one()
+    purchase = Purchase(price=tier.get_price("GBP"))
+    db.session.add(purchase)
+    db.session.commit()
+
+    assert SearchEntry.query.get(("purchase", purchase.id)) is None
+    assert ("purchase", purchase.id, True) not in search(str(purchase.id))
+
+    # Once it's claimed, it's indexed
+    purchase.owner_id = user.id
+    db.session.commit()
+    assert SearchEntry.query.get(("purchase", purchase.id)).user_id == user.id
+
+    purchase.owner_id = None
+    db.session.commit()
+    assert SearchEntry.query.get(("purchase", purchase.id)) is None
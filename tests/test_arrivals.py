@@ -0,0 +1,150 @@
+import pytest
+
+from apps.arrivals.replica import ArrivalsReplica
+from apps.arrivals.search_index import AttendeeIndex
+from apps.arrivals.sync import (
+    export_snapshot,
+    apply_sync_event,
+    sign_snapshot,
+    SnapshotSignatureException,
+)
+from main import db
+from models.basket import Basket
+from models.user import User
+from models.product import PriceTier
+from models.purchase import CheckinStateException
+
+
+def test_attendee_index():
+    index = AttendeeIndex()
+    index.add(1, "John Smith", "js@example.com")
+    index.add(2, "Johnny Bravo", "bravo@example.com")
+    index.add(3, "Ann Smithson", "ann@johnson.org")
+    index.add(4, "Bob", "bob@example.com")
+
+    # Prefixes before substrings, names before emails
+    assert index.search("john") == [1, 2, 3]
+    assert index.search("JO") == [1, 2, 3]
+    assert index.search("smith") == [3, 1]
+    assert index.search("bravo@") == [2]
+    assert index.search("zzz") == []
+    assert index.search(" ") == []
+
+    # All the words in order beat matching just one
+    assert index.search("ann smith") == [3, 1]
+    assert index.search("smith ann") == [3, 1]
+    assert index.search("j s") == [1, 3, 2]
+
+    index.add(1, "Jane Smith", "jane@example.com")
+    assert index.search("john") == [2, 3]
+
+    index.remove(2)
+    assert index.search("john") == [3]
+    assert len(index) == 3
+
+
+def test_offline_checkin(app, user, tmpdir):
+    basket = Basket(user, "GBP")
+    basket[PriceTier.query.filter_by(name="full-std").one()] = 1
+    basket.create_purchases()
+    db.session.commit()
+
+    ticket = basket.purchases[0]
+    ticket.set_state("paid")
+    db.session.commit()
+
+    key = app.config["SECRET_KEY"]
+    gates = [ArrivalsReplica(str(tmpdir.mkdir(name)), key) for name in "ab"]
+    snapshot = export_snapshot()
+    for gate in gates:
+        gate.load_snapshot(snapshot)
+
+    assert gates[0].search("test user") == [gates[0].users[user.id]]
+    assert gates[0].user_from_code(user.checkin_code)["id"] == user.id
+    assert gates[0].get_tickets(user.id)[0]["checked_in"] is False
+
+    with pytest.raises(SnapshotSignatureException):
+        gates[0].load_snapshot(sign_snapshot(snapshot, "not the key"))
+
+    # Both gates check the same ticket in while offline
+    events = [gate.record(ticket.id, "check_in") for gate in gates]
+    with pytest.raises(CheckinStateException):
+        gates[0].record(ticket.id, "check_in")
+
+    # The queue survives a restart
+    restarted = ArrivalsReplica(gates[0].path, key)
+    restarted.load()
+    assert list(restarted.pending) == [events[0]["id"]]
+    assert restarted.tickets[ticket.id]["checked_in"] is True
+
+    first = apply_sync_event(events[0])
+    db.session.commit()
+    assert first["result"] == "ok"
+    assert ticket.checked_in
+
+    # Replays are idempotent, and the second gate gets a conflict
+    assert apply_sync_event(events[0]) == first
+    second = apply_sync_event(events[1])
+    db.session.commit()
+    assert second["result"] == "conflict"
+
+    assert gates[1].acknowledge([second]) == [second]
+    assert not gates[1].pending
+
+    # Deltas only include changed tickets
+    delta = export_snapshot(since=ticket.modified)
+    assert [t["id"] for t in delta["tickets"]] == [ticket.id]
+    gates[1].load_snapshot(delta)
+    assert gates[1].tickets[ticket.id]["checked_in"] is True
+
+
+def test_replica_gate(app, tmpdir, monkeypatch):
+    volunteer = User("gate@example.com", "Gate Volunteer")
+    volunteer.grant_permission("arrivals")
+    user = User("gate-attendee@example.com", "Gate Attendee")
+    db.session.add_all([volunteer, user])
+
+    basket = Basket(user, "GBP")
+    basket[PriceTier.query.filter_by(name="full-std").one()] = 1
+    basket.create_purchases()
+    db.session.commit()
+    ticket = basket.purchases[0]
+    ticket.set_state("paid")
+    db.session.commit()
+
+    path = str(tmpdir.mkdir("gate"))
+    ArrivalsReplica(path, app.config["SECRET_KEY"]).load_snapshot(export_snapshot())
+    monkeypatch.setitem(app.config, "ARRIVALS_REPLICA_PATH", path)
+
+    client = app.test_client()
+    code = volunteer.login_code(app.config["SECRET_KEY"])
+    client.get("/login?code={}".format(code))
+
+    response = client.post("/arrivals/search", data={"q": user.name})
+    users = response.get_json()["users"]
+    assert users[0]["id"] == user.id
+    assert users[0]["completes"] == 0
+
+    response = client.post("/arrivals/search", data={"q": user.checkin_code})
+    assert response.get_json()["location"].endswith(
+        "/arrivals/checkin/{}/code".format(user.id)
+    )
+
+    response = client.get("/arrivals/checkin/{}".format(user.id))
+    assert response.status_code == 200
+    assert b"Not checked in" in response.data
+    assert b"0 check-ins waiting" in response.data
+    response = client.post("/arrivals/checkin/{}".format(user.id))
+    assert response.status_code == 302
+
+    # Recorded at the gate, and not in the database until it syncs
+    restarted = ArrivalsReplica(path, app.config["SECRET_KEY"])
+    restarted.load()
+    assert restarted.tickets[ticket.id]["checked_in"] is True
+    assert len(restarted.pending) == 1
+    db.session.refresh(ticket)
+    assert not ticket.checked_in
+
+    client.post("/arrivals/checkin/ticket/{}/undo".format(ticket.id))
+    response = client.post("/arrivals/search", data={"q": user.name})
+    assert response.get_json()["users"][0]["completes"] == 0
@@ -1,8 +1,48 @@
+from csv import DictReader
+from datetime import datetime, timedelta
+from io import StringIO
+from smtplib import SMTPDataError
+
+from flask_mail import Connection
 from hypothesis import given, assume, settings
 from hypothesis.strategies import text
 
-from models.cfp import TalkProposal
-from apps.cfp_review.base import send_email_for_proposal
+from models.cfp import (
+    TalkProposal,
+    Proposal,
+    CFPVote,
+    ReviewQueueEntry,
+    get_event_slot_mask,
+    slots_fit,
+)
+from models import (
+    count_attr_edits,
+    count_attr_edits_in_sql,
+    export_attr_edits,
+    iter_attr_edits,
+)
+from models.user import User
+from apps.cfp.proposal_import import import_proposals
+from apps.base.scheduled_tasks import send_queued_emails
+from apps.cfp_review.base import send_email_for_proposal, queue_emails_for_proposals
+from apps.cfp_review.clashfinder import (
+    find_overlapping_pairs,
+    find_clashes,
+    find_clashes_for,
+)
+from apps.cfp_review.vote_stats import (
+    get_proposal_vote_stats,
+    summarise_vote_stats,
+    get_reviewer_progress,
+)
+from apps.cfp_review.review_queue import (
+    fill_review_queue,
+    get_reviewable_proposals,
+    get_review_queue,
+    get_next_in_review_queue,
+    remove_from_review_queue,
+    review_again,
+)
 
 
 @given(title=text(), description=text(), requirements=text())
@@ -31,3 +71,337 @@ def test_cfp(db, app, user, outbox, title, description, requirements):
 
     assert len(outbox) == 1
     del outbox[:]
+
+
+def test_queued_proposal_emails(db, app, user, outbox):
+    proposals = []
+    for i in range(2):
+        proposal = TalkProposal()
+        proposal.title = "Queued talk {}".format(i)
+        proposal.description = "A talk"
+        proposal.user = user
+        proposals.append(proposal)
+    db.session.add_all(proposals)
+    db.session.commit()
+
+    with app.test_request_context("/"):
+        batch = queue_emails_for_proposals(
+            [(proposals[0], "accepted"), (proposals[1], "rejected")], "Test batch"
+        )
+        db.session.commit()
+
+    assert proposals[1].has_rejected_email
+    assert len(outbox) == 0
+    assert batch.get_progress() == {"queued": 2, "sent": 0, "failed": 0}
+
+    assert send_queued_emails() == 2
+    assert [m.subject for m in outbox] == [
+        'Your EMF proposal "Queued talk 0" has been accepted!',
+        'Your EMF proposal "Queued talk 1" was not accepted.',
+    ]
+    assert batch.get_progress() == {"queued": 0, "sent": 2, "failed": 0}
+    del outbox[:]
+
+
+def test_queued_email_failures(db, app, user, outbox, monkeypatch):
+    proposals = []
+    for i in range(3):
+        proposal = TalkProposal()
+        proposal.title = "Failing talk {}".format(i)
+        proposal.description = "A talk"
+        proposal.user = user
+        proposals.append(proposal)
+    db.session.add_all(proposals)
+    db.session.commit()
+
+    with app.test_request_context("/"):
+        batch = queue_emails_for_proposals(
+            [(p, "accepted") for p in proposals], "Failing batch"
+        )
+        db.session.commit()
+
+    send = Connection.send
+
+    def failing_send(self, message, *args, **kwargs):
+        if "Failing talk 0" in message.subject:
+            raise SMTPDataError(554, b"Message rejected")
+        if "Failing talk 1" in message.subject:
+            # As seen in https://bugs.python.org/issue27240
+            raise AttributeError("'Token' object has no attribute '_pp'")
+        return send(self, message, *args, **kwargs)
+
+    monkeypatch.setattr(Connection, "send", failing_send)
+
+    assert send_queued_emails() == 3
+    assert batch.get_progress() == {"queued": 0, "sent": 2, "failed": 1}
+    assert "SMTPDataError" in batch.emails.filter_by(sent=False).one().error
+    assert sorted(m.subject for m in outbox) == [
+        'Your EMF proposal "" has been accepted!',
+        'Your EMF proposal "Failing talk 2" has been accepted!',
+    ]
+
+    # The failed email doesn't hold up the queue
+    assert send_queued_emails() == 0
+    del outbox[:]
+
+
+IMPORT_CSV = """id,title,description,length,need_finance,one_day,type,experience,attendees,size
+9001,Imported talk,"A talk
+over two lines",25 mins,t,f,talk,,,
+9002,Imported workshop,A workshop,1 hour,f,f,workshop,,10,
+9003,Broken row,Shifted columns,f,t,f,f,,,
+9004,Imported talk,The same title,25 mins,f,f,talk,,,
+9005,Imported installation,An installation,,f,f,installation,,,small
+"""
+
+
+def test_proposal_import(db, app):
+    with app.test_request_context("/"):
+        stats = import_proposals(DictReader(StringIO(IMPORT_CSV)), chunk_size=2)
+
+    assert stats.rows == 5
+    assert stats.imported == 3
+    assert stats.skipped == 1
+    assert stats.errors == [(5, "Unknown type f")]
+
+    talk = Proposal.query.filter_by(title="Imported talk").one()
+    assert talk.type == "talk"
+    assert talk.state == "locked"
+    assert talk.needs_money
+    assert talk.user.email == "cfp_9001@test.invalid"
+
+    # Re-running shouldn't create anything new
+    with app.test_request_context("/"):
+        stats = import_proposals(DictReader(StringIO(IMPORT_CSV)))
+    assert stats.imported == 0
+    assert stats.skipped == 4
+
+
+def test_find_overlapping_pairs():
+    start = datetime(2018, 8, 31, 12, 0)
+    hour = timedelta(hours=1)
+    intervals = [
+        (3, start, start + hour),
+        (1, start + hour / 2, start + 2 * hour),
+        (2, start + hour, start + 2 * hour),
+        (4, start + 2 * hour, start + 3 * hour),
+    ]
+
+    assert find_overlapping_pairs(intervals) == {(1, 3), (1, 2)}
+    assert find_overlapping_pairs([]) == set()
+
+
+def test_clashfinder(db, user):
+    start = datetime(2018, 8, 31, 12, 0)
+    proposals = []
+    for i, offset in enumerate([0, 0, 2]):
+        proposal = TalkProposal()
+        proposal.title = "Clashing talk {}".format(i)
+        proposal.description = "A talk"
+        proposal.user = user
+        proposal.scheduled_duration = 60
+        proposal.scheduled_time = start + timedelta(hours=offset)
+        proposals.append(proposal)
+    db.session.add_all(proposals)
+
+    for i in range(3):
+        fan = User("clash_fan_{}@example.com".format(i), "Fan {}".format(i))
+        fan.favourites.extend(proposals)
+        db.session.add(fan)
+    db.session.commit()
+
+    clashes = find_clashes()
+    assert len(clashes) == 1
+    assert clashes[0]["proposal_1"] == proposals[0]
+    assert clashes[0]["proposal_2"] == proposals[1]
+    assert clashes[0]["favourites"] == 3
+
+    # Moving the third talk on top of the others should create two more
+    proposals[2].potential_time = start
+    assert [c["id"] for c in find_clashes_for(proposals[2])] == [
+        proposals[0].id,
+        proposals[1].id,
+    ]
+
+    # Back-to-back talks off the 10-minute grid don't clash
+    proposals[0].scheduled_duration = 65
+    proposals[2].potential_time = start + timedelta(minutes=65)
+    assert find_clashes_for(proposals[2]) == []
+
+
+def test_attr_edits(db, user):
+    proposal = TalkProposal()
+    proposal.title = "Edited talk"
+    proposal.description = "A talk"
+    proposal.user = user
+    db.session.add(proposal)
+    db.session.commit()
+
+    for title, length in [("Edited talk 2", "25 mins"), ("Edited talk 3", "25 mins")]:
+        proposal.title = title
+        proposal.length = length
+        db.session.commit()
+
+    # A version where the title doesn't change
+    proposal.length = None
+    db.session.commit()
+
+    attrs = ["title", "length", "description", "requirements"]
+    edits = count_attr_edits_in_sql(Proposal, attrs)
+    assert edits == count_attr_edits(iter_attr_edits(Proposal, attrs), attrs)
+    assert count_attr_edits_in_sql(TalkProposal, attrs) == count_attr_edits(
+        iter_attr_edits(TalkProposal, attrs), attrs
+    )
+
+    # Other tests' proposals may be edited more
+    count, maxes, totals = edits
+    assert count >= 1
+    assert maxes["title"] >= 3 and maxes["length"] >= 3
+    assert export_attr_edits(Proposal, attrs)["title"]["max"] == maxes["title"]
+
+
+def test_vote_stats(db, user):
+    proposals = []
+    for i in range(3):
+        proposal = TalkProposal()
+        proposal.title = "Voted talk {}".format(i)
+        proposal.description = "A talk"
+        proposal.user = user
+        proposal.state = "anonymised"
+        proposals.append(proposal)
+    db.session.add_all(proposals)
+
+    for i, (state, note, read) in enumerate(
+        [("voted", "Good", False), ("voted", None, True), ("blocked", "", False)]
+    ):
+        reviewer = User("stats_reviewer_{}@example.com".format(i), "Reviewer")
+        db.session.add(reviewer)
+        reviewer.grant_permission("cfp_reviewer")
+        for proposal in proposals[:2]:
+            vote = CFPVote(reviewer, proposal)
+            vote.set_state(state)
+            vote.vote = 1
+            vote.note = note
+            vote.has_been_read = read
+            db.session.add(vote)
+    db.session.commit()
+
+    query = Proposal.query.filter(Proposal.id.in_([p.id for p in proposals]))
+    stats = get_proposal_vote_stats(query)
+    for proposal in proposals[:2]:
+        assert stats[proposal.id]["states"] == {"voted": 2, "blocked": 1}
+        assert stats[proposal.id]["notes"] == proposal.get_total_note_count()
+        assert stats[proposal.id]["unread"] == proposal.get_unread_vote_note_count()
+    assert proposals[2].id not in stats
+
+    summary = summarise_vote_stats([p.id for p in proposals], stats)
+    assert summary["min_votes"] == 0
+    assert summary["max_votes"] == 2
+    assert summary["voted_total"] == 4
+    assert summary["blocked_total"] == 2
+    assert summary["notes_total"] == 4
+    assert summary["notes_unread"] == 4
+
+    progress = {
+        u.email: (cast, assigned) for u, cast, assigned in get_reviewer_progress()
+    }
+    assert progress["stats_reviewer_0@example.com"][0] == 2
+    assert progress["stats_reviewer_1@example.com"][0] == 2
+
+
+def test_review_queue(db, user):
+    reviewer = User("queue_reviewer@example.com", "Queue Reviewer")
+    db.session.add(reviewer)
+    reviewer.grant_permission("cfp_reviewer")
+
+    proposals = []
+    for i in range(3):
+        proposal = TalkProposal()
+        proposal.title = "Queued talk {}".format(i)
+        proposal.description = "A talk"
+        proposal.user = user
+        proposal.state = "anonymised"
+        proposals.append(proposal)
+    db.session.add_all(proposals)
+
+    # Give the first proposal a vote, so the others should come first
+    vote = CFPVote(user, proposals[0])
+    vote.vote = 1
+    vote.set_state("voted")
+    db.session.add(vote)
+    db.session.commit()
+
+    ReviewQueueEntry.query.filter_by(user_id=reviewer.id).delete()
+    # Other tests' proposals may be waiting for review too
+    fill_review_queue(
+        reviewer,
+        proposals=get_reviewable_proposals(reviewer).filter(
+            Proposal.id.in_([p.id for p in proposals])
+        ),
+    )
+    db.session.commit()
+    queue = get_review_queue(reviewer)
+    assert set(queue[:2]) == set(proposals[1:])
+    assert queue[2] == proposals[0]
+
+    next_entry, remaining = get_next_in_review_queue(reviewer, queue[0].id)
+    assert next_entry.proposal_id == queue[1].id
+    assert remaining == 2
+
+    remove_from_review_queue(reviewer, queue[1])
+    db.session.commit()
+    next_entry, remaining = get_next_in_review_queue(reviewer, queue[0].id)
+    assert next_entry.proposal_id == queue[2].id
+    assert remaining == 1
+
+    review_again(reviewer.id, queue[2])
+    db.session.commit()
+    assert get_review_queue(reviewer)[0] == queue[2]
+
+
+def test_review_list_fills_empty_queue(db, app, user):
+    reviewer = User("list_reviewer@example.com", "List Reviewer")
+    reviewer.grant_permission("cfp_reviewer")
+    proposal = TalkProposal()
+    proposal.title = "Listed talk"
+    proposal.description = "A talk"
+    proposal.user = user
+    proposal.state = "anonymised"
+    db.session.add_all([reviewer, proposal])
+    db.session.commit()
+    db.session.add(ReviewQueueEntry(reviewer.id, proposal.id, 1))
+    db.session.commit()
+
+    client = app.test_client()
+    code = reviewer.login_code(app.config["SECRET_KEY"])
+    client.get("/login?code={}".format(code))
+
+    # Viewing the list doesn't top up a queue with proposals left in it
+    assert client.get("/cfp-review/review").status_code == 200
+    queue = ReviewQueueEntry.query.filter_by(user_id=reviewer.id)
+    assert [e.proposal_id for e in queue] == [proposal.id]
+
+    remove_from_review_queue(reviewer, proposal)
+    db.session.commit()
+    assert client.get("/cfp-review/review").status_code == 200
+    assert proposal.id in [e.proposal_id for e in queue]
+
+
+def test_allowed_slot_masks():
+    proposal = TalkProposal()
+    proposal.available_times = "fri_13_16,sat_10_13"
+    proposal.scheduled_duration = 30
+
+    mask = proposal.allowed_slot_mask
+    assert slots_fit(get_event_slot_mask(datetime(2018, 8, 31, 13, 0), 30), mask)
+    assert slots_fit(get_event_slot_mask(datetime(2018, 8, 31, 15, 30), 30), mask)
+    assert not slots_fit(get_event_slot_mask(datetime(2018, 8, 31, 15, 40), 30), mask)
+    assert not slots_fit(get_event_slot_mask(datetime(2018, 9, 1, 13, 0), 30), mask)
+
+    # Events touching the same slot clash
+    assert get_event_slot_mask(datetime(2018, 8, 31, 13, 0), 30) & get_event_slot_mask(
+        datetime(2018, 8, 31, 13, 20), 30
+    )
+    assert not get_event_slot_mask(
+        datetime(2018, 8, 31, 13, 0), 30
+    ) & get_event_slot_mask(datetime(2018, 8, 31, 13, 30), 30)
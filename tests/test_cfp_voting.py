@@ -6,6 +6,9 @@ from apps.cfp_review.majority_judgement import (
     calculate_score,
     calculate_normalised_score,
     calculate_max_normalised_score,
+    calculate_scores,
+    calculate_max_normalised_scores,
+    get_majority_judgement_order,
     MajorityJudgementException,
 )
 
@@ -62,6 +65,33 @@ def test_calculate_score_2(data):
     calculate_score(score_list, base)
 
 
+def test_get_majority_judgement_order():
+    assert get_majority_judgement_order(0) == ()
+    assert get_majority_judgement_order(1) == (0,)
+    assert get_majority_judgement_order(4) == (1, 2, 0, 3)
+    assert get_majority_judgement_order(5) == (2, 1, 3, 0, 4)
+
+
+@given(data())
+def test_calculate_scores(data):
+    base = data.draw(integers(min_value=2, max_value=36))
+    score_lists = data.draw(
+        lists(lists(integers(min_value=0, max_value=base - 1)), max_size=10)
+    )
+    score_lists = dict(enumerate(score_lists))
+
+    scores = calculate_scores(score_lists, base)
+    normalised_scores = calculate_max_normalised_scores(score_lists, base)
+    for key, score_list in score_lists.items():
+        assert scores.get(key) == calculate_score(score_list, base)
+        assert normalised_scores[key] == calculate_max_normalised_score(
+            score_list, base
+        )
+
+    with pytest.raises(MajorityJudgementException):
+        calculate_scores({1: [0, base]}, base)
+
+
 def test_calculate_normalised_score():
     # Basic tests
     assert calculate_normalised_score([1], 1) == 1
@@ -0,0 +1,22 @@
+import gzip
+import hashlib
+import json
+import os
+
+from apps.base.tasks_export import export_model
+from models.user import User
+
+
+def test_export_model(app, user, tmpdir):
+    path = str(tmpdir)
+    for dirname in ["public", "private"]:
+        os.makedirs(os.path.join(path, dirname))
+
+    tables, checksums = export_model(app, User, path, compress=True)
+    assert tables == ["user"]
+    assert sorted(checksums) == ["private/User.json.gz", "public/User.json.gz"]
+
+    with open(os.path.join(path, "public", "User.json.gz"), "rb") as f:
+        data = f.read()
+    assert hashlib.sha256(data).hexdigest() == checksums["public/User.json.gz"]
+    assert json.loads(gzip.decompress(data)) == {"users": {"count": User.query.count()}}
@@ -0,0 +1,130 @@
+import hashlib
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from models.ical import CalendarSource, refresh_calendar_sources
+
+
+def make_ical(*events):
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "X-WR-CALNAME:Test Village"]
+    for uid, summary in events:
+        lines += [
+            "BEGIN:VEVENT",
+            "UID:{}".format(uid),
+            "SUMMARY:{}".format(summary),
+            "DTSTART:20180831T130000Z",
+            "DTEND:20180831T140000Z",
+            "END:VEVENT",
+        ]
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(lines).encode("utf-8")
+
+
+class CalendarHandler(BaseHTTPRequestHandler):
+    """ Serves .ics files from server.calendars, with ETags """
+
+    def do_GET(self):
+        body = self.server.calendars.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/calendar")
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def ical_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CalendarHandler)
+    server.calendars = {}
+    server.url = "http://127.0.0.1:{}".format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+def test_refresh_calendar_sources(db, ical_server):
+    ical_server.calendars["/a.ics"] = make_ical(
+        ("a1", "Soldering"), ("a2", "Lockpicking")
+    )
+    ical_server.calendars["/b.ics"] = make_ical(("b1", "Karaoke"))
+
+    source_a = CalendarSource(url=ical_server.url + "/a.ics")
+    source_b = CalendarSource(url=ical_server.url + "/b.ics")
+    missing = CalendarSource(url=ical_server.url + "/missing.ics")
+    db.session.add_all([source_a, source_b, missing])
+    db.session.commit()
+
+    results = refresh_calendar_sources([source_a, source_b, missing])
+    db.session.commit()
+
+    assert isinstance(results[missing], Exception)
+    assert source_a.name == "Test Village"
+    assert sorted(e.uid for e in source_a.events) == ["a1", "a2"]
+    assert source_a.events_changed == 2
+    assert source_a.fetch_size > 0
+    assert source_b.events_changed == 1
+
+    # Nothing has changed, so the feeds shouldn't be parsed
+    refresh_calendar_sources([source_a, source_b])
+    assert source_a.events_changed == 0
+    assert source_a.fetch_size == 0
+
+    ical_server.calendars["/a.ics"] = make_ical(("a1", "Advanced soldering"))
+    refresh_calendar_sources([source_a, source_b])
+    db.session.commit()
+
+    events = {e.uid: e for e in source_a.events}
+    assert events["a1"].summary == "Advanced soldering"
+    assert events["a1"].displayed
+    assert not events["a2"].displayed
+    assert source_a.events_changed == 2
+    assert source_b.events_changed == 0
+
+
+def test_refresh_failure_is_rolled_back(db, ical_server, monkeypatch):
+    ical_server.calendars["/c.ics"] = make_ical(("c1", "Soldering"))
+    source = CalendarSource(url=ical_server.url + "/c.ics")
+    db.session.add(source)
+    db.session.commit()
+
+    refresh_calendar_sources([source])
+    db.session.commit()
+    etag = source.etag
+
+    def broken_update(self, ical_text):
+        for event in self.events:
+            event.displayed = False
+        raise ValueError("Broken feed")
+
+    ical_server.calendars["/c.ics"] = make_ical(("c1", "Advanced soldering"))
+    monkeypatch.setattr(CalendarSource, "update_events", broken_update)
+    results = refresh_calendar_sources([source])
+    db.session.commit()
+
+    assert isinstance(results[source], ValueError)
+    assert source.etag == etag
+    assert all(e.displayed for e in source.events)
+
+    # The feed is fetched in full and applied next time
+    monkeypatch.undo()
+    refresh_calendar_sources([source])
+    db.session.commit()
+
+    assert source.etag != etag
+    assert source.events[0].summary == "Advanced soldering"
@@ -0,0 +1,60 @@
+import time
+
+from apps.common.profiler import Sampler, get_stack
+from models.request_profile import RequestProfile
+
+
+def busy_function(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+def test_sampler():
+    from threading import get_ident
+
+    sampler = Sampler(get_ident(), 0.001)
+    sampler.start()
+    busy_function(0.05)
+    sampler.stop()
+
+    assert sum(sampler.stacks.values()) > 0
+    assert any(
+        stack.endswith("tests.test_profiler:busy_function") for stack in sampler.stacks
+    )
+    assert get_stack(None) == ""
+
+
+def test_profile_summary():
+    profile = RequestProfile(
+        stacks={"a:main;b:view;c:query": 3, "a:main;b:view": 1, "a:main;d:render": 2}
+    )
+    assert profile.sample_count == 6
+    assert profile.get_top_frames(3) == [
+        ("a:main", 6, 0),
+        ("b:view", 4, 1),
+        ("c:query", 3, 3),
+    ]
+    assert profile.to_folded() == (
+        "a:main;b:view 1\na:main;b:view;c:query 3\na:main;d:render 2\n"
+    )
+
+
+def test_profile_request(app, client):
+    app.config["PROFILE_TOKEN"] = "profile-me"
+    try:
+        client.get("/about")
+        assert RequestProfile.query.count() == 0
+
+        client.get("/about", headers={"X-Profile-Token": "wrong"})
+        assert RequestProfile.query.count() == 0
+
+        rv = client.get("/about", headers={"X-Profile-Token": "profile-me"})
+        assert rv.status_code == 200
+    finally:
+        del app.config["PROFILE_TOKEN"]
+
+    profile = RequestProfile.query.one()
+    assert profile.path == "/about"
+    assert profile.reason == "token"
+    assert profile.template_duration > 0
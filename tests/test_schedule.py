@@ -0,0 +1,179 @@
+import json
+import pytest
+from datetime import datetime, timedelta
+
+from main import db
+from models.cfp import TalkProposal, Venue
+from models.user import User, generate_api_token
+from apps.schedule import event_tz
+from apps.schedule.upcoming import UpcomingIndex
+from apps.schedule.historic import historic_talk_data, load_historic_schedule
+
+from .test_sql_query_count import QueryLog
+
+
+@pytest.fixture(scope="module")
+def line_up_app(app_with_cache):
+    app_with_cache.config["LINE_UP"] = True
+    yield app_with_cache
+    app_with_cache.config["LINE_UP"] = False
+
+
+@pytest.fixture(scope="module")
+def scheduled(line_up_app):
+    speaker = User("schedule_speaker@example.com", "Speaker")
+    attendee = User("schedule_attendee@example.com", "Attendee")
+    venue = Venue(name="Stage B")
+    db.session.add_all([speaker, attendee, venue])
+
+    proposals = []
+    for i in range(4):
+        proposal = TalkProposal()
+        proposal.title = "Favourite talk {}".format(i)
+        proposal.description = "A talk"
+        proposal.user = speaker
+        proposal.state = "accepted"
+        proposal.scheduled_duration = 30
+        proposal.scheduled_time = datetime(2018, 8, 31, 13, 0) + timedelta(hours=i)
+        proposal.scheduled_venue = venue
+        proposals.append(proposal)
+
+    db.session.add_all(proposals)
+    attendee.favourites.append(proposals[1])
+    attendee.favourites.append(proposals[3])
+    db.session.commit()
+
+    yield attendee, proposals
+
+
+def favourites_url(app, user, fmt):
+    token = generate_api_token(app.config["SECRET_KEY"], user.id)
+    return "/favourites.{}?token={}".format(fmt, token)
+
+
+def test_favourites_json(line_up_app, scheduled):
+    attendee, proposals = scheduled
+    client = line_up_app.test_client()
+
+    rv = client.get(favourites_url(line_up_app, attendee, "json"))
+    assert rv.status_code == 200
+    data = json.loads(rv.get_data(as_text=True))
+
+    assert [e["id"] for e in data] == [proposals[1].id, proposals[3].id]
+    assert all(e["is_fave"] for e in data)
+
+
+def test_favourites_ical(line_up_app, scheduled):
+    attendee, proposals = scheduled
+    client = line_up_app.test_client()
+
+    rv = client.get(favourites_url(line_up_app, attendee, "ical"))
+    assert rv.status_code == 200
+    ical = rv.get_data(as_text=True)
+
+    assert ical.startswith("BEGIN:VCALENDAR")
+    assert ical.rstrip().endswith("END:VCALENDAR")
+    assert ical.count("BEGIN:VEVENT") == 2
+    assert "Favourite talk 3" in ical
+    assert "Favourite talk 0" not in ical
+
+
+def test_favourites_etag(line_up_app, scheduled):
+    attendee, proposals = scheduled
+    client = line_up_app.test_client()
+    url = favourites_url(line_up_app, attendee, "json")
+
+    rv = client.get(url)
+    etag = rv.headers["ETag"]
+
+    with QueryLog() as log:
+        rv = client.get(url, headers={"If-None-Match": etag})
+        assert rv.status_code == 304
+        # Fetching the user and their favourites
+        assert log.count <= 2
+
+    # Other users get a different ETag for the same favourites
+    other = User.query.filter_by(email="schedule_speaker@example.com").one()
+    rv = client.get(favourites_url(line_up_app, other, "json"))
+    assert rv.headers["ETag"] != etag
+
+
+def test_upcoming_favourites(line_up_app, scheduled, monkeypatch):
+    attendee, proposals = scheduled
+    monkeypatch.setitem(line_up_app.config, "SCHEDULE_NOW", "2018-08-31 12:00")
+    url = "/now-and-next.json?venue=Stage%20B&limit=0"
+
+    client = line_up_app.test_client()
+    code = attendee.login_code(line_up_app.config["SECRET_KEY"])
+    client.get("/login?code={}".format(code))
+    data = json.loads(client.get(url).get_data(as_text=True))
+    assert [e["id"] for e in data] == [p.id for p in proposals]
+    assert [e["is_fave"] for e in data] == [False, True, False, True]
+
+    # The upcoming index is shared, so favourites mustn't leak to other users
+    data = json.loads(line_up_app.test_client().get(url).get_data(as_text=True))
+    assert not any(e["is_fave"] for e in data)
+
+
+def make_event(id, venue, start, minutes):
+    start = event_tz.localize(start)
+    return {
+        "id": id,
+        "venue": venue,
+        "title": "Event {}".format(id),
+        "start_date": start,
+        "end_date": start + timedelta(minutes=minutes),
+    }
+
+
+def test_upcoming_index():
+    day = datetime(2018, 8, 31)
+    schedule = [
+        make_event(1, "Stage A", day.replace(hour=10), 60),
+        make_event(2, "Stage A", day.replace(hour=11), 30),
+        make_event(3, "Stage A", day.replace(hour=12), 30),
+        # A long event which overlaps the rest of the venue
+        make_event(4, "Stage B", day.replace(hour=9), 8 * 60),
+        make_event(5, "Stage B", day.replace(hour=11), 30),
+        make_event(6, "Stage B", day.replace(hour=14), 30),
+        make_event(7, "Stage C", day.replace(hour=9), 30),
+    ]
+    index = UpcomingIndex(schedule)
+
+    now = event_tz.localize(day.replace(hour=11, minute=10))
+    res = index.upcoming(now, limit=2)
+    assert {k: [e["id"] for e in v] for k, v in res.items()} == {
+        "stage-a": [2, 3],
+        "stage-b": [4, 5],
+    }
+    assert res["stage-a"][0]["start_time"] == "11:00"
+
+    res = index.upcoming(now, venues=["Stage B"], limit=5)
+    assert {k: [e["id"] for e in v] for k, v in res.items()} == {"stage-b": [4, 5, 6]}
+
+    res = index.upcoming(now, limit=0)
+    assert [e["id"] for e in res] == [4, 2, 5, 3, 6]
+
+    # Check against filtering the whole schedule at every minute
+    for minute in range(0, 10 * 60, 7):
+        now = event_tz.localize(day.replace(hour=8) + timedelta(minutes=minute))
+        expected = sorted(
+            (e for e in schedule if e["end_date"] > now), key=lambda e: e["start_date"]
+        )
+        res = index.upcoming(now, limit=0)
+        assert [e["id"] for e in res] == [e["id"] for e in expected]
+
+
+def test_historic_talk_data():
+    data = historic_talk_data(2018)
+    # Parsed once and then cached
+    assert historic_talk_data(2018) is data
+
+    for venue in data["venues"]:
+        titles = [e["title"] for e in venue["events"]]
+        assert len(titles) == len(set(titles))
+        assert all(isinstance(e["start_date"], datetime) for e in venue["events"])
+
+    schedule = load_historic_schedule(2018)
+    event = data["venues"][0]["events"][0]
+    assert schedule[event["id"]]["title"] == event["title"]
@@ -0,0 +1,50 @@
+import pendulum
+from sqlalchemy import func, select
+
+from main import db
+from models import scheduled_task
+from models.scheduled_task import (
+    ScheduledTask,
+    ScheduledTaskResult,
+    execute_scheduled_tasks,
+)
+
+
+def answer():
+    return 42
+
+
+def fail():
+    raise ValueError("Task failed")
+
+
+def get_results(task):
+    return ScheduledTaskResult.query.filter_by(name=task.name).all()
+
+
+def test_execute_scheduled_tasks(app, monkeypatch):
+    tasks = [
+        ScheduledTask(answer, pendulum.duration(minutes=1)),
+        ScheduledTask(fail, pendulum.duration(minutes=1)),
+    ]
+    monkeypatch.setattr(scheduled_task, "tasks", tasks)
+
+    # Another runner has the first task
+    with db.engine.connect() as lock:
+        with lock.begin():
+            lock.execute(select([func.pg_advisory_xact_lock(tasks[0].lock_id)]))
+            execute_scheduled_tasks()
+
+    assert get_results(tasks[0]) == []
+    [result] = get_results(tasks[1])
+    assert result.result["exception"] == "ValueError('Task failed')"
+
+    execute_scheduled_tasks()
+    [result] = get_results(tasks[0])
+    assert result.result["returnval"] == 42
+    assert result.result["lag"] >= 0
+
+    # Neither is due again yet
+    execute_scheduled_tasks()
+    assert len(get_results(tasks[0])) == 1
+    assert len(get_results(tasks[1])) == 1
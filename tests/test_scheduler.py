@@ -0,0 +1,53 @@
+from apps.cfp.scheduler import (
+    get_neighbourhood,
+    get_schedule_quality,
+    is_placed,
+    schedule_incremental,
+)
+from apps.cfp.scheduler_benchmark import generate_problem
+
+
+def test_generate_problem():
+    data = generate_problem(talk_count=50, venue_count=2, seed=1)
+    assert len(data) == 50
+    assert any(is_placed(e) for e in data)
+
+    # Placing everything where it already is shouldn't count as moving
+    quality = get_schedule_quality(data, data)
+    assert quality["moved"] == 0
+    assert quality["unscheduled"] == len([e for e in data if not is_placed(e)])
+
+
+def test_incremental_schedule(app):
+    data = generate_problem(talk_count=30, venue_count=2, seed=2)
+    changed = next(e for e in data if is_placed(e))
+
+    assert get_neighbourhood(data, {changed["id"]}, 0) == {changed["id"]}
+    neighbours = get_neighbourhood(data, {changed["id"]}, 1)
+    assert changed["id"] in neighbours
+    assert len(neighbours) > 1
+    assert get_neighbourhood(data, {changed["id"]}, None) == {e["id"] for e in data}
+
+    problems = []
+
+    def solve(problem):
+        problems.append(problem)
+        # Pretend the changed talk can only be fitted in with its neighbours free
+        if len(problems) == 1:
+            raise Exception("Infeasible")
+        return problem
+
+    progress = []
+    schedule, quality = schedule_incremental(
+        solve, data, {changed["id"]}, progress=lambda *args: progress.append(args)
+    )
+
+    assert schedule is problems[1]
+    assert quality["moved"] == 0
+    assert len(progress) == 2
+    assert progress[0][3] is None
+
+    # Only the changed talk was free in the first attempt
+    pinned = [e for e in problems[0] if is_placed(e) and e["id"] != changed["id"]]
+    assert all(e["valid_venues"] == [e["venue"]] for e in pinned)
+    assert problems[0][data.index(changed)] is changed
@@ -1,16 +1,26 @@
+import os
+
 import pytest
 import sqlalchemy
+import yaml
+from datetime import datetime, timedelta
+
 from main import db
+from models import event_year
+from models.basket import Basket
+from models.cfp import TalkProposal, Venue
+from models.product import PriceTier
+from models.user import User, UserDiversity
+from apps.common.query_stats import QueryStats
+from apps.schedule.data import refresh_schedule_cache
 
+with open(os.path.join(os.path.dirname(__file__), "query_budgets.yaml")) as f:
+    BUDGETS = yaml.safe_load(f)
 
-class QueryLog:
-    def __init__(self):
-        self.count = 0
-        self.queries = []
 
+class QueryLog(QueryStats):
     def _query_callback(self, _conn, _cur, query, params, *_):
-        self.count += 1
-        self.queries.append(query)
+        self.record(query, 0)
 
     def __enter__(self):
         sqlalchemy.event.listen(
@@ -27,13 +37,100 @@ class QueryLog:
         return "<SQLAlchemy Query Logger>"
 
 
-@pytest.mark.parametrize("url,queries", [("/tickets", 2), ("/", 0)])
+def check_budget(client, url, queries):
+    """ Fetch url and check it stays within its budget, returning the log """
+    with QueryLog() as log:
+        rv = client.get(url)
+        assert rv.status_code == 200, f"Fetching {url} results in HTTP 200"
+
+    assert log.count <= queries, f"{url} query count"
+    assert not log.repeated(BUDGETS["repeated_query_limit"]), f"{url} repeats queries"
+    return log
+
+
+@pytest.mark.parametrize("url,queries", BUDGETS["anonymous"].items())
 def test_query_count(app_with_cache, url, queries):
     """ Test how many SQL queries a page generates. """
     client = app_with_cache.test_client()
     client.get(url)  # Initial fetch to fill caches
 
-    with QueryLog() as log:
-        rv = client.get(url)
-        assert rv.status_code == 200, f"Fetching {url} results in HTTP 200"
-        assert log.count <= queries, f"{url} query count"
+    check_budget(client, url, queries)
+
+
+@pytest.fixture(scope="module")
+def logged_in_client(app_with_cache):
+    user = User.query.filter_by(email="budget@example.com").one_or_none()
+    if not user:
+        user = User("budget@example.com", "Budget User")
+        user.diversity = UserDiversity()
+        user.grant_permission("arrivals")
+        db.session.add(user)
+        db.session.commit()
+
+        basket = Basket(user, "GBP")
+        basket[PriceTier.query.filter_by(name="full-std").one()] = 1
+        basket.create_purchases()
+        db.session.commit()
+        basket.purchases[0].set_state("paid")
+        db.session.commit()
+
+    client = app_with_cache.test_client()
+    code = user.login_code(app_with_cache.config["SECRET_KEY"])
+    client.get(f"/login?code={code}")
+    yield client
+
+
+@pytest.mark.parametrize("url,queries", BUDGETS["logged_in"].items())
+def test_logged_in_query_count(logged_in_client, url, queries):
+    logged_in_client.get(url)  # Initial fetch to fill caches
+
+    check_budget(logged_in_client, url, queries)
+
+
+def add_scheduled_proposals(db, user, venue, count):
+    start = datetime(2018, 8, 31, 13, 0)
+    for i in range(count):
+        proposal = TalkProposal()
+        proposal.title = "Scheduled talk {}".format(i)
+        proposal.description = "A talk"
+        proposal.user = user
+        proposal.state = "accepted"
+        proposal.scheduled_duration = 30
+        proposal.scheduled_time = start + timedelta(minutes=40 * i)
+        proposal.scheduled_venue = venue
+        db.session.add(proposal)
+
+    db.session.commit()
+
+
+@pytest.fixture(scope="module")
+def schedule_app(app_with_cache):
+    app_with_cache.config["SCHEDULE"] = True
+    yield app_with_cache
+    app_with_cache.config["SCHEDULE"] = False
+
+
+@pytest.mark.parametrize("url,queries", BUDGETS["schedule"].items())
+def test_schedule_query_count(schedule_app, url, queries):
+    """ The number of queries to build the schedule shouldn't depend on its size. """
+    url = url.format(year=event_year())
+    client = schedule_app.test_client()
+
+    user = User.query.filter_by(email="speaker@example.com").one_or_none()
+    if not user:
+        user = User("speaker@example.com", "Speaker")
+        venue = Venue(name="Stage A")
+        db.session.add_all([user, venue])
+        add_scheduled_proposals(db, user, venue, 3)
+    venue = Venue.query.filter_by(name="Stage A").one()
+
+    # The schedule itself is cached, so measure the cost of building it
+    client.get(url)  # Initial fetch to fill caches
+    refresh_schedule_cache()
+    small_log = check_budget(client, url, queries)
+
+    add_scheduled_proposals(db, user, venue, 10)
+    refresh_schedule_cache()
+
+    large_log = check_budget(client, url, queries)
+    assert large_log.count == small_log.count, f"{url} query count grows with schedule"
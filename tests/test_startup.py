@@ -0,0 +1,66 @@
+import os
+
+from main import LazyModule, LazyClient, db, warm_app, init_worker
+from apps.base.startup_benchmark import parse_import_times, measure_startup
+
+
+def test_lazy_module():
+    module = LazyModule("json.tool")
+    configured = []
+    module.configure(configured.append)
+    assert module._module is None
+
+    # Attributes of the real module, and its submodules, load it
+    assert module.main.__module__ == "json.tool"
+    assert configured == [module._module]
+
+    # Later configuration is applied straight away
+    module.configure(configured.append)
+    assert len(configured) == 2
+
+    assert LazyModule("xml").dom.__name__ == "xml.dom"
+
+
+def test_lazy_client():
+    created = []
+    client = LazyClient()
+    client.configure(lambda: created.append(1) or "client")
+
+    assert created == []
+    assert client.upper() == "CLIENT"
+    assert client.lower() == "client"
+    assert created == [1]
+
+
+def test_parse_import_times():
+    output = "\n".join(
+        [
+            "import time: self [us] | cumulative | imported package",
+            "import time:       120 |        120 |     flask.json",
+            "import time:       318 |        960 |   flask",
+            "import time:      1500 |       2500 | main",
+        ]
+    )
+    assert parse_import_times(output) == {"main": 0.0025}
+
+
+def test_startup_is_lazy():
+    result = measure_startup(os.getcwd())
+    assert result["lazy_modules_loaded"] == []
+    assert result["max_rss_kb"] > 0
+    assert "main" in result["import_times"]
+
+
+def test_warm_app(app):
+    warm_app(app)
+    assert len(app.jinja_env.cache) >= len(app.jinja_loader.list_templates())
+
+
+def test_init_worker(app):
+    # Connections kept for the parent aren't closed, so mustn't hold locks
+    db.session.close()
+    pool = db.engine.pool
+    init_worker(app)
+
+    assert db.engine.pool is not pool
+    assert db.session.execute("SELECT 1").scalar() == 1
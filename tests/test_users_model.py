@@ -1,11 +1,16 @@
+from time import perf_counter
+
 from models.user import User
 from models.user import (
     generate_login_code,
     verify_login_code,
     generate_api_token,
+    verify_api_token,
     generate_sso_code,
     generate_checkin_code,
     verify_checkin_code,
+    verify_unlimited_hmac,
+    verify_unlimited_short_hmac,
 )
 
 
@@ -76,6 +81,35 @@ def test_verify_checkin_code():
     assert bad_code_result is None
 
 
+def verifications_per_second(verify, key, codes):
+    start = perf_counter()
+    for uid, code in enumerate(codes, 1):
+        assert verify(key, code) == uid
+    return len(codes) / (perf_counter() - start)
+
+
+def test_verify_cache(record_property):
+    key = "abc"
+    for generate, verify, cached in [
+        (generate_checkin_code, verify_checkin_code, verify_unlimited_short_hmac),
+        (generate_api_token, verify_api_token, verify_unlimited_hmac),
+    ]:
+        codes = [generate(key, uid) for uid in range(1, 1001)]
+        cached.cache_clear()
+
+        uncached_rate = verifications_per_second(verify, key, codes)
+        assert cached.cache_info().hits == 0
+        assert cached.cache_info().misses == len(codes)
+
+        cached_rate = verifications_per_second(verify, key, codes)
+        assert cached.cache_info().hits == len(codes)
+        assert cached.cache_info().misses == len(codes)
+
+        # Timings vary too much on CI to assert on, so they're only reported
+        record_property(verify.__name__ + "_per_second", int(uncached_rate))
+        record_property(verify.__name__ + "_cached_per_second", int(cached_rate))
+
+
 def test_get_user_by_email(user):
     assert User.get_by_email(email=user.email) == user
 
@@ -1,5 +1,9 @@
 from werkzeug.middleware.proxy_fix import ProxyFix
-from main import create_app
+from main import create_app, warm_app
+
+# This is shared between workers, see post_fork in gunicorn.py
+flask_app = create_app()
+warm_app(flask_app)
 
 # ProxyFix handles the X-Forwarded-For and X-Forwarded-Proto headers
-app = ProxyFix(create_app())
+app = ProxyFix(flask_app)